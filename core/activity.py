@@ -0,0 +1,182 @@
+"""
+Activity logging service.
+
+``log_activity`` replaces direct ``ActivityLog.objects.create`` calls in
+request handlers. ``settings.ACTIVITY_LOG_BACKEND`` selects how the event is
+written:
+
+``sync`` (default)
+    One INSERT per event, inside the caller (the old behaviour).
+``buffered``
+    Events are queued in an in-process buffer and written with
+    ``bulk_create`` when ``ACTIVITY_LOG_BUFFER_SIZE`` events are waiting or
+    ``ACTIVITY_LOG_FLUSH_INTERVAL`` seconds after the first queued event.
+``celery``
+    Buffered the same way, but each flush hands the batch to the
+    ``write_activity_logs`` task, so with several web processes the writes
+    happen in the workers.
+
+The buffers are flushed at interpreter exit and when a Celery worker
+process shuts down, so queued events are not dropped on a clean shutdown.
+A crash still loses them, so the payment audit events in ``AUDIT_ACTIONS``
+are always written synchronously.
+"""
+import atexit
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from .dashboard_cache import invalidate_dashboard
+from .models import ActivityLog
+
+logger = logging.getLogger(__name__)
+
+# Never buffered, whatever the backend
+AUDIT_ACTIONS = frozenset({'payment_initiated', 'payment_success', 'payment_failed', 'payment_cancelled'})
+
+
+def _write_to_database(events):
+    ActivityLog.objects.bulk_create([ActivityLog(**event) for event in events])
+    invalidate_dashboard([event['user_id'] for event in events], 'activity')
+
+
+def _write_to_celery(events):
+    from .tasks import write_activity_logs
+
+    write_activity_logs.delay([
+        {**event, 'timestamp': event['timestamp'].isoformat()} for event in events
+    ])
+
+
+class ActivityLogBuffer:
+    """Thread-safe event buffer flushed by size or age through ``writer``"""
+
+    def __init__(self, writer, max_size, flush_interval):
+        self.writer = writer
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self._events = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, event):
+        with self._lock:
+            self._events.append(event)
+            if len(self._events) >= self.max_size:
+                batch = self._take()
+            else:
+                batch = None
+                if self._timer is None and self.flush_interval > 0:
+                    self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if batch:
+            self._write(batch)
+
+    def flush(self):
+        """Write every queued event now; returns the number written"""
+        with self._lock:
+            batch = self._take()
+        if batch and self._write(batch):
+            return len(batch)
+        return 0
+
+    def _take(self):
+        # Caller holds the lock
+        batch, self._events = self._events, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _write(self, batch):
+        try:
+            self.writer(batch)
+            return True
+        except Exception:
+            logger.exception("Failed to write %d activity events; keeping them for the next flush", len(batch))
+            with self._lock:
+                self._events[:0] = batch
+                # Don't grow without bound while the database is unavailable
+                overflow = len(self._events) - self.max_size * 10
+                if overflow > 0:
+                    logger.error("Dropping %d oldest activity events", overflow)
+                    del self._events[:overflow]
+            return False
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # The timer thread got its own connection; close it even when
+            # CONN_MAX_AGE would keep it, since this thread never runs again
+            connections.close_all()
+
+
+_buffers = {}
+_buffers_lock = threading.Lock()
+
+_WRITERS = {
+    'buffered': _write_to_database,
+    'celery': _write_to_celery,
+}
+
+
+def get_buffer(backend):
+    """Return the process-wide buffer for a buffered backend"""
+    with _buffers_lock:
+        buffer = _buffers.get(backend)
+        if buffer is None:
+            buffer = ActivityLogBuffer(
+                _WRITERS[backend],
+                max_size=settings.ACTIVITY_LOG_BUFFER_SIZE,
+                flush_interval=settings.ACTIVITY_LOG_FLUSH_INTERVAL,
+            )
+            _buffers[backend] = buffer
+        return buffer
+
+
+def log_activity(user, action, metadata=None):
+    """Record an activity event for ``user`` (a User or a user id)"""
+    user_id = getattr(user, 'pk', user)
+    backend = settings.ACTIVITY_LOG_BACKEND
+    if backend == 'sync' or action in AUDIT_ACTIONS:
+        ActivityLog.objects.create(user_id=user_id, action=action, metadata=metadata)
+        invalidate_dashboard(user_id, 'activity')
+        return
+    get_buffer(backend).add({
+        'user_id': user_id,
+        'action': action,
+        'metadata': metadata,
+        'timestamp': timezone.now(),
+    })
+
+
+async def alog_activity(user, action, metadata=None):
+    """Async wrapper around ``log_activity`` for async views"""
+    await sync_to_async(log_activity)(user, action, metadata)
+
+
+def flush_activity_logs():
+    """Flush every buffered backend; returns the number of events written"""
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    return sum(buffer.flush() for buffer in buffers)
+
+
+atexit.register(flush_activity_logs)
+
+
+@worker_process_shutdown.connect
+def _flush_on_worker_shutdown(**kwargs):
+    flush_activity_logs()
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import FileUpload, PaymentTransaction, ActivityLog
+from .models import FileUpload, PaymentTransaction, ActivityLog, ChunkedUpload
 
 # Unregister the default User admin
 admin.site.unregister(User)
@@ -35,7 +35,7 @@ class FileUploadAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'filename', 'upload_time', 'status', 'word_count', 'get_file_size')
     list_filter = ('status', 'upload_time', 'user')
     search_fields = ('filename', 'user__username')
-    readonly_fields = ('id', 'user', 'filename', 'upload_time', 'status', 'word_count', 'file')
+    readonly_fields = ('id', 'user', 'filename', 'upload_time', 'status', 'word_count', 'text_stats', 'file')
     date_hierarchy = 'upload_time'
     ordering = ('-upload_time',)
     
@@ -44,10 +44,13 @@ class FileUploadAdmin(admin.ModelAdmin):
             'fields': ('user', 'file', 'filename', 'upload_time')
         }),
         ('Processing Status', {
-            'fields': ('status', 'word_count', 'error_message')
+            'fields': ('status', 'word_count', 'text_stats', 'error_message')
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('preview')
+    
     def get_file_size(self, obj):
         """Display file size in human readable format"""
         if obj.file:
@@ -147,6 +150,21 @@ class ActivityLogAdmin(admin.ModelAdmin):
         js = ('admin/js/metadata_viewer.js',)
 
 
+@admin.register(ChunkedUpload)
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'filename', 'received_bytes', 'total_size', 'status', 'updated_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('filename', 'user__username')
+    readonly_fields = ('id', 'user', 'filename', 'total_size', 'received_bytes', 'status', 'file_upload', 'created_at', 'updated_at')
+    ordering = ('-created_at',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # # Custom admin site configuration
 # admin.site.site_header = 'Payment & File Upload System'
 # admin.site.site_title = 'Payment & File Upload Admin'
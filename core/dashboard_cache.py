@@ -0,0 +1,62 @@
+"""
+Per-user cache state for the dashboard page.
+
+Each dashboard section (files, payments, activity) is rendered inside a
+``{% cache %}`` fragment keyed on a per-user version stamp. Anything that
+changes a section calls ``invalidate_dashboard`` with the affected user ids
+and sections, which moves the stamp and makes the next render miss.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+SECTIONS = ('files', 'payments', 'activity')
+
+
+def _version_key(section, user_id):
+    return f'dashboard:{section}:{user_id}'
+
+
+def _token_key(user_id):
+    return f'dashboard:auth-token:{user_id}'
+
+
+def get_dashboard_versions(user_id):
+    """Return ``{section: version}`` for a user, creating missing stamps"""
+    keys = {_version_key(section, user_id): section for section in SECTIONS}
+    found = cache.get_many(keys)
+    versions = {keys[key]: value for key, value in found.items()}
+    missing = {key: time.time_ns() for key, section in keys.items() if section not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update({keys[key]: value for key, value in missing.items()})
+    return versions
+
+
+def invalidate_dashboard(user_ids, *sections):
+    """Move the version stamp of ``sections`` (default: all) for each user id"""
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    stamp = time.time_ns()
+    cache.set_many(
+        {_version_key(section, user_id): stamp for user_id in set(user_ids) for section in (sections or SECTIONS)},
+        None,
+    )
+
+
+def get_auth_token_key(user):
+    """Return the user's API token key, creating the token on first use"""
+    key = cache.get(_token_key(user.pk))
+    if key is None:
+        token, created = Token.objects.get_or_create(user=user)
+        key = token.key
+        cache.set(_token_key(user.pk), key, None)
+    return key
+
+
+@receiver(post_delete, sender=Token)
+def _forget_deleted_token(sender, instance, **kwargs):
+    cache.delete(_token_key(instance.user_id))
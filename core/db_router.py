@@ -0,0 +1,49 @@
+"""
+Read-replica routing.
+
+Replicas are listed in ``settings.DATABASE_REPLICAS`` (built from the
+``DB_REPLICAS`` environment variable). Reads only go to one where a view has
+opted in, either for a whole request with ``replica_reads()`` (the read-only
+viewsets) or for a single queryset with ``.using(read_replica())`` (the
+dashboard listings). Everything else, including every write, uses the
+primary, so a request that has just written never reads a lagging copy.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def read_replica():
+    """Alias of a replica to read from, or the primary when none is configured"""
+    replicas = settings.DATABASE_REPLICAS
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    """Route ORM reads inside the block to a replica"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return read_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so an instance read from a replica is still saved to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
@@ -0,0 +1,51 @@
+"""
+Cached "has this user paid" checks.
+
+Uploads and the dashboard ask this on every request, so the answer is kept
+in Django's cache once a successful payment is seen. Only positive answers
+are cached: an unpaid user may pay at any moment (possibly handled by
+another process), while a paid user stays paid unless a callback flips the
+transaction, in which case ``revoke_entitlement`` drops the entry.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import PaymentTransaction
+
+
+def _cache_key(user_id):
+    return f'entitlement:paid:{user_id}'
+
+
+def is_entitlement_cached(user_id):
+    """Return True if the user is already known to have paid, without a query"""
+    return bool(cache.get(_cache_key(user_id)))
+
+
+def has_successful_payment(user, recent_payments=None):
+    """
+    Return True if ``user`` has a successful payment, hitting the database at most once.
+
+    ``recent_payments`` may be the user's already-fetched latest payments;
+    a success among them answers the question without another query.
+    """
+    if is_entitlement_cached(user.pk):
+        return True
+    
+    if recent_payments is not None and any(p.status == 'success' for p in recent_payments):
+        paid = True
+    else:
+        paid = PaymentTransaction.objects.filter(user=user, status='success').exists()
+    if paid:
+        grant_entitlement(user.pk)
+    return paid
+
+
+def grant_entitlement(user_id):
+    """Record that a user has paid, e.g. right after a success callback"""
+    cache.set(_cache_key(user_id), True, settings.ENTITLEMENT_CACHE_TIMEOUT)
+
+
+def revoke_entitlement(user_id):
+    """Forget the cached answer so the next check goes back to the database"""
+    cache.delete(_cache_key(user_id))
@@ -0,0 +1,70 @@
+"""
+File status events for the server-sent-events stream.
+
+Publishers (the upload view and the word-count tasks) append events to a
+per-user log in Django's cache: a sequence counter plus one key per event.
+``/api/file-events/`` streams the log to the browser and resumes from the
+``Last-Event-ID`` header after a reconnect. The cache must be shared (e.g.
+Redis) when Celery workers and web servers run as separate processes.
+"""
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def _seq_key(user_id):
+    return f'file-events:{user_id}:seq'
+
+
+def _event_key(user_id, seq):
+    return f'file-events:{user_id}:{seq}'
+
+
+def _next_seq(user_id):
+    key = _seq_key(user_id)
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # The counter was evicted between add() and incr()
+        cache.set(key, 1, None)
+        return 1
+
+
+def publish_file_status(file_uploads):
+    """Publish the current status of one or more uploads to their owners' streams"""
+    if isinstance(file_uploads, (list, tuple)):
+        uploads = file_uploads
+    else:
+        uploads = [file_uploads]
+    events = {}
+    for upload in uploads:
+        seq = _next_seq(upload.user_id)
+        events[_event_key(upload.user_id, seq)] = {
+            'id': upload.id,
+            'status': upload.status,
+            'word_count': upload.word_count,
+        }
+    cache.set_many(events, settings.FILE_STATUS_EVENT_TTL)
+
+
+def cache_is_shared():
+    """Whether events published by worker processes can reach the web processes"""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def latest_event_id(user_id):
+    return cache.get(_seq_key(user_id), 0)
+
+
+def read_events(user_id, after):
+    """Return ``[(seq, event), ...]`` published for a user after sequence ``after``"""
+    latest = latest_event_id(user_id)
+    if latest <= after:
+        return []
+    # Never replay more than the backlog limit, even after a long disconnect
+    first = max(after + 1, latest - settings.FILE_STATUS_EVENT_BACKLOG + 1)
+    keys = {_event_key(user_id, seq): seq for seq in range(first, latest + 1)}
+    found = cache.get_many(keys)
+    return [(keys[key], found[key]) for key in keys if key in found]
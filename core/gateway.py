@@ -0,0 +1,126 @@
+"""
+HTTP clients for the aamarPay gateway.
+
+Both the sync and the async client are shared and keep connections alive,
+so each payment reuses an open TCP+TLS connection instead of doing a fresh
+handshake. Pool sizes and timeouts come from ``settings.AAMARPAY_HTTP``.
+
+The async client only lives on an event loop that outlives requests: the
+ASGI server's loop, registered at lifespan startup and closed at shutdown
+(see ``payment_file_upload/asgi.py``). Under WSGI each async view runs on a
+fresh loop, so there the async path uses the sync session in a thread.
+"""
+import asyncio
+import threading
+import weakref
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_lock = threading.Lock()
+
+# One async client per event loop; a client cannot be shared across loops
+_async_clients = weakref.WeakKeyDictionary()
+
+# Event loops that serve many requests and close their client on shutdown
+_serving_loops = weakref.WeakSet()
+
+
+def build_payment_payload(user, transaction_id):
+    """Build the jsonpost.php request body for a payment"""
+    config = settings.AAMARPAY_CONFIG
+    return {
+        'store_id': config['store_id'],
+        'signature_key': config['signature_key'],
+        'tran_id': transaction_id,
+        'success_url': config['success_url'],
+        'fail_url': config['fail_url'],
+        'cancel_url': config['cancel_url'],
+        'amount': config['amount'],
+        'currency': config['currency'],
+        'desc': 'Payment for file upload service',
+        'cus_name': user.get_full_name() or user.username,
+        'cus_email': user.email or 'test@example.com',
+        'cus_phone': '01800000000',
+        'type': 'json',
+        'cus_add1': 'Dhaka',
+        'cus_city': 'Dhaka',
+        'cus_country': 'Bangladesh',
+        'cus_postcode': '1000',
+    }
+
+
+def get_session():
+    """Return the process-wide keep-alive ``requests`` session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                http = settings.AAMARPAY_HTTP
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=http['max_keepalive_connections'],
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def post_payment(payload):
+    """Send a payment request to aamarPay, blocking until it answers"""
+    http = settings.AAMARPAY_HTTP
+    return get_session().post(
+        settings.AAMARPAY_CONFIG['endpoint'],
+        json=payload,
+        timeout=(http['connect_timeout'], http['read_timeout']),
+    )
+
+
+def get_async_client():
+    """Return the pooled ``httpx.AsyncClient`` bound to the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        http = settings.AAMARPAY_HTTP
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                http['read_timeout'],
+                connect=http['connect_timeout'],
+                pool=http['pool_timeout'],
+            ),
+            limits=httpx.Limits(
+                max_connections=http['max_connections'],
+                max_keepalive_connections=http['max_keepalive_connections'],
+                keepalive_expiry=http['keepalive_expiry'],
+            ),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def start_async_clients():
+    """Let the running loop keep a pooled async client until ``aclose_clients``"""
+    _serving_loops.add(asyncio.get_running_loop())
+
+
+async def apost_payment(payload):
+    """Send a payment request to aamarPay without blocking the event loop"""
+    if asyncio.get_running_loop() not in _serving_loops:
+        # A client made on a per-request loop would never be closed
+        return await sync_to_async(post_payment, thread_sensitive=False)(payload)
+    return await get_async_client().post(settings.AAMARPAY_CONFIG['endpoint'], json=payload)
+
+
+async def aclose_clients():
+    """Close the async client of the running loop, e.g. on server shutdown"""
+    loop = asyncio.get_running_loop()
+    _serving_loops.discard(loop)
+    client = _async_clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,178 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from core.models import PaymentTransaction
+from core.simulator import GatewaySimulator, parse_outcomes
+
+ENDPOINTS = {
+    'sync': '/api/initiate-payment/',
+    'async': '/api/initiate-payment-async/',
+}
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(latencies, elapsed, errors):
+    """Throughput and latency percentiles (in ms) for one phase"""
+    ordered = sorted(latencies)
+    stats = {
+        'requests': len(ordered),
+        'errors': errors,
+        'requests_per_second': len(ordered) / elapsed if elapsed else None,
+    }
+    for q in (50, 95, 99):
+        value = percentile(ordered, q)
+        stats[f'p{q}_ms'] = None if value is None else value * 1000
+    return stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive payment initiation and gateway callbacks end to end against an "
+        "in-process app server and the gateway simulator, and report latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='sync')
+        parser.add_argument('--latency', type=float, default=0.05, help="Simulated gateway latency in seconds")
+        parser.add_argument('--jitter', type=float, default=0.0)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--outcomes', default='success=8,failed=1,cancelled=1')
+        parser.add_argument(
+            '--callback-delay', type=float, default=0.0,
+            help="Seconds between an accepted payment and its gateway callback",
+        )
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark user and its rows")
+
+    def handle(self, *args, **options):
+        try:
+            outcomes = parse_outcomes(options['outcomes'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        user = User.objects.create_user(f'payment-benchmark-{uuid.uuid4().hex[:8]}')
+        token = Token.objects.create(user=user)
+        app_server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+        app_server.set_app(get_internal_wsgi_application())
+        app_url = f'http://127.0.0.1:{app_server.server_address[1]}'
+        threading.Thread(target=app_server.serve_forever, daemon=True).start()
+
+        simulator = GatewaySimulator(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            outcomes=outcomes,
+            callback_delay=options['callback_delay'],
+            seed=options['seed'],
+        )
+        gateway_settings = override_settings(AAMARPAY_CONFIG={
+            **settings.AAMARPAY_CONFIG,
+            'endpoint': simulator.url,
+            'success_url': f'{app_url}/api/payment/success/',
+            'fail_url': f'{app_url}/api/payment/fail/',
+            'cancel_url': f'{app_url}/api/payment/cancel/',
+        })
+        try:
+            with simulator, gateway_settings:
+                report = self.run(options, app_url, token.key, simulator)
+            report['unsettled'] = PaymentTransaction.objects.filter(
+                user=user, status='pending', gateway_response__result='true'
+            ).count()
+        finally:
+            app_server.shutdown()
+            app_server.server_close()
+            if not options['keep']:
+                user.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+    def run(self, options, app_url, token_key, simulator):
+        local = threading.local()
+
+        def initiate(_):
+            # One keep-alive session per client thread
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.headers['Authorization'] = f'Token {token_key}'
+            started = time.perf_counter()
+            response = local.session.post(app_url + ENDPOINTS[options['endpoint']], timeout=60)
+            return response.status_code, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(initiate, range(options['payments'])))
+        initiate_elapsed = time.perf_counter() - started
+
+        # Callbacks start while payments are still being initiated; their
+        # throughput is measured over the whole run
+        completed = simulator.wait_for_callbacks(options['payments'] - simulator.errors)
+        total_elapsed = time.perf_counter() - started
+
+        callbacks = list(simulator.callbacks)
+        return {
+            'endpoint': ENDPOINTS[options['endpoint']],
+            'payments': options['payments'],
+            'concurrency': options['concurrency'],
+            'gateway_latency_ms': options['latency'] * 1000,
+            'gateway_errors': simulator.errors,
+            'callbacks_completed': completed,
+            'initiate': summarize(
+                [latency for _, latency in results],
+                initiate_elapsed,
+                sum(1 for code, _ in results if code != 200),
+            ),
+            'callbacks': summarize(
+                [latency for *_, latency in callbacks],
+                total_elapsed,
+                sum(1 for _, _, code, _ in callbacks if code != 302),
+            ),
+            'outcomes': {
+                name: sum(1 for _, outcome, _, _ in callbacks if outcome == name)
+                for name in simulator.outcomes
+            },
+        }
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['payments']} payments to {report['endpoint']} at concurrency "
+            f"{report['concurrency']}, gateway latency {report['gateway_latency_ms']:.0f}ms"
+        )
+        for phase in ('initiate', 'callbacks'):
+            stats = report[phase]
+            if not stats['requests']:
+                continue
+            self.stdout.write(
+                f"  {phase:<9} {stats['requests']:>6} req  {stats['requests_per_second']:>8.1f} req/s  "
+                f"p50 {stats['p50_ms']:>7.1f}ms  p95 {stats['p95_ms']:>7.1f}ms  "
+                f"p99 {stats['p99_ms']:>7.1f}ms  errors {stats['errors']}"
+            )
+        outcomes = ', '.join(f'{name} {count}' for name, count in report['outcomes'].items())
+        self.stdout.write(f"  outcomes: {outcomes}; gateway errors {report['gateway_errors']}; "
+                          f"unsettled {report['unsettled']}")
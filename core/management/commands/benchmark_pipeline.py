@@ -0,0 +1,385 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import ExitStack, contextmanager
+
+import celery
+import django
+from celery.contrib.testing.worker import start_worker
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from core.models import FileUpload, PaymentTransaction
+from payment_file_upload.celery_app import app
+
+SCHEMA_VERSION = 2
+TASK_NAME = 'core.tasks.process_file_word_count_with_content'
+
+# Single-request uploads are capped at 10MB by FileUploadSerializer
+MAX_SIZE = 10 * 1024 * 1024
+
+WORDS = {
+    'ascii': "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor".split(),
+    'utf8': "naïve café Ελληνικά русский язык 中文 字符 日本語 العربية emoji 🚀 déjà vu".split(),
+}
+KINDS = ('ascii', 'utf8', 'docx')
+UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2}
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    for unit in ('KB', 'MB', 'B'):
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * UNITS[unit])
+    return int(value)
+
+
+def size_label(size):
+    for unit in ('MB', 'KB'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return f'{size // UNITS[unit]}{unit}'
+    return f'{size}B'
+
+
+def _lines(kind, size, token):
+    """Yield lines of roughly ``size`` encoded bytes; the first is unique per run"""
+    words = WORDS['ascii' if kind == 'docx' else kind]
+    yield f'run {token}'
+    written = 0
+    index = 0
+    while written < size:
+        line = ' '.join(words[(index + i) % len(words)] for i in range(12))
+        index += 1
+        written += len(line.encode('utf-8')) + 1
+        yield line
+
+
+def write_corpus(path, kind, size, token):
+    """Write a corpus file and return its word count"""
+    count = 0
+    if kind == 'docx':
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('[Content_Types].xml', '<Types/>')
+            with archive.open('word/document.xml', 'w') as document:
+                document.write(
+                    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                    b'<w:body>'
+                )
+                for line in _lines(kind, size, token):
+                    count += len(line.split())
+                    document.write(f'<w:p><w:r><w:t>{line}</w:t></w:r></w:p>'.encode('utf-8'))
+                document.write(b'</w:body></w:document>')
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            for line in _lines(kind, size, token):
+                count += len(line.split())
+                f.write(line + '\n')
+    return count
+
+
+def summarize(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return {
+        'min': min(values),
+        'median': statistics.median(values),
+        'max': max(values),
+    }
+
+
+def peak_rss_kb():
+    """The process's resident-set high-water mark in KB, or None where unavailable (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform.system() == 'Darwin' else peak
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageRecorder:
+    """
+    Collects per-upload stage timestamps from Celery signals and counts SQL
+    queries per stage (request or task) on every database connection.
+    """
+
+    def __init__(self):
+        self.published = {}
+        self.started = {}
+        self.finished = {}
+        self.queries = {'request': 0, 'task': 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        stage = getattr(self._local, 'stage', 'request')
+        with self._lock:
+            self.queries[stage] += 1
+        return execute(sql, params, many, context)
+
+    def on_publish(self, sender=None, headers=None, **kwargs):
+        if sender == TASK_NAME:
+            self.published[headers['id']] = time.perf_counter()
+
+    def on_prerun(self, sender=None, task_id=None, args=None, **kwargs):
+        if sender.name == TASK_NAME:
+            self._local.stage = 'task'
+            self.started[args[0]] = (task_id, time.perf_counter())
+
+    def on_postrun(self, sender=None, task_id=None, args=None, **kwargs):
+        if sender.name == TASK_NAME:
+            self.finished[args[0]] = time.perf_counter()
+            self._local.stage = 'request'
+
+    def on_connection(self, sender=None, connection=None, **kwargs):
+        # Fired again whenever a thread reconnects, e.g. after each task
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def reset_queries(self):
+        with self._lock:
+            self.queries = {'request': 0, 'task': 0}
+
+    @contextmanager
+    def installed(self):
+        before_task_publish.connect(self.on_publish, weak=False)
+        task_prerun.connect(self.on_prerun, weak=False)
+        task_postrun.connect(self.on_postrun, weak=False)
+        connection_created.connect(self.on_connection, weak=False)
+        self.on_connection(connection=connection)
+        try:
+            yield self
+        finally:
+            connection.execute_wrappers.remove(self)
+            connection_created.disconnect(self.on_connection)
+            task_postrun.disconnect(self.on_postrun)
+            task_prerun.disconnect(self.on_prerun)
+            before_task_publish.disconnect(self.on_publish)
+
+
+@contextmanager
+def celery_mode(mode, worker_queues=(None,), pool='solo', concurrency=1):
+    """
+    Run tasks eagerly in-process, or through an in-memory broker and workers
+    started in threads, one per entry of ``worker_queues`` (a list of queue
+    names, or None to consume every queue), each with the given pool.
+    """
+    # The app reads its configuration under the CELERY_ settings namespace
+    keys = (
+        'CELERY_TASK_ALWAYS_EAGER', 'CELERY_TASK_EAGER_PROPAGATES', 'CELERY_BROKER_URL',
+        'CELERY_BROKER_TRANSPORT_OPTIONS', 'CELERY_RESULT_BACKEND',
+    )
+    saved = {key: app.conf.get(key) for key in keys}
+    # Celery prefers these environment variables over any configured value
+    saved_env = {name: os.environ.pop(name, None) for name in ('CELERY_BROKER_URL', 'CELERY_RESULT_BACKEND')}
+    try:
+        # Eager calls still acquire a producer, so neither mode may need a real broker
+        app.conf.update(CELERY_BROKER_URL='memory://', CELERY_RESULT_BACKEND='cache+memory://')
+        if mode == 'eager':
+            app.conf.update(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+            yield
+        else:
+            app.conf.update(
+                CELERY_TASK_ALWAYS_EAGER=False,
+                # The memory transport polls once a second by default, which
+                # would dominate the measured queue wait
+                CELERY_BROKER_TRANSPORT_OPTIONS={'polling_interval': 0.005},
+            )
+            with ExitStack() as workers:
+                for queues in worker_queues:
+                    # Always explicit: a worker's queue selection outlives it on the app
+                    queues = queues or list(app.amqp.queues)
+                    workers.enter_context(
+                        start_worker(
+                            app, pool=pool, concurrency=concurrency, queues=queues,
+                            perform_ping_check=False, shutdown_timeout=30,
+                        )
+                    )
+                yield
+    finally:
+        app.conf.update(saved)
+        os.environ.update({name: value for name, value in saved_env.items() if value is not None})
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark POST /api/files/ through process_file_word_count_with_content "
+        "to status 'completed' and print the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('eager', 'memory'), default='eager',
+                            help="eager: tasks run inside the request; memory: in-memory broker and a worker thread")
+        parser.add_argument('--sizes', default='1KB,100KB,1MB,8MB',
+                            help="Comma-separated corpus sizes (B, KB or MB; at most 10MB)")
+        parser.add_argument('--kinds', default=','.join(KINDS),
+                            help=f"Comma-separated corpus kinds: {', '.join(KINDS)}")
+        parser.add_argument('--repeat', type=int, default=3, help="Uploads per case")
+        parser.add_argument('--timeout', type=float, default=120, help="Seconds to wait for each upload")
+        parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+        parser.add_argument('--compare', help="Earlier results file to print end-to-end changes against")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [parse_size(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f"Invalid --sizes value '{options['sizes']}'")
+        if any(size <= 0 or size > MAX_SIZE for size in sizes):
+            raise CommandError("Sizes must be between 1B and 10MB (the single-request upload limit)")
+        kinds = [kind.strip() for kind in options['kinds'].split(',')]
+        unknown = set(kinds) - set(KINDS)
+        if unknown:
+            raise CommandError(f"Unknown corpus kinds: {', '.join(sorted(unknown))}")
+
+        workdir = tempfile.mkdtemp(prefix='pipeline-benchmark-')
+        user = User.objects.create_user(f'pipeline-benchmark-{uuid.uuid4().hex[:8]}')
+        PaymentTransaction.objects.create(
+            user=user, transaction_id=f'txn_{uuid.uuid4().hex[:8]}', amount=100, status='success',
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        recorder = StageRecorder()
+        pipeline_settings = override_settings(
+            MEDIA_ROOT=os.path.join(workdir, 'media'),
+            WORD_COUNT_BATCHING=False,
+            # Keep the counts to this benchmark's own work
+            ACTIVITY_LOG_BACKEND='sync',
+        )
+        results = []
+        try:
+            with pipeline_settings, recorder.installed(), celery_mode(options['mode']):
+                for kind in kinds:
+                    for size in sizes:
+                        results.append(self.run_case(client, recorder, workdir, kind, size, options))
+        finally:
+            user.delete()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {
+            'schema': SCHEMA_VERSION,
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'mode': options['mode'],
+            'repeat': options['repeat'],
+            'environment': {
+                'git_revision': git_revision(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'celery': celery.__version__,
+                'database': connection.vendor,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.print_comparison(options['compare'], report)
+
+    def run_case(self, client, recorder, workdir, kind, size, options):
+        ext = '.docx' if kind == 'docx' else '.txt'
+        runs = []
+        rss_before = peak_rss_kb()
+        for _ in range(options['repeat']):
+            path = os.path.join(workdir, f'{kind}-{size}{ext}')
+            words = write_corpus(path, kind, size, uuid.uuid4().hex)
+            recorder.reset_queries()
+
+            with open(path, 'rb') as f:
+                started = time.perf_counter()
+                response = client.post('/api/files/', {'file': f}, format='multipart')
+                responded = time.perf_counter()
+            os.remove(path)
+            if response.status_code != 201:
+                raise CommandError(f"Upload failed with {response.status_code}: {response.content[:200]!r}")
+            file_id = response.data['id']
+
+            deadline = time.monotonic() + options['timeout']
+            while file_id not in recorder.finished:
+                if time.monotonic() >= deadline:
+                    raise CommandError(f"Upload {file_id} did not finish within {options['timeout']}s")
+                time.sleep(0.005)
+            upload = FileUpload.objects.only('status', 'word_count').get(id=file_id)
+            task_id, task_started = recorder.started[file_id]
+            published = recorder.published.get(task_id)
+            finished = recorder.finished[file_id]
+
+            runs.append({
+                'end_to_end_ms': (finished - started) * 1000,
+                'request_ms': (responded - started) * 1000,
+                # Eager tasks run inside the request and are never queued
+                'queue_wait_ms': None if published is None else (task_started - published) * 1000,
+                'processing_ms': (finished - task_started) * 1000,
+                'queries': dict(recorder.queries),
+                'status': upload.status,
+                'word_count_ok': upload.word_count == words,
+            })
+
+        rss_after = peak_rss_kb()
+        return {
+            'case': f'{kind}-{size_label(size)}',
+            'kind': kind,
+            'size_bytes': size,
+            'runs': len(runs),
+            'end_to_end_ms': summarize([run['end_to_end_ms'] for run in runs]),
+            'request_ms': summarize([run['request_ms'] for run in runs]),
+            'queue_wait_ms': summarize([run['queue_wait_ms'] for run in runs]),
+            'processing_ms': summarize([run['processing_ms'] for run in runs]),
+            'queries': {
+                stage: statistics.median(run['queries'][stage] for run in runs)
+                for stage in ('request', 'task')
+            },
+            # The high-water mark cannot be reset, so a case only shows how far
+            # it raised the process-wide peak (0 if an earlier case went higher)
+            'process_peak_rss_kb': rss_after,
+            'peak_rss_growth_kb': None if rss_after is None else rss_after - rss_before,
+            'completed': all(run['status'] == 'completed' for run in runs),
+            'word_count_ok': all(run['word_count_ok'] for run in runs),
+        }
+
+    def print_comparison(self, path, report):
+        try:
+            with open(path, encoding='utf-8') as f:
+                baseline = {result['case']: result for result in json.load(f)['results']}
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read baseline '{path}': {e}")
+        self.stderr.write(f"End-to-end median vs {path}:")
+        for result in report['results']:
+            before = baseline.get(result['case'])
+            if before is None:
+                continue
+            old = before['end_to_end_ms']['median']
+            new = result['end_to_end_ms']['median']
+            change = (new - old) / old * 100 if old else 0.0
+            self.stderr.write(f"  {result['case']:<12} {old:>9.1f}ms -> {new:>9.1f}ms  {change:+6.1f}%")
@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from core.models import FileUpload, PaymentTransaction
+from payment_file_upload.celery_app import LARGE_FILES_QUEUE, SMALL_FILES_QUEUE
+
+from .benchmark_payments import percentile
+from .benchmark_pipeline import MAX_SIZE, StageRecorder, celery_mode, parse_size, size_label, write_corpus
+
+# Worker threads per scenario; each consumes the listed queues (None: all of them)
+SCENARIOS = {
+    # One lane for every upload, as before size-based routing
+    'shared': [None],
+    'routed': [[SMALL_FILES_QUEUE], [LARGE_FILES_QUEUE]],
+}
+
+
+def latency_stats(latencies):
+    ordered = sorted(latencies)
+    if not ordered:
+        return None
+    return {
+        'files': len(ordered),
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload large files followed by many small ones through an in-memory "
+        "broker, with one shared worker lane and with size-routed lanes, and "
+        "report how long the small files take to complete"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--small', type=int, default=40, help="Small uploads per scenario")
+        parser.add_argument('--small-size', default='1KB')
+        parser.add_argument('--large', type=int, default=3, help="Large uploads per scenario, sent first")
+        parser.add_argument('--large-size', default='8MB')
+        parser.add_argument('--scenario', choices=['both', *SCENARIOS], default='both')
+        parser.add_argument('--timeout', type=float, default=300, help="Seconds to wait for a scenario")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            small_size = parse_size(options['small_size'])
+            large_size = parse_size(options['large_size'])
+        except ValueError:
+            raise CommandError("Invalid --small-size or --large-size")
+        if not 0 < small_size < large_size <= MAX_SIZE:
+            raise CommandError("Sizes must satisfy 0 < small < large <= 10MB (the single-request upload limit)")
+        scenarios = list(SCENARIOS) if options['scenario'] == 'both' else [options['scenario']]
+
+        workdir = tempfile.mkdtemp(prefix='routing-benchmark-')
+        user = User.objects.create_user(f'routing-benchmark-{uuid.uuid4().hex[:8]}')
+        PaymentTransaction.objects.create(
+            user=user, transaction_id=f'txn_{uuid.uuid4().hex[:8]}', amount=100, status='success',
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        reports = []
+        try:
+            for scenario in scenarios:
+                recorder = StageRecorder()
+                scenario_settings = override_settings(
+                    MEDIA_ROOT=os.path.join(workdir, 'media'),
+                    WORD_COUNT_BATCHING=False,
+                    ACTIVITY_LOG_BACKEND='sync',
+                    # The shared lane takes every upload on the small-file queue
+                    WORD_COUNT_LARGE_FILE_SIZE=large_size if scenario == 'routed' else MAX_SIZE + 1,
+                )
+                with scenario_settings, recorder.installed(), celery_mode('memory', SCENARIOS[scenario]):
+                    report = self.run(client, recorder, workdir, small_size, large_size, options)
+                reports.append({'scenario': scenario, **report})
+        finally:
+            user.delete()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+        else:
+            self.print_report(reports)
+
+    def run(self, client, recorder, workdir, small_size, large_size, options):
+        # Write every corpus first (each one unique, so no upload is a duplicate)
+        corpora = []
+        for index in range(options['large'] + options['small']):
+            size = large_size if index < options['large'] else small_size
+            path = os.path.join(workdir, f'{index}-{size_label(size)}.txt')
+            write_corpus(path, 'ascii', size, uuid.uuid4().hex)
+            corpora.append((path, size))
+
+        started_at = {}
+        sizes = {}
+        started = time.perf_counter()
+        for path, size in corpora:
+            with open(path, 'rb') as f:
+                request_started = time.perf_counter()
+                response = client.post('/api/files/', {'file': f}, format='multipart')
+            os.remove(path)
+            if response.status_code != 201:
+                raise CommandError(f"Upload failed with {response.status_code}: {response.content[:200]!r}")
+            started_at[response.data['id']] = request_started
+            sizes[response.data['id']] = size
+
+        deadline = time.monotonic() + options['timeout']
+        while not all(file_id in recorder.finished for file_id in started_at):
+            if time.monotonic() >= deadline:
+                raise CommandError(f"Uploads did not finish within {options['timeout']}s")
+            time.sleep(0.005)
+        makespan = max(recorder.finished.values()) - started
+
+        completion = {file_id: recorder.finished[file_id] - request_started
+                      for file_id, request_started in started_at.items()}
+        statuses = set(FileUpload.objects.filter(id__in=started_at).values_list('status', flat=True))
+        return {
+            'small': latency_stats([value for file_id, value in completion.items() if sizes[file_id] == small_size]),
+            'large': latency_stats([value for file_id, value in completion.items() if sizes[file_id] == large_size]),
+            'small_size_bytes': small_size,
+            'large_size_bytes': large_size,
+            'makespan_ms': makespan * 1000,
+            'completed': statuses == {'completed'},
+        }
+
+    def print_report(self, reports):
+        for report in reports:
+            self.stdout.write(f"{report['scenario']:<7} makespan {report['makespan_ms']:9.1f}ms")
+            for kind in ('small', 'large'):
+                stats = report[kind]
+                if stats is None:
+                    continue
+                self.stdout.write(
+                    f"  {kind:<6} {stats['files']:>4} files  p50 {stats['p50_ms']:9.1f}ms  "
+                    f"p95 {stats['p95_ms']:9.1f}ms  max {stats['max_ms']:9.1f}ms"
+                )
@@ -0,0 +1,170 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.utils import load_backend
+from django.test.utils import override_settings
+
+from core.models import ActivityLog, FileUpload
+from core.sqlite_tuning import serialized_writes
+
+from .benchmark_payments import summarize
+
+ALIAS = 'sqlite_writers_benchmark'
+
+MODES = {
+    'baseline': {'SQLITE_TUNING': False, 'SQLITE_SERIALIZE_WRITES': False},
+    'tuned': {'SQLITE_TUNING': True, 'SQLITE_SERIALIZE_WRITES': True},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent word-count status updates, upload activity writes and "
+        "dashboard reads against a scratch SQLite file, with and without "
+        "SQLITE_TUNING, and report write throughput, latency and lock errors"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--writes', type=int, default=100, help="Writes per writer thread")
+        parser.add_argument('--readers', type=int, default=2)
+        parser.add_argument('--mode', choices=['both', *MODES], default='both')
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        modes = list(MODES) if options['mode'] == 'both' else [options['mode']]
+        reports = []
+        for mode in modes:
+            with tempfile.TemporaryDirectory() as directory, override_settings(**MODES[mode]):
+                report = self.run(os.path.join(directory, 'benchmark.sqlite3'), options)
+            reports.append({'mode': mode, **report})
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+        else:
+            self.print_report(reports)
+
+    def run(self, path, options):
+        # A scratch database on its own alias, opened per thread like a worker's connection
+        settings_dict = connections.configure_settings({
+            DEFAULT_DB_ALIAS: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path},
+        })[DEFAULT_DB_ALIAS]
+        backend = load_backend(settings_dict['ENGINE'])
+
+        def open_connection():
+            connections[ALIAS] = backend.DatabaseWrapper(copy.deepcopy(settings_dict), ALIAS)
+
+        open_connection()
+        try:
+            with connections[ALIAS].schema_editor() as editor:
+                for model in (User, FileUpload, ActivityLog):
+                    editor.create_model(model)
+            user = User.objects.db_manager(ALIAS).create_user('sqlite-benchmark')
+            FileUpload.objects.using(ALIAS).bulk_create(
+                FileUpload(user=user, file=f'uploads/benchmark-{index}.txt', status='processing')
+                for index in range(options['writers'] * options['writes'])
+            )
+            upload_ids = list(FileUpload.objects.using(ALIAS).order_by('id').values_list('id', flat=True))
+            with connections[ALIAS].cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                journal_mode = cursor.fetchone()[0]
+
+            latencies = []
+            errors = []
+            reads = []
+            writing = threading.Event()
+            writing.set()
+
+            def task_write(upload_id):
+                # The word-count task: load the upload, then save its results
+                upload = FileUpload.objects.using(ALIAS).get(id=upload_id)
+                upload.status = 'completed'
+                upload.word_count = upload_id
+                with serialized_writes(ALIAS):
+                    upload.save(using=ALIAS)
+
+            def activity_write(upload_id):
+                # An upload request: read and write in one transaction
+                with transaction.atomic(using=ALIAS):
+                    FileUpload.objects.using(ALIAS).filter(user=user).count()
+                    ActivityLog.objects.using(ALIAS).create(
+                        user=user, action='file_upload', metadata={'file_upload_id': upload_id}
+                    )
+
+            def writer(ids):
+                open_connection()
+                own_latencies, own_errors = [], 0
+                try:
+                    for position, upload_id in enumerate(ids):
+                        write = task_write if position % 2 == 0 else activity_write
+                        started = time.perf_counter()
+                        try:
+                            write(upload_id)
+                        except OperationalError:
+                            own_errors += 1
+                        own_latencies.append(time.perf_counter() - started)
+                finally:
+                    connections[ALIAS].close()
+                latencies.extend(own_latencies)
+                errors.append(own_errors)
+
+            def reader():
+                open_connection()
+                count = 0
+                try:
+                    while writing.is_set():
+                        try:
+                            list(FileUpload.objects.using(ALIAS).filter(user=user).order_by('-upload_time')[:50])
+                        except OperationalError:
+                            continue
+                        count += 1
+                finally:
+                    connections[ALIAS].close()
+                reads.append(count)
+
+            writers = [
+                threading.Thread(target=writer, args=(upload_ids[index::options['writers']],))
+                for index in range(options['writers'])
+            ]
+            readers = [threading.Thread(target=reader) for _ in range(options['readers'])]
+            started = time.perf_counter()
+            for thread in readers + writers:
+                thread.start()
+            for thread in writers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            writing.clear()
+            for thread in readers:
+                thread.join()
+        finally:
+            connections[ALIAS].close()
+            del connections[ALIAS]
+
+        return {
+            'journal_mode': journal_mode,
+            'writers': options['writers'],
+            'readers': options['readers'],
+            'writes': summarize(latencies, elapsed, sum(errors)),
+            'reads_per_second': sum(reads) / elapsed if elapsed else None,
+        }
+
+    def print_report(self, reports):
+        for report in reports:
+            writes = report['writes']
+            self.stdout.write(
+                f"{report['mode']:<9} journal={report['journal_mode']:<7} "
+                f"{report['writers']} writers, {report['readers']} readers"
+            )
+            self.stdout.write(
+                f"  writes  {writes['requests']:>6}  {writes['requests_per_second'] or 0:9.1f}/s  "
+                f"p50 {writes['p50_ms'] or 0:8.2f}ms  p95 {writes['p95_ms'] or 0:8.2f}ms  "
+                f"p99 {writes['p99_ms'] or 0:8.2f}ms  locked {writes['errors']}"
+            )
+            self.stdout.write(f"  reads   {report['reads_per_second'] or 0:9.1f}/s")
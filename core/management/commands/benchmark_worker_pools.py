@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from core.models import FileUpload
+from core.tasks import process_file_word_count_with_content
+from payment_file_upload.celery_app import app
+
+from .benchmark_pipeline import MAX_SIZE, celery_mode, parse_size, size_label, write_corpus
+
+POOLS = ('prefork', 'threads', 'solo')
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the same word-count workload through a worker with each pool "
+        "type over an in-memory broker, and report throughput per pool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pools', default=','.join(POOLS), help=f"Comma-separated pools: {', '.join(POOLS)}")
+        parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1,
+                            help="Pool slots (ignored by solo, which always runs one task at a time)")
+        parser.add_argument('--tasks', type=int, default=48, help="Word-count tasks per pool")
+        parser.add_argument('--sizes', default='64KB,1MB', help="Comma-separated file sizes, used in turn")
+        parser.add_argument(
+            '--prefetch-multiplier', type=int, default=0,
+            help="Messages reserved per slot (default: enough to reserve every task up front)",
+        )
+        parser.add_argument('--timeout', type=float, default=300, help="Seconds to wait for each pool")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        pools = [pool.strip() for pool in options['pools'].split(',')]
+        unknown = set(pools) - set(POOLS)
+        if unknown:
+            raise CommandError(f"Unknown pools: {', '.join(sorted(unknown))}")
+        try:
+            sizes = [parse_size(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f"Invalid --sizes value '{options['sizes']}'")
+        if any(size <= 0 or size > MAX_SIZE for size in sizes):
+            raise CommandError("Sizes must be between 1B and 10MB (the single-request upload limit)")
+
+        workdir = tempfile.mkdtemp(prefix='pool-benchmark-')
+        media_root = os.path.join(workdir, 'media')
+        os.makedirs(os.path.join(media_root, 'uploads'))
+        # One corpus per size, shared by the uploads: rows created here have no
+        # content digest, so none is answered from an earlier result
+        corpora = []
+        for size in sizes:
+            name = f'uploads/corpus-{size_label(size)}.txt'
+            write_corpus(os.path.join(media_root, name), 'ascii', size, uuid.uuid4().hex)
+            corpora.append((name, size))
+
+        user = User.objects.create_user(f'pool-benchmark-{uuid.uuid4().hex[:8]}')
+        pool_settings = override_settings(
+            MEDIA_ROOT=media_root,
+            ACTIVITY_LOG_BACKEND='sync',
+            # Measure the pool itself, not a process pool nested inside it
+            WORD_COUNT_PARALLEL_THRESHOLD=0,
+        )
+        reports = []
+        try:
+            with pool_settings:
+                for pool in pools:
+                    reports.append(self.run(user, pool, corpora, options))
+        finally:
+            user.delete()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(reports, indent=2))
+        else:
+            self.print_report(reports)
+
+    def run(self, user, pool, corpora, options):
+        concurrency = 1 if pool == 'solo' else options['concurrency']
+        # Over the in-memory broker a worker with every slot reserved only
+        # fetches again when its 2s drain timeout expires, which would measure
+        # that wait rather than the pool; with one worker, reserving the whole
+        # batch changes nothing else
+        prefetch = options['prefetch_multiplier'] or -(-options['tasks'] // concurrency)
+        uploads = FileUpload.objects.bulk_create(
+            FileUpload(user=user, file=name, filename=os.path.basename(name), status='processing')
+            for name, _ in (corpora[index % len(corpora)] for index in range(options['tasks']))
+        )
+        upload_ids = [upload.id for upload in uploads]
+        total_bytes = sum(corpora[index % len(corpora)][1] for index in range(options['tasks']))
+
+        saved_prefetch = app.conf.get('CELERY_WORKER_PREFETCH_MULTIPLIER')
+        app.conf.update(CELERY_WORKER_PREFETCH_MULTIPLIER=prefetch)
+        try:
+            # Prefork children are forked here, inside the settings above
+            with celery_mode('memory', pool=pool, concurrency=concurrency):
+                started = time.perf_counter()
+                for upload_id in upload_ids:
+                    process_file_word_count_with_content.delay(upload_id)
+                deadline = time.monotonic() + options['timeout']
+                # Task signals fire in prefork children, so completion is read from the database
+                while FileUpload.objects.filter(id__in=upload_ids, status='processing').exists():
+                    if time.monotonic() >= deadline:
+                        raise CommandError(f"{pool}: tasks did not finish within {options['timeout']}s")
+                    time.sleep(0.01)
+                elapsed = time.perf_counter() - started
+        finally:
+            app.conf.update(CELERY_WORKER_PREFETCH_MULTIPLIER=saved_prefetch)
+
+        statuses = set(FileUpload.objects.filter(id__in=upload_ids).values_list('status', flat=True))
+        return {
+            'pool': pool,
+            'concurrency': concurrency,
+            'prefetch_multiplier': prefetch,
+            'max_tasks_per_child': settings.CELERY_WORKER_MAX_TASKS_PER_CHILD if pool == 'prefork' else None,
+            'tasks': len(upload_ids),
+            'elapsed_s': elapsed,
+            'tasks_per_second': len(upload_ids) / elapsed,
+            'megabytes_per_second': total_bytes / elapsed / (1024 * 1024),
+            'completed': statuses == {'completed'},
+        }
+
+    def print_report(self, reports):
+        for report in reports:
+            self.stdout.write(
+                f"{report['pool']:<8} x{report['concurrency']:<3} {report['tasks']} tasks in "
+                f"{report['elapsed_s']:7.2f}s  {report['tasks_per_second']:8.1f} tasks/s  "
+                f"{report['megabytes_per_second']:7.1f} MB/s"
+                + ('' if report['completed'] else '  (some tasks failed)')
+            )
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.models import ActivityLog, FileUpload, PaymentTransaction
+from core.views import ActivityLogViewSet, FileUploadViewSet, PaymentTransactionViewSet
+
+
+class Command(BaseCommand):
+    help = "Print the database EXPLAIN plan for each per-user listing query"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            help="Username or id to build the queries for (defaults to the first user)",
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help="Run EXPLAIN ANALYZE (PostgreSQL/MySQL/MariaDB only)",
+        )
+
+    def get_user(self, identifier):
+        users = User.objects.order_by('id')
+        if identifier is None:
+            user = users.first()
+            if user is None:
+                # Plans do not depend on the row existing
+                return User(id=1, username='placeholder')
+            return user
+        lookup = {'id': identifier} if identifier.isdigit() else {'username': identifier}
+        try:
+            return users.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"User '{identifier}' does not exist")
+
+    def get_queries(self, user):
+        request = SimpleNamespace(user=user)
+        queries = []
+        for label, viewset_class in (
+            ('GET /api/files/', FileUploadViewSet),
+            ('GET /api/transactions/', PaymentTransactionViewSet),
+            ('GET /api/activity/', ActivityLogViewSet),
+        ):
+            viewset = viewset_class(request=request, format_kwarg=None)
+            paginator = viewset.paginator
+            # The page query: cursor ordering plus page_size + 1 rows
+            queryset = viewset.get_queryset().order_by(*paginator.ordering)[:paginator.page_size + 1]
+            queries.append((label, queryset))
+        # Unordered lookups, shaped like the .exists() checks the views run
+        queries += [
+            ('payment entitlement check',
+             PaymentTransaction.objects.filter(user=user, status='success').order_by().values('id')[:1]),
+            ('files by status',
+             FileUpload.objects.filter(user=user, status='processing').order_by().values('id')[:1]),
+            ('activity by action',
+             ActivityLog.objects.filter(user=user, action='file_uploaded').order_by().values('id')[:1]),
+        ]
+        return queries
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        if explain_options and connection.vendor == 'sqlite':
+            raise CommandError("--analyze is not supported on SQLite")
+
+        for label, queryset in self.get_queries(user):
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.simulator import GatewaySimulator, parse_outcomes
+
+
+class Command(BaseCommand):
+    help = "Serve a local aamarPay stand-in (point AAMARPAY_ENDPOINT at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds before each reply")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Random +/- seconds added to the latency")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of payments rejected")
+        parser.add_argument(
+            '--outcomes', default='success=1',
+            help="Checkout outcome weights, e.g. success=8,failed=1,cancelled=1",
+        )
+        parser.add_argument(
+            '--callback-delay', type=float, default=None,
+            help="Also call the outcome URL this many seconds after each payment",
+        )
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            outcomes = parse_outcomes(options['outcomes'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        simulator = GatewaySimulator(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            outcomes=outcomes,
+            callback_delay=options['callback_delay'],
+            host=options['host'],
+            port=options['port'],
+            seed=options['seed'],
+        )
+        self.stdout.write(f"Gateway simulator listening on {simulator.url}")
+        self.stdout.write(f"Start the app with AAMARPAY_ENDPOINT={simulator.url}")
+        try:
+            simulator.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.server.server_close()
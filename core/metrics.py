@@ -0,0 +1,274 @@
+"""
+In-process performance histograms, exposed in Prometheus text format.
+
+``RequestMetricsMiddleware`` times every request and counts its SQL
+queries; Celery signal hooks time each task from publish to start (queue
+wait) and from start to finish (run time); the word counter records how
+many bytes it read. Observing a value is a bisect and an add under a lock.
+
+Every process (web or worker) keeps its own histograms and pushes a
+snapshot to Django's cache at most every ``METRICS_PUSH_INTERVAL`` seconds.
+``/api/metrics/`` merges the snapshots of all live processes, so the cache
+must be shared (e.g. Redis) when there is more than one process.
+"""
+import bisect
+import os
+import socket
+import threading
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_process_shutdown
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+SOURCES_KEY = 'metrics:sources'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = tuple(1024 * 4 ** exponent for exponent in range(10))  # 1KB .. 256MB
+
+REGISTRY = []
+
+
+class Histogram:
+    """A labelled Prometheus histogram"""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', "Time spent serving a request",
+    ('view', 'method', 'status'), LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', "SQL queries run while serving a request",
+    ('view', 'method'), QUERY_BUCKETS,
+)
+REQUEST_QUERY_TIME = Histogram(
+    'http_request_db_duration_seconds', "Time spent in SQL queries while serving a request",
+    ('view', 'method'), LATENCY_BUCKETS,
+)
+TASK_QUEUE_WAIT = Histogram(
+    'celery_task_queue_wait_seconds', "Time from publishing a task to a worker starting it",
+    ('task',), LATENCY_BUCKETS,
+)
+TASK_RUNTIME = Histogram(
+    'celery_task_runtime_seconds', "Time a worker spent running a task",
+    ('task', 'state'), LATENCY_BUCKETS,
+)
+WORD_COUNT_BYTES = Histogram(
+    'word_count_bytes_processed', "Size of each file read by the word counter",
+    (), BYTES_BUCKETS,
+)
+
+
+class QueryTimer:
+    """Execute wrapper counting queries and the time spent in them"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class RequestMetricsMiddleware:
+    """Record latency and SQL query count/time for each request, by view"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        # Stay async under ASGI so async views are not funnelled through a thread
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with self.timing_queries(timer):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with self.timing_queries(timer):
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    @staticmethod
+    def timing_queries(timer):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        return stack
+
+    @staticmethod
+    def record(request, response, elapsed, timer):
+        # Label by route name, not path, to keep the series count bounded
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        REQUEST_LATENCY.observe(elapsed, view, request.method, str(response.status_code))
+        REQUEST_QUERIES.observe(timer.count, view, request.method)
+        REQUEST_QUERY_TIME.observe(timer.duration, view, request.method)
+        push_snapshot()
+
+
+_task_starts = {}
+
+
+@before_task_publish.connect
+def _stamp_publish_time(headers=None, **kwargs):
+    if settings.METRICS_ENABLED and headers is not None:
+        # Wall clock: the worker reading it runs in another process
+        headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    if not settings.METRICS_ENABLED:
+        return
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is not None:
+        TASK_QUEUE_WAIT.observe(max(0.0, time.time() - published_at), task.name)
+    _task_starts[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    started = _task_starts.pop(task_id, None)
+    if started is None:
+        return
+    TASK_RUNTIME.observe(time.perf_counter() - started, task.name, state or 'UNKNOWN')
+    push_snapshot()
+
+
+@worker_process_shutdown.connect
+def _push_on_worker_shutdown(**kwargs):
+    push_snapshot(force=True)
+
+
+def _source_key(source):
+    return f'metrics:snapshot:{source}'
+
+
+def _source():
+    # Recomputed on each push: worker processes are forked after import
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def local_snapshot():
+    return {histogram.name: histogram.snapshot() for histogram in REGISTRY}
+
+
+_last_push = 0.0
+_push_lock = threading.Lock()
+
+
+def push_snapshot(force=False):
+    """Publish this process's histograms to the cache, throttled by METRICS_PUSH_INTERVAL"""
+    global _last_push
+    now = time.monotonic()
+    with _push_lock:
+        if not force and now - _last_push < settings.METRICS_PUSH_INTERVAL:
+            return
+        _last_push = now
+    source = _source()
+    ttl = settings.METRICS_SNAPSHOT_TTL
+    cache.set(_source_key(source), local_snapshot(), ttl)
+    sources = cache.get(SOURCES_KEY) or {}
+    sources = {name: seen for name, seen in sources.items() if seen > time.time() - ttl}
+    sources[source] = time.time()
+    cache.set(SOURCES_KEY, sources, ttl)
+
+
+def collect():
+    """Merge this process's live histograms with the snapshots pushed by other processes"""
+    merged = {name: dict(series) for name, series in local_snapshot().items()}
+    own = _source()
+    others = [_source_key(source) for source in (cache.get(SOURCES_KEY) or {}) if source != own]
+    for snapshot in cache.get_many(others).values():
+        for name, series in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                continue
+            for labels, (counts, total) in series.items():
+                current = target.get(labels)
+                if current is None:
+                    target[labels] = (list(counts), total)
+                elif len(current[0]) == len(counts):
+                    target[labels] = ([a + b for a, b in zip(current[0], counts)], current[1] + total)
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render_prometheus():
+    """Return every histogram in the Prometheus text exposition format"""
+    merged = collect()
+    lines = []
+    for histogram in REGISTRY:
+        lines.append(f'# HELP {histogram.name} {histogram.documentation}')
+        lines.append(f'# TYPE {histogram.name} histogram')
+        for labels, (counts, total) in sorted(merged[histogram.name].items()):
+            pairs = list(zip(histogram.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(
+                    f'{histogram.name}_bucket{_format_labels(pairs + [("le", bound)])} {cumulative}'
+                )
+            lines.append(f'{histogram.name}_sum{_format_labels(pairs)} {total}')
+            lines.append(f'{histogram.name}_count{_format_labels(pairs)} {cumulative}')
+    return '\n'.join(lines) + '\n'
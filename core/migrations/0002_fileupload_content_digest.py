@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='content_digest',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 14:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_user_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='activitylog',
+            name='activitylog_user_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='fileupload',
+            name='fileupload_user_time_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='paymenttransaction',
+            name='paymenttx_user_time_idx',
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='activitylog_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileupload',
+            index=models.Index(fields=['user', '-upload_time', '-id'], name='fileupload_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymenttransaction',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='paymenttx_user_time_idx'),
+        ),
+    ]
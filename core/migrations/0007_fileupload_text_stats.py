@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='text_stats',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
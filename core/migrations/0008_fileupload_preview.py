@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_fileupload_text_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='preview',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
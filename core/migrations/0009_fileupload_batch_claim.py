@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_fileupload_preview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='batch_claim',
+            field=models.UUIDField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -1,4 +1,7 @@
+import uuid
+import zlib
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class FileUpload(models.Model):
@@ -14,12 +17,38 @@ class FileUpload(models.Model):
     upload_time = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
     word_count = models.PositiveIntegerField(null=True, blank=True)
+    # Line, character, sentence and distinct-word counts plus the most
+    # frequent words, filled in with word_count when TEXT_STATS_ENABLED
+    text_stats = models.JSONField(null=True, blank=True)
+    # zlib-compressed UTF-8 of the first FILE_PREVIEW_SIZE characters. The
+    # file itself stays in storage; listings defer this column
+    preview = models.BinaryField(null=True, blank=True, editable=False)
+    # SHA-256 of the uploaded bytes, used to reuse results for duplicate uploads
+    content_digest = models.CharField(max_length=64, blank=True, db_index=True)
+    # Set by the batching dispatcher in the UPDATE that claims the upload, so
+    # each upload is queued exactly once whichever worker runs the dispatcher
+    batch_claim = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
     
     def __str__(self):
         return f"{self.filename} - {self.user.username}"
     
+    @staticmethod
+    def compress_preview(text):
+        return zlib.compress(text.encode('utf-8'))
+    
+    @property
+    def preview_text(self):
+        """The decompressed preview, or None if none was stored"""
+        if self.preview is None:
+            return None
+        return zlib.decompress(self.preview).decode('utf-8')
+    
     class Meta:
         ordering = ['-upload_time']
+        indexes = [
+            models.Index(fields=['user', '-upload_time', '-id'], name='fileupload_user_time_idx'),
+            models.Index(fields=['user', 'status'], name='fileupload_user_status_idx'),
+        ]
 
 class PaymentTransaction(models.Model):
     STATUS_CHOICES = (
@@ -41,15 +70,55 @@ class PaymentTransaction(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-id'], name='paymenttx_user_time_idx'),
+            models.Index(fields=['user', 'status'], name='paymenttx_user_status_idx'),
+        ]
 
 class ActivityLog(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     action = models.CharField(max_length=100)
     metadata = models.JSONField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set from the event, not the INSERT, so buffered writes keep their time
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     def __str__(self):
         return f"{self.action} - {self.user.username}"
     
     class Meta:
-        ordering = ['-timestamp']
\ No newline at end of file
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-id'], name='activitylog_user_time_idx'),
+            models.Index(fields=['user', 'action'], name='activitylog_user_action_idx'),
+        ]
+
+class ChunkedUpload(models.Model):
+    STATUS_CHOICES = (
+        ('uploading', 'Uploading'),
+        # Held by the one request writing a chunk or assembling the file
+        ('receiving', 'Receiving'),
+        ('completing', 'Completing'),
+        ('complete', 'Complete'),
+    )
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    # Bytes safely on disk; the next chunk must start here
+    received_bytes = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    file_upload = models.ForeignKey(FileUpload, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received_bytes}/{self.total_size}) - {self.user.username}"
+    
+    @property
+    def part_name(self):
+        """Storage name of the partial file the chunks are appended to"""
+        return f'chunked/{self.id}.part'
+    
+    class Meta:
+        ordering = ['-created_at']
@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TimestampCursorPagination(CursorPagination):
+    """
+    Keyset pagination over ``(-timestamp, -id)``.
+
+    Each page is a ``WHERE timestamp < <cursor> ... LIMIT n`` range scan on
+    the ``(user, -timestamp, -id)`` index, so deep pages cost the same as the
+    first one. Rows sharing a timestamp are disambiguated by ``id`` and the
+    small offset DRF keeps in the cursor.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-timestamp', '-id')
+
+
+class UploadTimeCursorPagination(TimestampCursorPagination):
+    ordering = ('-upload_time', '-id')
@@ -0,0 +1,269 @@
+import codecs
+import hashlib
+import mmap
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.etree import ElementTree
+
+# Size of each read when streaming a file through the word counter.
+CHUNK_SIZE = 64 * 1024
+
+# ASCII bytes that str.split() treats as whitespace. In UTF-8 these never
+# occur inside a multi-byte sequence, so cutting a file right before one
+# splits it without breaking a character or a word.
+_WHITESPACE_BYTES = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+
+# Every byte as b' ' (whitespace) or b'x' (part of a word), so that in ASCII
+# text each word starts at a b' x' transition
+_WORD_BYTES = bytes(0x20 if byte in _WHITESPACE_BYTES else 0x78 for byte in range(256))
+
+# UTF-8 text files at least this large are counted through a memory map
+MMAP_MIN_SIZE = 1024 * 1024
+
+# WordprocessingML tags that matter for word boundaries
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_BODY = _W_NS + 'body'
+_W_TEXT = _W_NS + 't'
+_W_TAB = _W_NS + 'tab'
+_W_BREAKS = (_W_NS + 'br', _W_NS + 'cr')
+_W_BLOCKS = (_W_NS + 'p', _W_NS + 'tc')
+
+
+def digest_chunks(chunks):
+    """Return the SHA-256 hex digest of an iterable of byte chunks"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_text_chunks(file_obj, chunk_size=CHUNK_SIZE):
+    """Yield successive fixed-size chunks from an open text file"""
+    while True:
+        chunk = file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def count_words_in_chunks(chunks, in_word=False):
+    """
+    Count whitespace-separated words across an iterable of text chunks.
+
+    Gives the same result as ``len(''.join(chunks).split())`` while only
+    holding one chunk at a time. A word split across a chunk boundary is
+    counted once; ``in_word`` says the text before the first chunk ended in
+    a word that was already counted.
+    """
+    count = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        count += len(chunk.split())
+        # The first token of this chunk continues the previous chunk's last word
+        if in_word and not chunk[0].isspace():
+            count -= 1
+        in_word = not chunk[-1].isspace()
+    return count
+
+
+def _is_utf8(encoding):
+    return codecs.lookup(encoding).name == 'utf-8'
+
+
+def count_words(file_path, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    """Stream a text file from disk and return its word count"""
+    if _is_utf8(encoding) and os.path.getsize(file_path) >= MMAP_MIN_SIZE:
+        try:
+            return count_words_mapped(file_path, encoding=encoding)
+        except OSError:
+            pass  # Not mappable (e.g. some network filesystems); read it instead
+    with open(file_path, 'r', encoding=encoding) as f:
+        return count_words_in_chunks(iter_text_chunks(f, chunk_size))
+
+
+def _decode_mapped(mapped, start, end, encoding, chunk_size):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for offset in range(start, end, chunk_size):
+        yield decoder.decode(mapped[offset:min(offset + chunk_size, end)])
+    yield decoder.decode(b'', final=True)
+
+
+def count_words_mapped(file_path, start=0, end=None, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    """
+    Count the words in bytes ``[start, end)`` of a UTF-8 file through a memory map.
+
+    ASCII is scanned as bytes without decoding: one ``translate`` marks each
+    byte as whitespace or word, and words are counted as whitespace-to-word
+    transitions. Whitespace outside ASCII (U+00A0, U+2003, ...) needs
+    decoding. From the first chunk holding a non-ASCII byte, the rest is
+    therefore decoded incrementally and counted like ``count_words``. Either
+    way the result equals ``len(text.split())``.
+    """
+    with open(file_path, 'rb') as f:
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        if end <= start:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            count = 0
+            in_word = False
+            for offset in range(start, end, chunk_size):
+                data = mapped[offset:min(offset + chunk_size, end)]
+                if not data.isascii():
+                    # Every byte before ``offset`` was ASCII, so it starts a character
+                    return count + count_words_in_chunks(
+                        _decode_mapped(mapped, offset, end, encoding, chunk_size), in_word
+                    )
+                marks = data.translate(_WORD_BYTES)
+                count += marks.count(b' x')
+                if not in_word and marks[0] == 0x78:
+                    count += 1
+                in_word = marks[-1] == 0x78
+            return count
+
+
+def _find_whitespace(f, offset, limit):
+    """Return the position of the first whitespace byte at or after ``offset``, or ``limit``"""
+    f.seek(offset)
+    while offset < limit:
+        block = f.read(min(CHUNK_SIZE, limit - offset))
+        if not block:
+            break
+        hits = [i for i in (block.find(bytes([b])) for b in _WHITESPACE_BYTES) if i != -1]
+        if hits:
+            return offset + min(hits)
+        offset += len(block)
+    return limit
+
+
+def split_byte_ranges(file_path, parts):
+    """
+    Split a file into at most ``parts`` contiguous ``(start, end)`` byte ranges.
+
+    Every range but the last ends right before a whitespace byte, so no word
+    (or UTF-8 character) straddles two ranges and their counts can be summed.
+    """
+    size = os.path.getsize(file_path)
+    step = max(1, -(-size // max(1, parts)))
+    ranges = []
+    start = 0
+    with open(file_path, 'rb') as f:
+        while start < size:
+            end = _find_whitespace(f, start + step, size) if start + step < size else size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def count_words_in_range(file_path, start, end, encoding='utf-8', chunk_size=CHUNK_SIZE):
+    """Count the words in bytes ``[start, end)`` of a file, memory-mapped for UTF-8 or else decoding incrementally"""
+    if _is_utf8(encoding):
+        try:
+            return count_words_mapped(file_path, start, end, encoding)
+        except OSError:
+            pass
+    decoder = codecs.getincrementaldecoder(encoding)()
+
+    def chunks():
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield decoder.decode(data)
+        yield decoder.decode(b'', final=True)
+
+    return count_words_in_chunks(chunks())
+
+
+def count_words_parallel(file_path, workers, encoding='utf-8'):
+    """
+    Count words by fanning whitespace-aligned byte ranges out to a process pool.
+
+    Falls back to a serial count if a pool cannot be started in this process.
+    """
+    ranges = split_byte_ranges(file_path, workers)
+    if len(ranges) < 2:
+        return count_words(file_path, encoding=encoding)
+    try:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [
+                pool.submit(count_words_in_range, file_path, start, end, encoding)
+                for start, end in ranges
+            ]
+            return sum(future.result() for future in futures)
+    except (OSError, AssertionError, BrokenProcessPool):
+        return count_words(file_path, encoding=encoding)
+
+
+def iter_docx_text(file_path):
+    """
+    Yield the text runs of a .docx document in reading order.
+
+    ``word/document.xml`` is decompressed and parsed incrementally, and each
+    finished block is dropped from the tree, so neither the XML nor a DOM of
+    the whole document is ever held in memory. Runs inside a paragraph are
+    yielded back to back (Word often splits one word across runs); tabs,
+    line breaks and paragraph ends are yielded as whitespace.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open('word/document.xml') as xml_stream:
+            body = None
+            depth = 0
+            body_depth = None
+            for event, elem in ElementTree.iterparse(xml_stream, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if elem.tag == _W_BODY:
+                        body, body_depth = elem, depth
+                    continue
+
+                depth -= 1
+                if elem.tag == _W_TEXT:
+                    if elem.text:
+                        yield elem.text
+                elif elem.tag == _W_TAB:
+                    yield '\t'
+                elif elem.tag in _W_BREAKS or elem.tag in _W_BLOCKS:
+                    yield '\n'
+
+                # Release each top-level block (paragraph, table, ...) once parsed
+                if body is not None and depth == body_depth:
+                    body.clear()
+
+
+def read_preview(file_path, limit, encoding='utf-8'):
+    """Return the first ``limit`` characters of an uploaded file's text"""
+    if os.path.splitext(file_path)[1].lower() == '.docx':
+        parts = []
+        length = 0
+        for text in iter_docx_text(file_path):
+            parts.append(text)
+            length += len(text)
+            if length >= limit:
+                break
+        return ''.join(parts)[:limit]
+    with open(file_path, 'r', encoding=encoding) as f:
+        return f.read(limit)
+
+
+def count_file_words(file_path, parallel_threshold=0, parallel_workers=1):
+    """
+    Return the word count of an uploaded file, picking the reader by extension.
+
+    Text files of at least ``parallel_threshold`` bytes (0 disables) are
+    counted across ``parallel_workers`` processes.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.docx':
+        return count_words_in_chunks(iter_docx_text(file_path))
+    if (parallel_threshold and parallel_workers > 1
+            and os.path.getsize(file_path) >= parallel_threshold):
+        return count_words_parallel(file_path, parallel_workers)
+    return count_words(file_path)
@@ -1,21 +1,26 @@
+import os
+
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import FileUpload, PaymentTransaction, ActivityLog
+from django.core.files.storage import default_storage
+from .models import FileUpload, PaymentTransaction, ActivityLog, ChunkedUpload
+from .processing import digest_chunks
 
+ALLOWED_UPLOAD_EXTENSIONS = ['.txt', '.docx']
 
 
 # core/serializers.py
 class FileUploadSerializer(serializers.ModelSerializer):
     class Meta:
         model = FileUpload
-        fields = ['id', 'user', 'file', 'upload_time', 'status', 'word_count']
-        read_only_fields = ['id', 'user', 'upload_time', 'status', 'word_count']
+        fields = ['id', 'user', 'file', 'upload_time', 'status', 'word_count', 'text_stats']
+        read_only_fields = ['id', 'user', 'upload_time', 'status', 'word_count', 'text_stats']
     
     def validate_file(self, value):
         # Check file extension
-        import os
         ext = os.path.splitext(value.name)[1].lower()
-        if ext not in ['.txt', '.docx']:
+        if ext not in ALLOWED_UPLOAD_EXTENSIONS:
             raise serializers.ValidationError("Only .txt and .docx files are allowed.")
         
         # Check file size (limit to 10MB)
@@ -26,14 +31,63 @@ class FileUploadSerializer(serializers.ModelSerializer):
         return value
     
     def create(self, validated_data):
-        # Get the file from validated data
-        file_obj = validated_data['file']
-        
-        # Set the filename from the file object
-        validated_data['filename'] = file_obj.name
         validated_data['user'] = self.context['request'].user
-        
+        validated_data.update(_file_fields(validated_data['user'], [validated_data['file']])[0])
         return super().create(validated_data)
+
+def _file_fields(user, file_objs):
+    """Return the FileUpload fields derived from each of ``user``'s uploaded files"""
+    rows = [
+        {
+            # Set the filename from the file object
+            'filename': file_obj.name,
+            'file': file_obj,
+            # Hash the upload as it streams through, so duplicates can reuse results
+            'content_digest': digest_chunks(file_obj.chunks()),
+        }
+        for file_obj in file_objs
+    ]
+    
+    if settings.FILE_UPLOAD_REUSE_DUPLICATES:
+        # Only the user's own copies: the stored name carries the original filename.
+        # The extension picks the parser, so a .docx never reuses a .txt blob
+        stored = {
+            (digest, os.path.splitext(name)[1].lower()): name
+            for digest, name in FileUpload.objects.filter(
+                user=user, content_digest__in={row['content_digest'] for row in rows}
+            ).order_by().values_list('content_digest', 'file')
+        }
+        for row in rows:
+            existing_name = stored.get((row['content_digest'], os.path.splitext(row['filename'])[1].lower()))
+            if existing_name and default_storage.exists(existing_name):
+                # Point at the stored copy instead of writing the same bytes again
+                row['file'] = existing_name
+    
+    return rows
+
+class BulkFileUploadSerializer(serializers.Serializer):
+    """Validates many files with FileUploadSerializer's rules and inserts them together"""
+    files = serializers.ListField(child=serializers.FileField(), allow_empty=False)
+    
+    def validate_files(self, value):
+        checker = FileUploadSerializer()
+        errors = {}
+        for index, file_obj in enumerate(value):
+            try:
+                checker.validate_file(file_obj)
+            except serializers.ValidationError as e:
+                errors[index] = {'file': e.detail}
+        if errors:
+            raise serializers.ValidationError(errors)
+        return value
+    
+    def create(self, validated_data):
+        user = self.context['request'].user
+        # bulk_create runs FileField.pre_save, which writes each file to storage
+        return FileUpload.objects.bulk_create([
+            FileUpload(user=user, status='processing', **fields)
+            for fields in _file_fields(user, validated_data['files'])
+        ])
     
 class PaymentTransactionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -45,4 +99,29 @@ class ActivityLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = ActivityLog
         fields = ['id', 'user', 'action', 'metadata', 'timestamp']
-        read_only_fields = ['id', 'user', 'timestamp']
\ No newline at end of file
+        read_only_fields = ['id', 'user', 'timestamp']
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    size = serializers.IntegerField(source='total_size', min_value=1)
+    offset = serializers.IntegerField(source='received_bytes', read_only=True)
+    
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'filename', 'size', 'offset', 'status', 'file_upload', 'created_at']
+        read_only_fields = ['id', 'offset', 'status', 'file_upload', 'created_at']
+    
+    def validate_filename(self, value):
+        import os
+        # Keep only the base name; the client's directory layout is irrelevant
+        value = os.path.basename(value.replace('\\', '/'))
+        ext = os.path.splitext(value)[1].lower()
+        if ext not in ALLOWED_UPLOAD_EXTENSIONS:
+            raise serializers.ValidationError("Only .txt and .docx files are allowed.")
+        return value
+    
+    def validate_size(self, value):
+        if value > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"File size exceeds {settings.CHUNKED_UPLOAD_MAX_SIZE // (1024 * 1024)}MB limit."
+            )
+        return value
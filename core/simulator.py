@@ -0,0 +1,170 @@
+"""
+Local stand-in for the aamarPay gateway.
+
+``GatewaySimulator`` serves ``jsonpost.php`` on a local port with a
+configurable response latency and error rate, so the payment path can be
+exercised and benchmarked without the sandbox. Each accepted payment gets
+a ``payment_url`` on the simulator; opening it redirects to the success,
+fail or cancel URL from the payment request, picked by ``outcomes``
+weights, the way the hosted checkout does. With ``callback_delay`` set, the
+simulator also calls that URL itself once the delay has passed, recording
+the status and latency of each callback.
+
+Run it standalone with ``python manage.py run_gateway_simulator``.
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+import requests
+
+OUTCOME_URLS = {
+    'success': 'success_url',
+    'failed': 'fail_url',
+    'cancelled': 'cancel_url',
+}
+
+
+def parse_outcomes(value):
+    """Parse ``success=8,failed=1,cancelled=1`` into a weights dict"""
+    outcomes = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OUTCOME_URLS:
+            raise ValueError(f"Unknown outcome '{name}'; expected one of {', '.join(OUTCOME_URLS)}")
+        outcomes[name] = float(weight or 1)
+    return outcomes
+
+
+class GatewaySimulator:
+    """Threaded HTTP server that answers like aamarPay's jsonpost.php"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, outcomes=None,
+                 callback_delay=None, host='127.0.0.1', port=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.outcomes = outcomes or {'success': 1}
+        self.callback_delay = callback_delay
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.client_ports = set()
+        # (transaction id, outcome, HTTP status, seconds) per completed callback
+        self.callbacks = []
+        self._payments = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._timers = []
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                self.send_json(simulator.handle_payment(payload, self.client_address[1]))
+
+            def do_GET(self):
+                # /pay/<tran_id>: the hosted checkout page, answered at once
+                tran_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+                url = simulator.checkout_redirect(tran_id)
+                self.send_response(302 if url else 404)
+                if url:
+                    self.send_header('Location', url)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def send_json(self, data):
+                body = json.dumps(data).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://{host}:{self.server.server_address[1]}'
+        self.url = f'{self.base_url}/jsonpost.php'
+
+    def handle_payment(self, payload, client_port=None):
+        with self._lock:
+            self.requests += 1
+            self.client_ports.add(client_port)
+            failed = self.random.random() < self.error_rate
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            if failed:
+                self.errors += 1
+            else:
+                self._payments[payload['tran_id']] = payload
+        time.sleep(delay)
+        if failed:
+            return {'result': 'false', 'message': 'Simulated gateway error'}
+        if self.callback_delay is not None:
+            timer = threading.Timer(self.callback_delay, self._send_callback, args=(payload['tran_id'],))
+            timer.daemon = True
+            with self._lock:
+                self._timers.append(timer)
+            timer.start()
+        return {'result': 'true', 'payment_url': f"{self.base_url}/pay/{payload['tran_id']}"}
+
+    def pick_outcome(self):
+        with self._lock:
+            names = list(self.outcomes)
+            return self.random.choices(names, weights=[self.outcomes[name] for name in names])[0]
+
+    def callback_url(self, tran_id, outcome):
+        payload = self._payments[tran_id]
+        return f"{payload[OUTCOME_URLS[outcome]]}?{urlencode({'mer_txnid': tran_id})}"
+
+    def checkout_redirect(self, tran_id):
+        if tran_id not in self._payments:
+            return None
+        return self.callback_url(tran_id, self.pick_outcome())
+
+    def _send_callback(self, tran_id):
+        outcome = self.pick_outcome()
+        started = time.perf_counter()
+        try:
+            response = self._session.get(self.callback_url(tran_id, outcome), allow_redirects=False, timeout=30)
+            status_code = response.status_code
+        except requests.RequestException:
+            status_code = None
+        with self._lock:
+            self.callbacks.append((tran_id, outcome, status_code, time.perf_counter() - started))
+
+    def wait_for_callbacks(self, count, timeout=30):
+        """Block until ``count`` callbacks have completed; returns whether they did"""
+        deadline = time.monotonic() + timeout
+        while len(self.callbacks) < count:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            timers, self._timers = self._timers, []
+        for timer in timers:
+            timer.cancel()
+        self.server.shutdown()
+        self.server.server_close()
+        self._session.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,80 @@
+"""
+SQLite settings for concurrent writers.
+
+With ``SQLITE_TUNING`` on, every new SQLite connection is switched to WAL, so
+readers no longer block the writer or each other. It also gets
+``SQLITE_SYNCHRONOUS``, a ``busy_timeout`` and a memory map, and opens
+transactions with ``BEGIN IMMEDIATE``. Taking the write lock when an atomic
+block starts means a waiting writer sits out ``busy_timeout``. Upgrading a
+read lock mid-transaction would fail at once with "database is locked".
+
+``serialized_writes()`` queues writes from the word-count tasks on a lock
+shared by the threads of a process and, where ``fcntl`` is available, by
+every process using the same database file. Writers are then handed the
+lock in turn. Without it they poll through SQLite's busy handler, which
+sleeps for up to 100ms between attempts.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+try:
+    import fcntl
+except ImportError:  # Windows: other processes still wait on busy_timeout
+    fcntl = None
+
+_thread_lock = threading.Lock()
+# (pid, lock file path) -> open file; reopened after a fork, since flock
+# does not exclude processes sharing an inherited descriptor
+_lock_files = {}
+
+
+def _is_file_database(connection):
+    name = str(connection.settings_dict['NAME'])
+    return not connection.is_in_memory_db() and name != ''
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not settings.SQLITE_TUNING:
+        return
+    # The raw connection, so the pragmas stay out of query logs and metrics
+    raw = connection.connection
+    raw.execute(f'PRAGMA busy_timeout = {int(settings.SQLITE_BUSY_TIMEOUT)}')
+    if _is_file_database(connection):
+        raw.execute(f'PRAGMA journal_mode = {settings.SQLITE_JOURNAL_MODE}')
+    raw.execute(f'PRAGMA synchronous = {settings.SQLITE_SYNCHRONOUS}')
+    raw.execute(f'PRAGMA mmap_size = {int(settings.SQLITE_MMAP_SIZE)}')
+    connection.transaction_mode = 'IMMEDIATE'
+
+
+def _lock_file(path):
+    key = (os.getpid(), path)
+    lock_file = _lock_files.get(key)
+    if lock_file is None:
+        lock_file = _lock_files[key] = open(path, 'a+b')
+    return lock_file
+
+
+@contextmanager
+def serialized_writes(using=DEFAULT_DB_ALIAS):
+    """Hold the database's write lock for the block when it is SQLite and serialisation is on"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or not settings.SQLITE_SERIALIZE_WRITES:
+        yield
+        return
+    with _thread_lock:
+        if fcntl is None or not _is_file_database(connection):
+            yield
+            return
+        lock_file = _lock_file(f"{connection.settings_dict['NAME']}-writelock")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -1,41 +1,212 @@
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from celery import shared_task
 from django.conf import settings
-from .models import FileUpload
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from payment_file_upload.celery_app import LARGE_FILES_QUEUE, SMALL_FILES_QUEUE
+from .dashboard_cache import invalidate_dashboard
+from .events import publish_file_status
+from .metrics import WORD_COUNT_BYTES
+from .models import ActivityLog, ChunkedUpload, FileUpload
+from .processing import count_file_words, read_preview
+from .sqlite_tuning import serialized_writes
+from .textstats import analyze_file
+from .uploads import discard_session
+
+# Fields filled in by processing a file
+RESULT_FIELDS = ('word_count', 'text_stats', 'preview')
+
+
+def _apply_results(file_upload, results):
+    """Set the analysis fields on an upload and mark it completed"""
+    for field, value in results.items():
+        setattr(file_upload, field, value)
+    file_upload.status = 'completed'
+
+
+def _count_upload(file_upload):
+    """Count one upload's words (and statistics), recording them, the preview and status on the instance"""
+    # Get the file path
+    file_path = os.path.join(settings.MEDIA_ROOT, file_upload.file.name)
+    
+    # Check if file exists and is accessible
+    if not os.path.exists(file_path):
+        file_upload.status = 'failed'
+        file_upload.error_message = 'File not found'
+        return file_upload
+    
+    # Process the file with proper error handling
+    try:
+        # Stream the file in fixed-size chunks so memory stays flat
+        # regardless of upload size (.docx bodies are parsed incrementally)
+        # Text files above WORD_COUNT_PARALLEL_THRESHOLD are split across processes
+        parallel = {
+            'parallel_threshold': settings.WORD_COUNT_PARALLEL_THRESHOLD,
+            'parallel_workers': settings.WORD_COUNT_PARALLEL_WORKERS,
+        }
+        if settings.TEXT_STATS_ENABLED:
+            # One pass yields the word count and the statistics together
+            results = analyze_file(
+                file_path,
+                sketch_size=settings.TEXT_STATS_SKETCH_SIZE,
+                exact_distinct_limit=settings.TEXT_STATS_EXACT_DISTINCT_LIMIT,
+                **parallel,
+            ).as_fields(settings.TEXT_STATS_TOP_WORDS)
+        else:
+            results = {'word_count': count_file_words(file_path, **parallel)}
+        if settings.FILE_PREVIEW_SIZE:
+            results['preview'] = FileUpload.compress_preview(read_preview(file_path, settings.FILE_PREVIEW_SIZE))
+        _apply_results(file_upload, results)
+        if settings.METRICS_ENABLED:
+            WORD_COUNT_BYTES.observe(os.path.getsize(file_path))
+    except PermissionError:
+        file_upload.status = 'failed'
+        file_upload.error_message = 'Permission denied when accessing file'
+    except Exception as e:
+        file_upload.status = 'failed'
+        file_upload.error_message = str(e)
+    return file_upload
+
+
+def _result_key(file_upload):
+    """Content digest and extension: the same bytes count differently as .txt and .docx"""
+    return file_upload.content_digest, os.path.splitext(file_upload.file.name)[1].lower()
+
+
+def _cached_results(file_uploads):
+    """Map ``_result_key``s to the results of an already-completed upload of the same kind"""
+    digests = {upload.content_digest for upload in file_uploads if upload.content_digest}
+    if not digests:
+        return {}
+    rows = FileUpload.objects.filter(
+        content_digest__in=digests,
+        status='completed',
+        word_count__isnull=False,
+    )
+    if settings.TEXT_STATS_ENABLED:
+        # Not an upload counted while statistics were off
+        rows = rows.filter(text_stats__isnull=False)
+    rows = rows.order_by().values('content_digest', 'file', *RESULT_FIELDS)
+    return {
+        (row.pop('content_digest'), os.path.splitext(row.pop('file'))[1].lower()): row
+        for row in rows
+    }
+
 
 @shared_task
 def process_file_word_count_with_content(file_upload_id):
     try:
         file_upload = FileUpload.objects.get(id=file_upload_id)
-        
-        # Get the file path
-        file_path = os.path.join(settings.MEDIA_ROOT, file_upload.file.name)
-        
-        # Check if file exists and is accessible
-        if not os.path.exists(file_path):
-            file_upload.status = 'failed'
-            file_upload.error_message = 'File not found'
-            file_upload.save()
-            return
-        
-        # Process the file with proper error handling
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                word_count = len(content.split())
-                
-                file_upload.word_count = word_count
-                file_upload.content = content
-                file_upload.status = 'completed'
-                file_upload.save()
-        except PermissionError:
-            file_upload.status = 'failed'
-            file_upload.error_message = 'Permission denied when accessing file'
-            file_upload.save()
-        except Exception as e:
-            file_upload.status = 'failed'
-            file_upload.error_message = str(e)
-            file_upload.save()
-            
     except FileUpload.DoesNotExist:
-        return
\ No newline at end of file
+        return
+    
+    # Duplicate content: reuse the earlier result without touching the file
+    cached = _cached_results([file_upload])
+    if _result_key(file_upload) in cached:
+        _apply_results(file_upload, cached[_result_key(file_upload)])
+    else:
+        _count_upload(file_upload)
+    # Queue behind other workers' saves instead of polling SQLite's lock
+    with serialized_writes():
+        file_upload.save()
+    invalidate_dashboard(file_upload.user_id, 'files')
+    publish_file_status(file_upload)
+
+
+@shared_task
+def process_file_word_count_batch(file_upload_ids):
+    """Count many uploads with one SELECT and one bulk UPDATE"""
+    file_uploads = list(
+        FileUpload.objects.filter(id__in=file_upload_ids)
+        .only('id', 'user_id', 'file', 'status', 'content_digest', *RESULT_FIELDS)
+    )
+    if not file_uploads:
+        return 0
+    
+    cached = _cached_results(file_uploads)
+    to_count = []
+    for file_upload in file_uploads:
+        if _result_key(file_upload) in cached:
+            _apply_results(file_upload, cached[_result_key(file_upload)])
+        else:
+            to_count.append(file_upload)
+    
+    if to_count:
+        workers = min(settings.WORD_COUNT_BATCH_WORKERS, len(to_count))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_count_upload, to_count))
+    
+    with serialized_writes():
+        FileUpload.objects.bulk_update(file_uploads, ['status', *RESULT_FIELDS])
+    invalidate_dashboard([upload.user_id for upload in file_uploads], 'files')
+    publish_file_status(file_uploads)
+    return len(file_uploads)
+
+
+def queue_word_count(file_upload_id, size):
+    """Enqueue an interactive upload's word count on the small- or large-file queue by its size in bytes"""
+    queue = LARGE_FILES_QUEUE if size >= settings.WORD_COUNT_LARGE_FILE_SIZE else SMALL_FILES_QUEUE
+    process_file_word_count_with_content.apply_async((file_upload_id,), queue=queue)
+
+
+def queue_word_count_batches(file_upload_ids):
+    """Split upload ids into WORD_COUNT_BATCH_SIZE chunks and enqueue one message per chunk"""
+    file_upload_ids = list(file_upload_ids)
+    batch_size = settings.WORD_COUNT_BATCH_SIZE
+    for start in range(0, len(file_upload_ids), batch_size):
+        process_file_word_count_batch.delay(file_upload_ids[start:start + batch_size])
+
+
+@shared_task
+def dispatch_pending_word_counts():
+    """
+    Coalesce uploads that are waiting for processing into batch messages.
+
+    Runs periodically when WORD_COUNT_BATCHING is enabled, in which case
+    uploads are not enqueued individually. Each run claims every unclaimed
+    upload with one conditional UPDATE and queues what it claimed, so an
+    upload is queued once however many workers run the dispatcher, and one
+    committed late is picked up by the next run.
+    """
+    if not settings.WORD_COUNT_BATCHING:
+        return 0
+    
+    claim = uuid.uuid4()
+    claimed = FileUpload.objects.filter(status='processing', batch_claim__isnull=True).update(batch_claim=claim)
+    if not claimed:
+        return 0
+    claimed_ids = list(
+        FileUpload.objects.filter(batch_claim=claim)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    queue_word_count_batches(claimed_ids)
+    return len(claimed_ids)
+
+
+@shared_task
+def write_activity_logs(events):
+    """Persist a batch of activity events queued by the celery activity-log backend"""
+    for event in events:
+        event['timestamp'] = parse_datetime(event['timestamp'])
+    ActivityLog.objects.bulk_create([ActivityLog(**event) for event in events])
+    invalidate_dashboard([event['user_id'] for event in events], 'activity')
+    return len(events)
+
+
+@shared_task
+def purge_stale_chunked_uploads():
+    """Delete chunked upload sessions (and their part files) abandoned past the expiry"""
+    cutoff = timezone.now() - timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRY_HOURS)
+    # Sessions claimed by a request that died mid-write are stale as well
+    stale = ChunkedUpload.objects.filter(
+        status__in=('uploading', 'receiving', 'completing'), updated_at__lt=cutoff
+    )
+    count = 0
+    for session in stale.iterator():
+        discard_session(session)
+        count += 1
+    return count
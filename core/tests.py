@@ -1,3 +1,2206 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from celery.signals import task_postrun, task_prerun
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.conf import settings
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from payment_file_upload.celery_app import (
+    BULK_QUEUE,
+    LARGE_FILES_QUEUE,
+    SMALL_FILES_QUEUE,
+    app as celery_app,
+    size_worker_for_queues,
+)
+
+from . import activity, gateway, metrics, textstats, uploads
+from .activity import ActivityLogBuffer, flush_activity_logs, log_activity
+from .db_router import ReplicaRouter, read_replica, replica_reads
+from .entitlements import has_successful_payment
+from .events import publish_file_status, read_events
+from .management.commands.benchmark_pipeline import parse_size, write_corpus
+from .models import ActivityLog, ChunkedUpload, FileUpload, PaymentTransaction
+from .processing import (
+    CHUNK_SIZE,
+    count_file_words,
+    count_words,
+    count_words_in_chunks,
+    count_words_mapped,
+    count_words_parallel,
+    digest_chunks,
+    iter_docx_text,
+    iter_text_chunks,
+    split_byte_ranges,
+)
+from .simulator import GatewaySimulator, parse_outcomes
+from .sqlite_tuning import serialized_writes
+from .textstats import analyze_chunks, analyze_file, analyze_range
+from .tasks import (
+    dispatch_pending_word_counts,
+    process_file_word_count_batch,
+    process_file_word_count_with_content,
+    purge_stale_chunked_uploads,
+    queue_word_count_batches,
+    write_activity_logs,
+)
+
+
+# Timing and large-file benchmarks print their numbers and take a while, so
+# they only run with RUN_BENCHMARKS=1; fast tests keep the assertions
+_run_benchmarks = skipUnless(os.getenv('RUN_BENCHMARKS'), 'set RUN_BENCHMARKS=1 to run benchmarks')
+
+
+def benchmark(test_item):
+    """Skip unless RUN_BENCHMARKS is set; a ``ReportMixin`` class also reports its numbers"""
+    if isinstance(test_item, type):
+        test_item.REPORT = True
+    return _run_benchmarks(test_item)
+
+
+class ReportMixin:
+    """
+    Shared by a scaled-down test and its ``@benchmark`` subclass.
+
+    Only the benchmark prints its numbers and checks wall-clock comparisons,
+    which are noise at test scale.
+    """
+    REPORT = False
+
+    def report(self, message):
+        if self.REPORT:
+            print(f"\n  {message}", end='')
+
+    def assertFaster(self, seconds, than):
+        if self.REPORT:
+            self.assertLess(seconds, than)
+
+
+# Write activity synchronously unless a test opts into buffering, so no
+# buffered event outlives the test database and gets flushed at exit
+_sync_activity_log = override_settings(ACTIVITY_LOG_BACKEND='sync')
+
+
+def setUpModule():
+    _sync_activity_log.enable()
+
+
+def tearDownModule():
+    _sync_activity_log.disable()
+
+
+class MediaRootMixin:
+    """Point MEDIA_ROOT at a throwaway directory for the duration of a test"""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write_media_file(self, name, data):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+
+def build_docx(path, paragraphs):
+    """Write a minimal .docx whose body holds ``paragraphs`` (lists of runs)"""
+    body = ''.join(
+        '<w:p>' + ''.join(f'<w:r><w:t xml:space="preserve">{run}</w:t></w:r>' for run in runs) + '</w:p>'
+        for runs in paragraphs
+    )
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}</w:body></w:document>'
+    )
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', '<Types/>')
+        archive.writestr('word/document.xml', document)
+    return path
+
+
+class StreamingWordCountTests(SimpleTestCase):
+    def test_matches_str_split_across_chunk_boundaries(self):
+        text = "  alpha beta\tgamma\n\ndelta  épsilon zeta  eta "
+        for size in range(1, len(text) + 1):
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            self.assertEqual(count_words_in_chunks(chunks), len(text.split()), size)
+
+    def test_empty_and_whitespace_only(self):
+        self.assertEqual(count_words_in_chunks([]), 0)
+        self.assertEqual(count_words_in_chunks(['', '   ', '\n\t']), 0)
+
+    def test_file_with_small_chunk_size(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8', delete=False) as f:
+            f.write("one two three\nfour five six seven")
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(count_words(f.name, chunk_size=3), 7)
+
+
+class MappedWordCountTests(SimpleTestCase):
+    # ASCII whitespace str.split() knows and bytes.split() does not (\x1c-\x1f),
+    # non-whitespace controls, multi-byte characters and Unicode whitespace
+    PIECES = [
+        'a', 'Zz', '42', '.', ' ', '  ', '\t', '\n', '\r\n', '\x0b', '\x0c', '\x1c', '\x1f', '\x00', '\x7f',
+        'é', 'ß', '中', '🚀', '\xa0', '\x85', '\u2003', '\u2028', '\u3000',
+    ]
+    ASCII_PIECES = [piece for piece in PIECES if piece.isascii()]
+
+    def write(self, text):
+        fd, path = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def random_text(self, rng):
+        # Mostly ASCII, with any non-ASCII starting at a random point
+        pieces = [rng.choice(self.ASCII_PIECES) for _ in range(rng.randint(0, 200))]
+        if rng.random() < 0.6:
+            pieces[rng.randint(0, len(pieces)):] = [rng.choice(self.PIECES) for _ in range(rng.randint(1, 60))]
+        return ''.join(pieces)
+
+    def test_matches_str_split_on_random_text(self):
+        rng = random.Random(2024)
+        for case in range(400):
+            text = self.random_text(rng)
+            path = self.write(text)
+            expected = len(text.split())
+            chunk_size = rng.randint(1, 17)
+            self.assertEqual(count_words_mapped(path, chunk_size=chunk_size), expected, (case, chunk_size, text))
+            ranges = split_byte_ranges(path, rng.randint(2, 5))
+            self.assertEqual(
+                sum(count_words_mapped(path, start, end, chunk_size=chunk_size) for start, end in ranges),
+                expected,
+                (case, ranges, text),
+            )
+
+    def test_empty_file(self):
+        self.assertEqual(count_words_mapped(self.write('')), 0)
+
+    def test_large_files_are_counted_through_the_map(self):
+        path = self.write('one two\u2003three ' * 10)
+        with mock.patch('core.processing.MMAP_MIN_SIZE', 64), \
+                mock.patch('core.processing.count_words_mapped', wraps=count_words_mapped) as mapped:
+            self.assertEqual(count_words(path), 30)
+        mapped.assert_called_once()
+
+    def test_invalid_utf8_after_ascii_is_still_an_error(self):
+        path = self.write('plain ascii words ')
+        with open(path, 'ab') as f:
+            f.write(b'\xff')
+        with self.assertRaises(UnicodeDecodeError):
+            count_words_mapped(path)
+
+    @benchmark
+    def test_mapped_count_benchmark(self):
+        line = "lorem ipsum dolor sit amet, consectetur adipiscing elit\n"
+        path = self.write(line * (32 * 1024 * 1024 // len(line)))
+
+        started = time.perf_counter()
+        with open(path, 'r', encoding='utf-8') as f:
+            decoded = count_words_in_chunks(iter_text_chunks(f))
+        decoded_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        mapped = count_words_mapped(path)
+        mapped_seconds = time.perf_counter() - started
+
+        print(f"\n  32 MB decoded {decoded_seconds:.3f}s, mapped {mapped_seconds:.3f}s", end='')
+        self.assertEqual(mapped, decoded)
+
+
+class ParallelWordCountTests(SimpleTestCase):
+    TEXT = "Grüße  aus\tDhaka\u00a0—  ৳100 paid\x1cok\n\nnaïve  café " * 500
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8', delete=False) as f:
+            f.write(self.TEXT)
+        self.path = f.name
+        self.addCleanup(os.remove, self.path)
+
+    def test_ranges_cover_file_on_whitespace_boundaries(self):
+        data = open(self.path, 'rb').read()
+        for parts in (1, 2, 3, 7, 16):
+            ranges = split_byte_ranges(self.path, parts)
+            self.assertLessEqual(len(ranges), parts)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertTrue(data[start:start + 1].decode('ascii').isspace())
+
+    def test_parallel_count_matches_str_split(self):
+        expected = len(self.TEXT.split())
+        for workers in (2, 3, 8):
+            self.assertEqual(count_words_parallel(self.path, workers), expected)
+
+    def test_file_without_whitespace_is_one_range(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('x' * 100_000)
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(split_byte_ranges(f.name, 4), [(0, 100_000)])
+        self.assertEqual(count_words_parallel(f.name, 4), 1)
+
+    def test_threshold_selects_parallel_path(self):
+        with mock.patch('core.processing.count_words_parallel', return_value=42) as parallel:
+            self.assertEqual(count_file_words(self.path, parallel_threshold=10, parallel_workers=4), 42)
+            parallel.assert_called_once_with(self.path, 4)
+            self.assertEqual(
+                count_file_words(self.path, parallel_threshold=10 ** 9, parallel_workers=4),
+                len(self.TEXT.split()),
+            )
+
+    @benchmark
+    def test_parallel_latency_benchmark(self):
+        workers = os.cpu_count() or 1
+        line = "lorem ipsum dolor sit amet, consectetur adipiscing elit\n"
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write(line * (32 * 1024 * 1024 // len(line)))
+        self.addCleanup(os.remove, f.name)
+
+        started = time.perf_counter()
+        serial = count_words(f.name)
+        serial_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        parallel = count_words_parallel(f.name, max(2, workers))
+        parallel_seconds = time.perf_counter() - started
+
+        print(
+            f"\n  32 MB serial {serial_seconds:.3f}s, parallel x{max(2, workers)} {parallel_seconds:.3f}s",
+            end='',
+        )
+        self.assertEqual(serial, parallel)
+
+
+class DocxExtractionTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def test_runs_join_and_paragraphs_separate(self):
+        path = build_docx(os.path.join(self.directory, 'doc.docx'), [
+            ['Hel', 'lo world'],
+            ['second ', 'paragraph'],
+            ['last'],
+        ])
+        self.assertEqual(''.join(iter_docx_text(path)).split(), ['Hello', 'world', 'second', 'paragraph', 'last'])
+        self.assertEqual(count_file_words(path), 5)
+
+    def test_tabs_and_breaks_separate_words(self):
+        path = os.path.join(self.directory, 'tabs.docx')
+        document = (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+            '<w:p><w:r><w:t>one</w:t><w:tab/><w:t>two</w:t><w:br/><w:t>three</w:t></w:r></w:p>'
+            '</w:body></w:document>'
+        )
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr('word/document.xml', document)
+        self.assertEqual(count_file_words(path), 3)
+
+    def test_large_document_is_parsed_in_bounded_memory(self):
+        paragraph = ['lorem ipsum dolor ', 'sit amet consectetur']
+        path = build_docx(os.path.join(self.directory, 'big.docx'), [paragraph] * 100_000)
+        tracemalloc.start()
+        try:
+            self.assertEqual(count_file_words(path), 100_000 * 6)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+
+class TextStatsTests(SimpleTestCase):
+    TEXT = (
+        "The quick brown fox. The LAZY dog?\n"
+        "“Quoted,” she said!  Grüße aus\tDhaka — the end...\n"
+        "no terminator here"
+    )
+
+    def reference(self, text):
+        terms = [token.lower().strip(textstats._TERM_PUNCTUATION) for token in text.split()]
+        terms = [term for term in terms if term]
+        return terms
+
+    def test_matches_reference_across_chunk_boundaries(self):
+        terms = self.reference(self.TEXT)
+        for size in range(1, len(self.TEXT) + 1):
+            chunks = [self.TEXT[i:i + size] for i in range(0, len(self.TEXT), size)]
+            stats = analyze_chunks(chunks)
+            self.assertEqual(
+                (stats.words, stats.lines, stats.characters, stats.sentences, stats.distinct.count()),
+                (len(self.TEXT.split()), 3, len(self.TEXT), 5, len(set(terms))),
+                size,
+            )
+            self.assertEqual(stats.top_words(2), [['the', 3], ['aus', 1]])
+
+    def test_empty_and_newline_terminated(self):
+        self.assertEqual(analyze_chunks([]).as_fields(5), {
+            'word_count': 0,
+            'text_stats': {'lines': 0, 'characters': 0, 'sentences': 0, 'unique_words': 0, 'top_words': []},
+        })
+        stats = analyze_chunks(["one.\n", "two\n"])
+        self.assertEqual((stats.lines, stats.sentences), (2, 2))
+
+    def test_parallel_ranges_merge_to_the_serial_result(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8', delete=False) as f:
+            f.write(self.TEXT * 300)
+        self.addCleanup(os.remove, f.name)
+        serial = analyze_file(f.name).as_fields(5)
+        for parts in (2, 3, 7):
+            merged = None
+            for start, end in split_byte_ranges(f.name, parts):
+                stats = analyze_range(f.name, start, end)
+                merged = stats if merged is None else merged
+                if stats is not merged:
+                    merged.merge(stats)
+            self.assertEqual(merged.as_fields(5), serial, parts)
+        self.assertEqual(analyze_file(f.name, parallel_threshold=1, parallel_workers=3).as_fields(5), serial)
+
+    def test_sketches_bound_memory_for_large_vocabularies(self):
+        rng = random.Random(7)
+        vocabulary = 60_000
+        hot = [f'hot{i}' for i in range(3)]
+        chunks = [
+            ' '.join(rng.choice(hot) if rng.random() < 0.3 else f'w{rng.randrange(vocabulary)}' for _ in range(5_000)) + ' '
+            for _ in range(60)
+        ]
+        stats = analyze_chunks(chunks, sketch_size=100, exact_distinct_limit=1_000)
+        exact = len(set(' '.join(chunks).split()))
+
+        self.assertIsNotNone(stats.distinct.sketch)
+        self.assertFalse(stats.distinct.terms)
+        self.assertAlmostEqual(stats.distinct.count() / exact, 1, delta=0.03)
+        self.assertLessEqual(len(stats.frequent.counts), 100)
+        self.assertEqual(sorted(term for term, _ in stats.top_words(3)), hot)
+
+
+class StreamingWordCountMemoryTests(ReportMixin, SimpleTestCase):
+    """Peak traced memory must not grow with file size"""
+
+    SIZES = [1024, 1024 ** 2, 4 * 1024 ** 2]
+    # Generous bound: a handful of chunks plus the per-chunk token list
+    PEAK_LIMIT = 32 * CHUNK_SIZE
+
+    def _write_file(self, directory, size):
+        line = "lorem ipsum dolor sit amet, consectetur adipiscing elit\n"
+        block = line * (CHUNK_SIZE // len(line) + 1)
+        path = os.path.join(directory, f'{size}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            remaining = size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        return path
+
+    def test_peak_memory_is_flat(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+
+        peaks = {}
+        for size in self.SIZES:
+            path = self._write_file(directory, size)
+            tracemalloc.start()
+            try:
+                count_words(path)
+                peaks[size] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            os.remove(path)
+
+        for size, peak in peaks.items():
+            self.report(f"streaming count {size:>11,} bytes: peak {peak:>9,} bytes")
+            self.assertLess(peak, self.PEAK_LIMIT)
+
+
+@benchmark
+class StreamingWordCountMemoryBenchmark(StreamingWordCountMemoryTests):
+    SIZES = [1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2]
+
+
+class ProcessFileWordCountTaskTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('reader', password='pass')
+
+    def test_counts_words_and_statistics_in_one_pass(self):
+        self.write_media_file('uploads/notes.txt', "the quick brown fox\njumps over the lazy dog")
+        upload = FileUpload.objects.create(user=self.user, file='uploads/notes.txt', filename='notes.txt')
+
+        with mock.patch('core.tasks.analyze_file', wraps=analyze_file) as analyze, \
+                mock.patch('core.tasks.count_file_words') as counter:
+            process_file_word_count_with_content(upload.id)
+        analyze.assert_called_once()
+        counter.assert_not_called()
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, 'completed')
+        self.assertEqual(upload.word_count, 9)
+        self.assertEqual(upload.text_stats, {
+            'lines': 2, 'characters': 43, 'sentences': 1, 'unique_words': 8,
+            'top_words': [['the', 2], ['brown', 1], ['dog', 1], ['fox', 1], ['jumps', 1],
+                          ['lazy', 1], ['over', 1], ['quick', 1]],
+        })
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        data = client.get(f'/api/files/{upload.id}/').data
+        self.assertEqual(data['text_stats'], upload.text_stats)
+
+    @override_settings(TEXT_STATS_ENABLED=False)
+    def test_statistics_can_be_turned_off(self):
+        self.write_media_file('uploads/notes.txt', "one two three")
+        upload = FileUpload.objects.create(user=self.user, file='uploads/notes.txt', filename='notes.txt')
+        with mock.patch('core.tasks.count_file_words', wraps=count_file_words) as counter, \
+                mock.patch('core.tasks.analyze_file') as analyze, \
+                override_settings(WORD_COUNT_PARALLEL_THRESHOLD=1024, WORD_COUNT_PARALLEL_WORKERS=3):
+            process_file_word_count_with_content(upload.id)
+        counter.assert_called_once_with(mock.ANY, parallel_threshold=1024, parallel_workers=3)
+        analyze.assert_not_called()
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.word_count, 3)
+        self.assertIsNone(upload.text_stats)
+
+    @override_settings(TEXT_STATS_ENABLED=False)
+    def test_large_text_is_counted_through_the_map(self):
+        self.write_media_file('uploads/big.txt', 'plain ascii words\n' * 10)
+        upload = FileUpload.objects.create(user=self.user, file='uploads/big.txt', filename='big.txt')
+        with mock.patch('core.processing.MMAP_MIN_SIZE', 64), \
+                mock.patch('core.processing.count_words_mapped', wraps=count_words_mapped) as mapped, \
+                override_settings(WORD_COUNT_PARALLEL_THRESHOLD=0):
+            process_file_word_count_with_content(upload.id)
+        mapped.assert_called_once()
+        upload.refresh_from_db()
+        self.assertEqual(upload.word_count, 30)
+
+    def test_missing_file_marks_failed(self):
+        upload = FileUpload.objects.create(user=self.user, file='uploads/missing.txt', filename='missing.txt')
+
+        process_file_word_count_with_content(upload.id)
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, 'failed')
+        self.assertIsNone(upload.word_count)
+
+    def test_counts_docx_body_text(self):
+        os.makedirs(os.path.join(self.media_root, 'uploads'))
+        build_docx(os.path.join(self.media_root, 'uploads', 'report.docx'), [['Quarterly ', 'report'], ['all good']])
+        upload = FileUpload.objects.create(user=self.user, file='uploads/report.docx', filename='report.docx')
+
+        process_file_word_count_with_content(upload.id)
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, 'completed')
+        self.assertEqual(upload.word_count, 4)
+
+
+class FilePreviewTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('previewer', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def process(self, name, data):
+        self.write_media_file(f'uploads/{name}', data)
+        upload = FileUpload.objects.create(user=self.user, file=f'uploads/{name}', filename=name)
+        process_file_word_count_with_content(upload.id)
+        upload.refresh_from_db()
+        return upload
+
+    @override_settings(FILE_PREVIEW_SIZE=100)
+    def test_preview_is_compressed_and_truncated(self):
+        text = "naïve café " * 5000
+        upload = self.process('long.txt', text)
+
+        self.assertEqual(upload.preview_text, text[:100])
+        self.assertLess(len(upload.preview), 100)
+
+        response = self.client.get(f'/api/files/{upload.id}/preview/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'id': upload.id, 'status': 'completed', 'preview': text[:100]})
+
+    def test_docx_preview_is_extracted_text(self):
+        os.makedirs(os.path.join(self.media_root, 'uploads'))
+        build_docx(os.path.join(self.media_root, 'uploads', 'memo.docx'), [['Dear ', 'team'], ['thanks']])
+        upload = FileUpload.objects.create(user=self.user, file='uploads/memo.docx', filename='memo.docx')
+        process_file_word_count_with_content(upload.id)
+        upload.refresh_from_db()
+        self.assertEqual(upload.preview_text, "Dear team\nthanks\n")
+
+    @override_settings(FILE_PREVIEW_SIZE=0)
+    def test_preview_can_be_disabled(self):
+        upload = self.process('short.txt', "hello world")
+        self.assertIsNone(upload.preview)
+        self.assertIsNone(self.client.get(f'/api/files/{upload.id}/preview/').data['preview'])
+
+    def test_listings_never_select_the_preview(self):
+        upload = self.process('a.txt', "some text")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/files/').status_code, 200)
+            self.assertEqual(self.client.get(f'/api/files/{upload.id}/').status_code, 200)
+        selects = [query['sql'] for query in queries if 'core_fileupload' in query['sql']]
+        self.assertTrue(selects)
+        self.assertFalse([sql for sql in selects if '"preview"' in sql])
+
+    def test_preview_of_another_users_file_is_not_found(self):
+        other = User.objects.create_user('other', password='pass')
+        upload = FileUpload.objects.create(user=other, file='uploads/x.txt', filename='x.txt')
+        self.assertEqual(self.client.get(f'/api/files/{upload.id}/preview/').status_code, 404)
+
+
+class BatchWordCountTaskTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('batcher', password='pass')
+
+    def _create_uploads(self, count, words_per_file=5):
+        uploads = []
+        for i in range(count):
+            name = f'uploads/batch_{i}.txt'
+            self.write_media_file(name, ' '.join(['word'] * (words_per_file + i % 3)))
+            uploads.append(FileUpload(user=self.user, file=name, filename=f'batch_{i}.txt'))
+        return FileUpload.objects.bulk_create(uploads)
+
+    def test_batch_counts_all_uploads_with_constant_queries(self):
+        uploads = self._create_uploads(20)
+        FileUpload.objects.create(user=self.user, file='uploads/gone.txt', filename='gone.txt')
+        ids = list(FileUpload.objects.values_list('id', flat=True))
+
+        # One SELECT plus one bulk UPDATE, independent of batch size
+        with self.assertNumQueries(2):
+            self.assertEqual(process_file_word_count_batch(ids), 21)
+
+        for upload in uploads:
+            upload.refresh_from_db()
+            self.assertEqual(upload.status, 'completed')
+            self.assertEqual(upload.word_count, 5 + int(upload.filename[6:-4]) % 3)
+        self.assertEqual(FileUpload.objects.get(filename='gone.txt').status, 'failed')
+
+    @override_settings(WORD_COUNT_BATCH_SIZE=8)
+    def test_queue_splits_ids_into_batches(self):
+        with mock.patch.object(process_file_word_count_batch, 'delay') as delay:
+            queue_word_count_batches(range(1, 21))
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [8, 8, 4])
+
+    @override_settings(WORD_COUNT_BATCHING=True, WORD_COUNT_BATCH_SIZE=10)
+    def test_dispatcher_queues_each_pending_upload_once(self):
+        self._create_uploads(15)
+        with mock.patch.object(process_file_word_count_batch, 'delay') as delay:
+            self.assertEqual(dispatch_pending_word_counts(), 15)
+            self.assertEqual(dispatch_pending_word_counts(), 0)
+            self._create_uploads(3)
+            self.assertEqual(dispatch_pending_word_counts(), 3)
+            # The claim lives in the rows, not in a per-process cache
+            cache.clear()
+            self.assertEqual(dispatch_pending_word_counts(), 0)
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [10, 5, 3])
+
+    @override_settings(WORD_COUNT_BATCHING=True)
+    def test_dispatcher_picks_up_uploads_committed_out_of_order(self):
+        later = FileUpload.objects.create(id=500, user=self.user, file='uploads/late.txt', filename='late.txt')
+        with mock.patch.object(process_file_word_count_batch, 'delay') as delay:
+            self.assertEqual(dispatch_pending_word_counts(), 1)
+            earlier = FileUpload.objects.create(id=400, user=self.user, file='uploads/early.txt', filename='early.txt')
+            self.assertEqual(dispatch_pending_word_counts(), 1)
+        self.assertEqual([call.args[0] for call in delay.call_args_list], [[later.id], [earlier.id]])
+
+    def test_dispatcher_is_idle_without_batching(self):
+        self._create_uploads(2)
+        with mock.patch.object(process_file_word_count_batch, 'delay') as delay:
+            self.assertEqual(dispatch_pending_word_counts(), 0)
+        delay.assert_not_called()
+
+    @benchmark
+    def test_batch_throughput_against_per_file_path(self):
+        count = 300
+        per_file_ids = [upload.id for upload in self._create_uploads(count)]
+        batch_ids = [upload.id for upload in self._create_uploads(count)]
+
+        with CaptureQueriesContext(connection) as per_file_queries:
+            started = time.perf_counter()
+            for upload_id in per_file_ids:
+                process_file_word_count_with_content(upload_id)
+            per_file_seconds = time.perf_counter() - started
+
+        with CaptureQueriesContext(connection) as batch_queries:
+            started = time.perf_counter()
+            for start in range(0, count, 50):
+                process_file_word_count_batch(batch_ids[start:start + 50])
+            batch_seconds = time.perf_counter() - started
+
+        print(
+            f"\n  per-file: {count / per_file_seconds:,.0f} files/s, {len(per_file_queries)} queries"
+            f"\n  batched:  {count / batch_seconds:,.0f} files/s, {len(batch_queries)} queries",
+            end='',
+        )
+        self.assertEqual(len(per_file_queries), 2 * count)
+        self.assertEqual(len(batch_queries), 2 * (count // 50))
+        self.assertEqual(FileUpload.objects.filter(status='completed').count(), 2 * count)
+
+
+class DuplicateUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('repeat', password='pass')
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_paid', amount=100, status='success')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, name, data):
+        with mock.patch('core.tasks.process_file_word_count_with_content.apply_async'):
+            response = self.client.post('/api/files/', {'file': SimpleUploadedFile(name, data)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return FileUpload.objects.get(id=response.data['id'])
+
+    def test_upload_records_content_digest(self):
+        upload = self.upload('a.txt', b'hello there world')
+        self.assertEqual(upload.content_digest, digest_chunks([b'hello there world']))
+
+    def test_duplicate_upload_reuses_stored_blob(self):
+        first = self.upload('NewPayment.txt', b'same bytes every time')
+        second = self.upload('NewPayment.txt', b'same bytes every time')
+        other = self.upload('NewPayment.txt', b'different bytes')
+
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertNotEqual(other.file.name, first.file.name)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'uploads'))), 2)
+
+    def test_same_bytes_under_another_extension_are_counted_again(self):
+        text = self.upload('notes.txt', b'plain words here')
+        process_file_word_count_with_content(text.id)
+        self.assertEqual(FileUpload.objects.get(id=text.id).word_count, 3)
+
+        # Parsed as .docx these bytes are not a document at all
+        docx = self.upload('notes.docx', b'plain words here')
+        self.assertNotEqual(docx.file.name, text.file.name)
+        process_file_word_count_with_content(docx.id)
+        docx.refresh_from_db()
+        self.assertEqual(docx.status, 'failed')
+        self.assertIsNone(docx.word_count)
+
+    def test_blob_is_not_shared_with_other_users(self):
+        first = self.upload('Private-Report.txt', b'same bytes every time')
+        other = User.objects.create_user('someone-else', password='pass')
+        PaymentTransaction.objects.create(user=other, transaction_id='txn_other', amount=100, status='success')
+        self.client.force_authenticate(other)
+        second = self.upload('mine.txt', b'same bytes every time')
+
+        self.assertNotEqual(second.file.name, first.file.name)
+        self.assertNotIn('Private-Report', second.file.name)
+        self.assertEqual(second.content_digest, first.content_digest)
+
+    @override_settings(FILE_UPLOAD_REUSE_DUPLICATES=False)
+    def test_blob_reuse_can_be_disabled(self):
+        first = self.upload('x.txt', b'same bytes')
+        second = self.upload('x.txt', b'same bytes')
+        self.assertNotEqual(second.file.name, first.file.name)
+        self.assertEqual(second.content_digest, first.content_digest)
+
+    def test_task_short_circuits_on_known_digest(self):
+        FileUpload.objects.create(
+            user=self.user, file='uploads/original.txt', filename='original.txt',
+            content_digest='f' * 64, status='completed', word_count=1234, text_stats={'lines': 5},
+        )
+        # The file is not on disk, so a completed result proves it was never read
+        duplicate = FileUpload.objects.create(
+            user=self.user, file='uploads/missing.txt', filename='copy.txt', content_digest='f' * 64,
+        )
+
+        process_file_word_count_with_content(duplicate.id)
+
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.status, 'completed')
+        self.assertEqual(duplicate.word_count, 1234)
+        self.assertEqual(duplicate.text_stats, {'lines': 5})
+
+    def test_results_without_statistics_are_not_reused(self):
+        # Counted while TEXT_STATS_ENABLED was off
+        FileUpload.objects.create(
+            user=self.user, file='uploads/original.txt', filename='original.txt',
+            content_digest='d' * 64, status='completed', word_count=2,
+        )
+        self.write_media_file('uploads/copy.txt', 'two words')
+        duplicate = FileUpload.objects.create(
+            user=self.user, file='uploads/copy.txt', filename='copy.txt', content_digest='d' * 64,
+        )
+
+        process_file_word_count_with_content(duplicate.id)
+
+        duplicate.refresh_from_db()
+        self.assertEqual(duplicate.word_count, 2)
+        self.assertEqual(duplicate.text_stats['lines'], 1)
+
+    def test_batch_short_circuits_on_known_digest(self):
+        FileUpload.objects.create(
+            user=self.user, file='uploads/original.txt', filename='original.txt',
+            content_digest='e' * 64, status='completed', word_count=7, text_stats={'lines': 1},
+        )
+        duplicate = FileUpload.objects.create(
+            user=self.user, file='uploads/missing.txt', filename='copy.txt', content_digest='e' * 64,
+        )
+        with mock.patch('core.tasks._count_upload') as count_upload:
+            process_file_word_count_batch([duplicate.id])
+        count_upload.assert_not_called()
+
+        duplicate.refresh_from_db()
+        self.assertEqual((duplicate.status, duplicate.word_count), ('completed', 7))
+
+
+class WordCountRoutingTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('router', password='pass')
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_paid', amount=100, status='success')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def queue_for_upload(self, data):
+        with mock.patch('core.tasks.process_file_word_count_with_content.apply_async') as apply_async:
+            response = self.client.post('/api/files/', {'file': SimpleUploadedFile('a.txt', data)}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        apply_async.assert_called_once_with((response.data['id'],), queue=mock.ANY)
+        return apply_async.call_args.kwargs['queue']
+
+    @override_settings(WORD_COUNT_LARGE_FILE_SIZE=100)
+    def test_uploads_are_routed_by_size(self):
+        self.assertEqual(self.queue_for_upload(b'x' * 99), SMALL_FILES_QUEUE)
+        self.assertEqual(self.queue_for_upload(b'x' * 100), LARGE_FILES_QUEUE)
+
+    def test_batches_use_the_bulk_queue(self):
+        route = celery_app.amqp.router.route({}, process_file_word_count_batch.name)
+        self.assertEqual(route['queue'].name, BULK_QUEUE)
+
+    @override_settings(WORD_COUNT_QUEUE_CONCURRENCY={SMALL_FILES_QUEUE: 4, BULK_QUEUE: 2})
+    def test_workers_default_to_their_lanes_concurrency(self):
+        conf = celery_app.conf
+        original = conf.get('CELERY_WORKER_CONCURRENCY')
+        self.addCleanup(conf.__setitem__, 'CELERY_WORKER_CONCURRENCY', original)
+
+        def concurrency(**options):
+            conf['CELERY_WORKER_CONCURRENCY'] = None
+            size_worker_for_queues(conf=conf, options=options)
+            # what the worker reads when it sizes its pool
+            return celery_app.either('worker_concurrency', None)
+
+        self.assertEqual(concurrency(queues=[SMALL_FILES_QUEUE, BULK_QUEUE]), 6)
+        self.assertEqual(concurrency(queues=f'{SMALL_FILES_QUEUE},{BULK_QUEUE}'), 6)
+        # -c, an unconfigured queue or no -Q leave the worker's default alone
+        self.assertIsNone(concurrency(queues=[SMALL_FILES_QUEUE], concurrency=8))
+        self.assertIsNone(concurrency(queues=[SMALL_FILES_QUEUE, 'celery']))
+        self.assertIsNone(concurrency(queues=None))
+        # as does an explicit CELERY_WORKER_CONCURRENCY
+        conf['CELERY_WORKER_CONCURRENCY'] = 3
+        size_worker_for_queues(conf=conf, options={'queues': [SMALL_FILES_QUEUE]})
+        self.assertEqual(conf.worker_concurrency, 3)
+
+
+class ChunkedUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('chunky', password='pass')
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_chunk', amount=100, status='success')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def start(self, filename='big.txt', size=0):
+        response = self.client.post('/api/uploads/', {'filename': filename, 'size': size}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def put_chunk(self, upload_id, offset, data):
+        return self.client.put(
+            f'/api/uploads/{upload_id}/chunk/', data, content_type='application/octet-stream',
+            headers={'Upload-Offset': str(offset)},
+        )
+
+    def complete(self, upload_id):
+        with mock.patch('core.tasks.process_file_word_count_with_content.apply_async') as delay:
+            response = self.client.post(f'/api/uploads/{upload_id}/complete/')
+        return response, delay
+
+    def upload_whole(self, data):
+        upload_id = self.start(size=len(data))
+        self.put_chunk(upload_id, 0, data)
+        response, delay = self.complete(upload_id)
+        return FileUpload.objects.get(id=response.data['id'])
+
+    def test_chunks_assemble_into_processed_upload(self):
+        data = b'word ' * 50000
+        upload_id = self.start(size=len(data))
+        step = 64 * 1024
+        for offset in range(0, len(data), step):
+            response = self.put_chunk(upload_id, offset, data[offset:offset + step])
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(response.data['offset'], min(offset + step, len(data)))
+
+        response, delay = self.complete(upload_id)
+
+        self.assertEqual(response.status_code, 201, response.data)
+        upload = FileUpload.objects.get(id=response.data['id'])
+        delay.assert_called_once_with((upload.id,), queue=SMALL_FILES_QUEUE)
+        self.assertEqual(upload.status, 'processing')
+        self.assertEqual(upload.content_digest, digest_chunks([data]))
+        with open(os.path.join(self.media_root, upload.file.name), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'chunked')), [])
+        self.assertEqual(ChunkedUpload.objects.get(id=upload_id).file_upload_id, upload.id)
+
+    def test_resume_after_interrupted_chunk(self):
+        data = b'alpha beta gamma delta'
+        upload_id = self.start(size=len(data))
+        self.put_chunk(upload_id, 0, data[:6])
+        # A retried chunk at a stale offset is refused with the offset to resume from
+        response = self.put_chunk(upload_id, 0, data[:6])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 6)
+
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['offset'], 6)
+        self.put_chunk(upload_id, 6, data[6:])
+        response, delay = self.complete(upload_id)
+
+        self.assertEqual(response.status_code, 201)
+        upload = FileUpload.objects.get(id=response.data['id'])
+        with open(os.path.join(self.media_root, upload.file.name), 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_chunk_is_read_in_bounded_pieces(self):
+        data = b'x ' * (256 * 1024)
+        upload_id = self.start(size=len(data))
+        session = ChunkedUpload.objects.get(id=upload_id)
+        stream = io.BytesIO(data)
+        with mock.patch.object(stream, 'read', wraps=stream.read) as read:
+            uploads.append_chunk(session, 0, stream)
+        self.assertTrue(all(call.args[0] <= 64 * 1024 for call in read.call_args_list))
+        self.assertEqual(session.received_bytes, len(data))
+
+    def test_complete_of_a_claimed_session_is_refused(self):
+        upload_id = self.start(size=5)
+        self.put_chunk(upload_id, 0, b'a b c')
+        ChunkedUpload.objects.filter(id=upload_id).update(status='completing')
+        response, delay = self.complete(upload_id)
+        self.assertEqual(response.status_code, 409)
+        delay.assert_not_called()
+        self.assertFalse(FileUpload.objects.filter(user=self.user).exists())
+
+    def test_complete_requires_all_bytes(self):
+        upload_id = self.start(size=10)
+        self.put_chunk(upload_id, 0, b'12345')
+        response, delay = self.complete(upload_id)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 5)
+        delay.assert_not_called()
+
+    def test_chunk_past_declared_size_is_rejected(self):
+        upload_id = self.start(size=4)
+        response = self.put_chunk(upload_id, 0, b'too many bytes')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ChunkedUpload.objects.get(id=upload_id).received_bytes, 0)
+
+    def test_init_validates_name_size_and_payment(self):
+        response = self.client.post('/api/uploads/', {'filename': 'x.pdf', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, 400)
+        with override_settings(CHUNKED_UPLOAD_MAX_SIZE=100):
+            response = self.client.post('/api/uploads/', {'filename': 'x.txt', 'size': 101}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        unpaid = User.objects.create_user('unpaid-chunks', password='pass')
+        self.client.force_authenticate(unpaid)
+        response = self.client.post('/api/uploads/', {'filename': 'x.txt', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_duplicate_content_reuses_stored_file(self):
+        first = self.upload_whole(b'same content')
+        second = self.upload_whole(b'same content')
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'uploads'))), 1)
+
+    def test_another_users_duplicate_gets_its_own_file(self):
+        first = self.upload_whole(b'same content')
+        other = User.objects.create_user('other-chunky', password='pass')
+        PaymentTransaction.objects.create(user=other, transaction_id='txn_chunk_other', amount=100, status='success')
+        self.client.force_authenticate(other)
+        second = self.upload_whole(b'same content')
+        self.assertNotEqual(second.file.name, first.file.name)
+
+    def test_purge_removes_stale_sessions(self):
+        upload_id = self.start(size=10)
+        self.put_chunk(upload_id, 0, b'12345')
+        ChunkedUpload.objects.filter(id=upload_id).update(updated_at=timezone.now() - timedelta(days=2))
+        fresh_id = self.start(size=10)
+
+        self.assertEqual(purge_stale_chunked_uploads(), 1)
+        self.assertFalse(ChunkedUpload.objects.filter(id=upload_id).exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'chunked')), [f'{fresh_id}.part'])
+
+
+class ChunkedUploadConcurrencyTests(MediaRootMixin, TransactionTestCase):
+    def test_racing_chunks_at_one_offset_do_not_interleave(self):
+        user = User.objects.create_user('racing-chunks', password='pass')
+        session = ChunkedUpload.objects.create(user=user, filename='race.txt', total_size=100)
+        uploads.start_session(session)
+        first_writing = threading.Event()
+        write_at = uploads._write_at
+
+        def slow_write_at(path, spool, offset):
+            first_writing.set()
+            time.sleep(0.3)  # The second request arrives meanwhile
+            write_at(path, spool, offset)
+
+        results = {}
+
+        def put(data):
+            try:
+                results[data] = uploads.append_chunk(ChunkedUpload.objects.get(pk=session.pk), 0, io.BytesIO(data))
+            except uploads.ChunkOffsetMismatch:
+                results[data] = None
+            finally:
+                connection.close()
+
+        with mock.patch('core.uploads._write_at', side_effect=slow_write_at):
+            first = threading.Thread(target=put, args=(b'a' * 40,))
+            first.start()
+            self.assertTrue(first_writing.wait(5))
+            second = threading.Thread(target=put, args=(b'b' * 10,))
+            second.start()
+            first.join()
+            second.join()
+
+        self.assertEqual(results, {b'a' * 40: 40, b'b' * 10: None})
+        session.refresh_from_db()
+        self.assertEqual(session.received_bytes, 40)
+        with open(uploads.part_path(session), 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 40)
+
+    def test_chunk_is_written_outside_a_transaction(self):
+        user = User.objects.create_user('quick-chunks', password='pass')
+        session = ChunkedUpload.objects.create(user=user, filename='quick.txt', total_size=10)
+        uploads.start_session(session)
+        write_at = uploads._write_at
+        in_atomic = []
+
+        def recording_write_at(path, spool, offset):
+            in_atomic.append(connection.in_atomic_block)
+            write_at(path, spool, offset)
+
+        with mock.patch('core.uploads._write_at', side_effect=recording_write_at):
+            self.assertEqual(uploads.append_chunk(session, 0, io.BytesIO(b'12345')), 5)
+        self.assertEqual(in_atomic, [False])
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.received_bytes), ('uploading', 5))
+
+    def test_failed_chunk_write_keeps_the_offset(self):
+        user = User.objects.create_user('broken-chunks', password='pass')
+        session = ChunkedUpload.objects.create(user=user, filename='broken.txt', total_size=10)
+        uploads.start_session(session)
+        with mock.patch('core.uploads._write_at', side_effect=OSError('disk full')), \
+                self.assertRaises(OSError):
+            uploads.append_chunk(session, 0, io.BytesIO(b'12345'))
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.received_bytes), ('uploading', 0))
+
+    def test_racing_completes_create_one_upload(self):
+        user = User.objects.create_user('racing-completes', password='pass')
+        session = ChunkedUpload.objects.create(user=user, filename='race.txt', total_size=5)
+        uploads.start_session(session)
+        uploads.append_chunk(session, 0, io.BytesIO(b'a b c'))
+        hashing = threading.Event()
+        read_file = uploads._read_file
+
+        def slow_read_file(path):
+            hashing.set()
+            time.sleep(0.3)  # The retried request arrives meanwhile
+            return read_file(path)
+
+        results = {}
+
+        def complete(name):
+            try:
+                results[name] = uploads.complete_session(ChunkedUpload.objects.get(pk=session.pk))
+            except uploads.SessionBusy:
+                results[name] = None
+            finally:
+                connection.close()
+
+        with mock.patch('core.uploads._read_file', side_effect=slow_read_file):
+            first = threading.Thread(target=complete, args=('first',))
+            first.start()
+            self.assertTrue(hashing.wait(5))
+            second = threading.Thread(target=complete, args=('second',))
+            second.start()
+            first.join()
+            second.join()
+
+        self.assertIsInstance(results['first'], FileUpload)
+        self.assertIsNone(results['second'])
+        self.assertEqual(FileUpload.objects.filter(user=user).count(), 1)
+        self.assertEqual(ChunkedUpload.objects.get(pk=session.pk).status, 'complete')
+
+
+class BulkUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('bulky', password='pass')
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_bulk', amount=100, status='success')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def bulk_upload(self, files):
+        with mock.patch('core.tasks.process_file_word_count_batch.delay') as delay:
+            response = self.client.post('/api/files/bulk/', {'files': files}, format='multipart')
+        return response, delay
+
+    @override_settings(WORD_COUNT_BATCH_SIZE=2)
+    def test_bulk_upload_creates_rows_activity_and_batches(self):
+        files = [SimpleUploadedFile(f'doc{i}.txt', f'file number {i}'.encode()) for i in range(3)]
+        response, delay = self.bulk_upload(files)
+
+        self.assertEqual(response.status_code, 201, response.data)
+        ids = [item['id'] for item in response.data]
+        uploads = FileUpload.objects.filter(id__in=ids).order_by('id')
+        self.assertEqual([upload.filename for upload in uploads], ['doc0.txt', 'doc1.txt', 'doc2.txt'])
+        self.assertTrue(all(upload.status == 'processing' and upload.content_digest for upload in uploads))
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'uploads'))), 3)
+        self.assertEqual([call.args[0] for call in delay.call_args_list], [ids[:2], ids[2:]])
+
+        logs = ActivityLog.objects.filter(user=self.user)
+        self.assertEqual(logs.count(), 1)
+        self.assertEqual(logs.get().metadata, {'count': 3, 'file_ids': ids})
+
+    def test_one_invalid_file_rejects_the_whole_request(self):
+        files = [SimpleUploadedFile('ok.txt', b'fine'), SimpleUploadedFile('bad.pdf', b'nope')]
+        response, delay = self.bulk_upload(files)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('1', json.dumps(response.data['files']))
+        self.assertFalse(FileUpload.objects.exists())
+        delay.assert_not_called()
+
+    def test_bulk_upload_requires_payment_and_files(self):
+        response, delay = self.bulk_upload([])
+        self.assertEqual(response.status_code, 400)
+
+        unpaid = User.objects.create_user('unpaid-bulk', password='pass')
+        self.client.force_authenticate(unpaid)
+        response, delay = self.bulk_upload([SimpleUploadedFile('a.txt', b'a')])
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_upload_reuses_stored_duplicates(self):
+        first, _ = self.bulk_upload([SimpleUploadedFile('a.txt', b'repeated words')])
+        second, _ = self.bulk_upload([
+            SimpleUploadedFile('a.txt', b'repeated words'),
+            SimpleUploadedFile('b.txt', b'fresh words'),
+        ])
+        names = list(FileUpload.objects.filter(id__in=[item['id'] for item in second.data]).values_list('file', flat=True))
+        self.assertIn(FileUpload.objects.get(id=first.data[0]['id']).file.name, names)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'uploads'))), 2)
+
+
+class BulkUploadEfficiencyTests(ReportMixin, MediaRootMixin, TestCase):
+    """One bulk request against one request per file"""
+
+    FILES = 20
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('bench', password='pass')
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_bench', amount=100, status='success')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_files(self, prefix):
+        return [
+            SimpleUploadedFile(f'{prefix}{i}.txt', f'{prefix} benchmark file {i}'.encode())
+            for i in range(self.FILES)
+        ]
+
+    def test_bulk_beats_per_file_requests(self):
+        files = self.make_files('single')
+        with mock.patch('core.tasks.process_file_word_count_with_content.apply_async') as single_delay, \
+                CaptureQueriesContext(connection) as single_queries:
+            started = time.perf_counter()
+            for upload in files:
+                response = self.client.post('/api/files/', {'file': upload}, format='multipart')
+                self.assertEqual(response.status_code, 201)
+            single_time = time.perf_counter() - started
+
+        files = self.make_files('bulk')
+        with mock.patch('core.tasks.process_file_word_count_batch.delay') as bulk_delay, \
+                CaptureQueriesContext(connection) as bulk_queries:
+            started = time.perf_counter()
+            response = self.client.post('/api/files/bulk/', {'files': files}, format='multipart')
+            bulk_time = time.perf_counter() - started
+        self.assertEqual(response.status_code, 201)
+
+        self.report(
+            f"{self.FILES} files per-file: {single_time:.2f}s, {len(single_queries)} queries, "
+            f"{single_delay.call_count} messages"
+        )
+        self.report(
+            f"{self.FILES} files bulk:     {bulk_time:.2f}s, {len(bulk_queries)} queries, "
+            f"{bulk_delay.call_count} messages"
+        )
+        self.assertFaster(bulk_time, single_time)
+        self.assertEqual(FileUpload.objects.count(), 2 * self.FILES)
+        # Besides bulk_create's INSERTs, which SQLite's parameter limit splits
+        # into batches: savepoint, digest lookup, release and the activity row
+        fields = [field for field in FileUpload._meta.concrete_fields if not field.primary_key]
+        inserts = math.ceil(self.FILES / connection.ops.bulk_batch_size(fields, files))
+        self.assertLessEqual(len(bulk_queries), inserts + 4)
+        self.assertLess(bulk_delay.call_count, single_delay.call_count)
+
+
+@benchmark
+class BulkUploadBenchmark(BulkUploadEfficiencyTests):
+    FILES = 500
+
+
+class PaymentCallbackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('payer', password='pass')
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_cb', amount=100)
+
+    def callback(self, path='success', txnid='txn_cb'):
+        return self.client.get(f'/api/payment/{path}/', {'mer_txnid': txnid})
+
+    def test_retried_callback_has_no_further_effect(self):
+        self.assertEqual(self.callback().status_code, 302)
+        with self.assertNumQueries(2):
+            response = self.callback()
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ActivityLog.objects.filter(action='payment_success').count(), 1)
+        self.assertEqual(PaymentTransaction.objects.get(transaction_id='txn_cb').status, 'success')
+
+    def test_settled_transaction_is_not_overwritten(self):
+        self.callback('success')
+        self.callback('fail')
+        self.callback('cancel')
+
+        self.assertEqual(PaymentTransaction.objects.get(transaction_id='txn_cb').status, 'success')
+        self.assertEqual(list(ActivityLog.objects.values_list('action', flat=True)), ['payment_success'])
+        self.assertTrue(has_successful_payment(self.user))
+
+    def test_callback_leaves_gateway_response_alone(self):
+        PaymentTransaction.objects.filter(transaction_id='txn_cb').update(gateway_response={'result': 'true'})
+        with CaptureQueriesContext(connection) as queries:
+            self.callback()
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('gateway_response', updates[0])
+        self.assertEqual(PaymentTransaction.objects.get(transaction_id='txn_cb').gateway_response, {'result': 'true'})
+
+    def test_unknown_transaction_is_404(self):
+        self.assertEqual(self.callback(txnid='txn_missing').status_code, 404)
+
+
+class PaymentCallbackConcurrencyTests(ReportMixin, TransactionTestCase):
+    """Duplicate callbacks racing on one transaction apply once"""
+
+    CALLBACKS = 40
+    THREADS = 8
+
+    def test_duplicate_callbacks_apply_exactly_once(self):
+        cache.clear()
+        user = User.objects.create_user('racer', password='pass')
+        PaymentTransaction.objects.create(user=user, transaction_id='txn_race', amount=100)
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+        results_lock = threading.Lock()
+
+        def fire(paths):
+            client = Client()
+            barrier.wait()
+            try:
+                for path in paths:
+                    started = time.perf_counter()
+                    response = client.get(f'/api/payment/{path}/', {'mer_txnid': 'txn_race'})
+                    with results_lock:
+                        results.append((response.status_code, time.perf_counter() - started))
+            finally:
+                connection.close()
+
+        # Mostly success retries, with failure and cancel callbacks mixed in
+        paths = ['success' if i % 4 else ('fail', 'cancel')[i % 8 // 4] for i in range(self.CALLBACKS)]
+        threads = [
+            threading.Thread(target=fire, args=(paths[i::self.THREADS],))
+            for i in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        latencies = sorted(latency for _, latency in results)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        self.report(
+            f"{len(results)} racing callbacks: p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+            f"p99 {p99 * 1000:.1f}ms"
+        )
+        self.assertFaster(p99, 2.0)
+
+        self.assertEqual([code for code, _ in results], [302] * self.CALLBACKS)
+        payment = PaymentTransaction.objects.get(transaction_id='txn_race')
+        self.assertNotEqual(payment.status, 'pending')
+        logs = ActivityLog.objects.filter(user=user)
+        self.assertEqual(logs.count(), 1)
+        self.assertEqual(logs.get().action, f'payment_{payment.status}')
+
+
+@benchmark
+class PaymentCallbackConcurrencyBenchmark(PaymentCallbackConcurrencyTests):
+    """Hundreds of racing callbacks, with their latency percentiles"""
+
+    CALLBACKS = 200
+    THREADS = 16
+
+
+class MetricsTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        for histogram in metrics.REGISTRY:
+            histogram.clear()
+        self.admin = User.objects.create_user('ops', password='pass', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def scrape(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram('test_seconds', "Test", ('kind',), (0.1, 1))
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value, 'a"b')
+
+        text = metrics.render_prometheus()
+
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn('test_seconds_bucket{kind="a\\"b",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{kind="a\\"b",le="1"} 3', text)
+        self.assertIn('test_seconds_bucket{kind="a\\"b",le="+Inf"} 4', text)
+        self.assertIn('test_seconds_count{kind="a\\"b"} 4', text)
+        self.assertIn('test_seconds_sum{kind="a\\"b"} 4.25', text)
+
+    def test_requests_are_timed_by_view_with_query_counts(self):
+        for _ in range(3):
+            self.client.get('/api/files/')
+
+        text = self.scrape()
+
+        self.assertIn(
+            'http_request_duration_seconds_count{view="fileupload-list",method="GET",status="200"} 3', text
+        )
+        self.assertIn('http_request_db_queries_count{view="fileupload-list",method="GET"} 3', text)
+        # Each listing runs at least its page query
+        self.assertIn('http_request_db_queries_bucket{view="fileupload-list",method="GET",le="0"} 0', text)
+        self.assertIn('http_request_db_duration_seconds_count{view="fileupload-list",method="GET"} 3', text)
+
+    def test_endpoint_is_staff_only(self):
+        self.client.force_authenticate(User.objects.create_user('plain', password='pass'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+
+    def test_task_hooks_record_queue_wait_runtime_and_bytes(self):
+        user = User.objects.create_user('counter', password='pass')
+        self.write_media_file('uploads/m.txt', 'x ' * 5000)
+        upload = FileUpload.objects.create(user=user, file='uploads/m.txt', filename='m.txt')
+
+        headers = {}
+        metrics._stamp_publish_time(headers=headers)
+        # What the worker sees: the task's request carries the message headers
+        task = SimpleNamespace(
+            name='core.tasks.process_file_word_count_with_content',
+            request=SimpleNamespace(published_at=headers['published_at'] - 0.2),
+        )
+        task_prerun.send(sender=process_file_word_count_with_content, task_id='t-1', task=task, args=(upload.id,), kwargs={})
+        process_file_word_count_with_content(upload.id)
+        task_postrun.send(sender=process_file_word_count_with_content, task_id='t-1', task=task, args=(upload.id,), kwargs={}, state='SUCCESS')
+
+        text = self.scrape()
+        task = task.name
+        self.assertIn(f'celery_task_queue_wait_seconds_count{{task="{task}"}} 1', text)
+        self.assertIn(f'celery_task_queue_wait_seconds_bucket{{task="{task}",le="0.1"}} 0', text)
+        self.assertIn(f'celery_task_runtime_seconds_count{{task="{task}",state="SUCCESS"}} 1', text)
+        self.assertIn('word_count_bytes_processed_bucket{le="16384"} 1', text)
+        self.assertIn('word_count_bytes_processed_sum 10000', text)
+
+    @override_settings(METRICS_PUSH_INTERVAL=0)
+    def test_snapshots_from_other_processes_are_merged(self):
+        metrics.REQUEST_QUERIES.observe(2, 'fileupload-list', 'GET')
+        metrics.push_snapshot()
+        # Pretend the pushed snapshot came from another process
+        snapshot = cache.get(metrics._source_key(metrics._source()))
+        cache.set(metrics._source_key('worker:1'), snapshot)
+        cache.set(metrics.SOURCES_KEY, {'worker:1': time.time()})
+
+        text = metrics.render_prometheus()
+
+        self.assertIn('http_request_db_queries_count{view="fileupload-list",method="GET"} 2', text)
+
+
+class PipelineBenchmarkCommandTests(TransactionTestCase):
+    def benchmark(self, mode):
+        out = io.StringIO()
+        call_command('benchmark_pipeline', mode=mode, sizes='1KB,64KB', repeat=2, stdout=out)
+        return json.loads(out.getvalue())
+
+    def assert_report(self, report):
+        self.assertEqual(report['schema'], 2)
+        self.assertEqual(
+            [result['case'] for result in report['results']],
+            ['ascii-1KB', 'ascii-64KB', 'utf8-1KB', 'utf8-64KB', 'docx-1KB', 'docx-64KB'],
+        )
+        for result in report['results']:
+            self.assertTrue(result['completed'], result)
+            self.assertTrue(result['word_count_ok'], result)
+            self.assertEqual(result['runs'], 2)
+            self.assertGreater(result['queries']['task'], 0)
+            if result['process_peak_rss_kb'] is not None:
+                self.assertGreater(result['process_peak_rss_kb'], 0)
+                self.assertGreaterEqual(result['peak_rss_growth_kb'], 0)
+            self.assertLessEqual(result['processing_ms']['median'], result['end_to_end_ms']['median'])
+        # The benchmark cleans up after itself
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(FileUpload.objects.exists())
+
+    def test_eager_mode(self):
+        report = self.benchmark('eager')
+        self.assert_report(report)
+        self.assertTrue(all(result['queue_wait_ms'] is None for result in report['results']))
+
+    def test_memory_broker_mode(self):
+        report = self.benchmark('memory')
+        self.assert_report(report)
+        self.assertTrue(all(result['queue_wait_ms']['median'] >= 0 for result in report['results']))
+
+    def test_corpora_word_counts_match_the_counter(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        for kind, ext in (('ascii', '.txt'), ('utf8', '.txt'), ('docx', '.docx')):
+            path = os.path.join(directory, kind + ext)
+            words = write_corpus(path, kind, 50000, 'token')
+            self.assertEqual(count_file_words(path), words)
+        self.assertEqual(parse_size('64KB'), 64 * 1024)
+        self.assertEqual(parse_size('1.5MB'), 3 * 512 * 1024)
+
+
+class RoutingBenchmarkCommandTests(TransactionTestCase):
+    def test_reports_small_and_large_completion_per_scenario(self):
+        out = io.StringIO()
+        call_command(
+            'benchmark_routing', json=True, small=6, large=1, large_size='256KB', stdout=out,
+        )
+        reports = {report['scenario']: report for report in json.loads(out.getvalue())}
+
+        self.assertEqual(set(reports), {'shared', 'routed'})
+        for report in reports.values():
+            self.assertTrue(report['completed'], report)
+            self.assertEqual(report['small']['files'], 6)
+            self.assertEqual(report['large']['files'], 1)
+            self.assertLessEqual(report['small']['p50_ms'], report['small']['p95_ms'])
+        # The benchmark cleans up after itself
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(FileUpload.objects.exists())
+
+
+class WorkerPoolBenchmarkCommandTests(TransactionTestCase):
+    def test_reports_throughput_for_each_pool(self):
+        out = io.StringIO()
+        call_command('benchmark_worker_pools', json=True, concurrency=2, tasks=6, sizes='1KB,16KB', stdout=out)
+        reports = {report['pool']: report for report in json.loads(out.getvalue())}
+
+        self.assertEqual(set(reports), {'prefork', 'threads', 'solo'})
+        for report in reports.values():
+            self.assertTrue(report['completed'], report)
+            self.assertEqual(report['tasks'], 6)
+            self.assertGreater(report['tasks_per_second'], 0)
+        self.assertEqual(reports['solo']['concurrency'], 1)
+        self.assertEqual(reports['threads']['prefetch_multiplier'], 3)
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(FileUpload.objects.exists())
+
+
+class GatewaySimulatorTests(SimpleTestCase):
+    def payload(self, tran_id):
+        return {
+            'tran_id': tran_id,
+            'success_url': 'http://app/success/',
+            'fail_url': 'http://app/fail/',
+            'cancel_url': 'http://app/cancel/',
+        }
+
+    def test_accepts_payment_and_redirects_checkout_to_outcome_url(self):
+        with GatewaySimulator(outcomes={'failed': 1}) as simulator:
+            response = requests.post(simulator.url, json=self.payload('txn_sim'), timeout=5)
+            checkout = requests.get(response.json()['payment_url'], allow_redirects=False, timeout=5)
+
+        self.assertEqual(response.json()['result'], 'true')
+        self.assertEqual(checkout.status_code, 302)
+        self.assertEqual(checkout.headers['Location'], 'http://app/fail/?mer_txnid=txn_sim')
+
+    def test_error_rate_rejects_payments(self):
+        simulator = GatewaySimulator(error_rate=1.0)
+        self.assertEqual(simulator.handle_payment(self.payload('txn_1'))['result'], 'false')
+        self.assertEqual(simulator.errors, 1)
+        self.assertIsNone(simulator.checkout_redirect('txn_1'))
+        simulator.server.server_close()
+
+    def test_parse_outcomes(self):
+        self.assertEqual(parse_outcomes('success=8,failed=1,cancelled'), {'success': 8, 'failed': 1, 'cancelled': 1})
+        with self.assertRaises(ValueError):
+            parse_outcomes('refunded=1')
+
+
+class PaymentBenchmarkCommandTests(TransactionTestCase):
+    def benchmark(self, **options):
+        out = io.StringIO()
+        call_command('benchmark_payments', json=True, stdout=out, concurrency=4, latency=0.005, **options)
+        return json.loads(out.getvalue())
+
+    def test_drives_initiation_and_callbacks_end_to_end(self):
+        report = self.benchmark(payments=40, outcomes='success=2,failed=1,cancelled=1', seed=7)
+
+        self.assertEqual(report['initiate']['requests'], 40)
+        self.assertEqual(report['initiate']['errors'], 0)
+        self.assertTrue(report['callbacks_completed'])
+        self.assertEqual(report['callbacks']['requests'], 40)
+        self.assertEqual(report['callbacks']['errors'], 0)
+        self.assertEqual(sum(report['outcomes'].values()), 40)
+        self.assertEqual(report['unsettled'], 0)
+        for phase in ('initiate', 'callbacks'):
+            stats = report[phase]
+            self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+            self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+            self.assertGreater(stats['requests_per_second'], 0)
+        # The benchmark user and its rows are removed afterwards
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(PaymentTransaction.objects.exists())
+
+    def test_gateway_errors_surface_as_failed_initiations(self):
+        report = self.benchmark(payments=20, error_rate=0.5, seed=3)
+
+        self.assertGreater(report['gateway_errors'], 0)
+        self.assertEqual(report['initiate']['errors'], report['gateway_errors'])
+        self.assertEqual(report['callbacks']['requests'], 20 - report['gateway_errors'])
+
+
+class AsyncPaymentInitiationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('payer', password='pass')
+        self.token = Token.objects.create(user=self.user)
+
+    def gateway_settings(self, stub):
+        return override_settings(AAMARPAY_CONFIG={**settings.AAMARPAY_CONFIG, 'endpoint': stub.url})
+
+    def test_requires_token(self):
+        response = self.client.post('/api/initiate-payment-async/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_sync_endpoint_reuses_connection(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with GatewaySimulator() as stub, self.gateway_settings(stub):
+            for _ in range(5):
+                response = client.post('/api/initiate-payment/')
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(stub.requests, 5)
+        self.assertEqual(len(stub.client_ports), 1)
+
+    async def test_concurrent_payments_do_not_serialise_on_gateway_latency(self):
+        concurrency, latency = 20, 0.25
+        client = AsyncClient()
+        headers = {'Authorization': f'Token {self.token.key}'}
+        # As under an ASGI server: this loop serves every request, then closes its client
+        gateway.start_async_clients()
+        try:
+            with GatewaySimulator(latency=latency) as stub, self.gateway_settings(stub):
+                started = time.perf_counter()
+                responses = await asyncio.gather(*[
+                    client.post('/api/initiate-payment-async/', headers=headers) for _ in range(concurrency)
+                ])
+                elapsed = time.perf_counter() - started
+
+                # A follow-up wave is served from the kept-alive pool
+                ports_before = set(stub.client_ports)
+                for _ in range(5):
+                    await client.post('/api/initiate-payment-async/', headers=headers)
+        finally:
+            await gateway.aclose_clients()
+
+        self.assertEqual([response.status_code for response in responses], [200] * concurrency, responses[0].content)
+        self.assertTrue(all(response.json()['payment_url'] for response in responses))
+        # Serial handling would take concurrency * latency
+        self.assertLess(elapsed, concurrency * latency / 3)
+        self.assertLessEqual(len(stub.client_ports - ports_before), 1)
+        self.assertEqual(await PaymentTransaction.objects.filter(user=self.user).acount(), concurrency + 5)
+        self.assertEqual(
+            await ActivityLog.objects.filter(user=self.user, action='payment_initiated').acount(),
+            concurrency + 5,
+        )
+
+    async def test_per_request_loops_do_not_open_async_clients(self):
+        # Under WSGI each async view runs on a fresh loop nobody closes
+        headers = {'Authorization': f'Token {self.token.key}'}
+        with GatewaySimulator() as stub, self.gateway_settings(stub):
+            response = await AsyncClient().post('/api/initiate-payment-async/', headers=headers)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(stub.requests, 1)
+        self.assertNotIn(asyncio.get_running_loop(), gateway._async_clients)
+
+    async def test_asgi_lifespan_closes_the_async_client(self):
+        from payment_file_upload.asgi import application
+
+        messages = asyncio.Queue()
+        sent = []
+
+        async def send(message):
+            sent.append(message['type'])
+
+        for message in ('lifespan.startup', 'lifespan.shutdown'):
+            messages.put_nowait({'type': message})
+        loop = asyncio.get_running_loop()
+
+        async def receive():
+            message = await messages.get()
+            if message['type'] == 'lifespan.shutdown':
+                # Between startup and shutdown the loop keeps a pooled client
+                self.assertIn(loop, gateway._serving_loops)
+                client = gateway.get_async_client()
+                receive.client = client
+            return message
+
+        await application({'type': 'lifespan'}, receive, send)
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(receive.client.is_closed)
+        self.assertNotIn(loop, gateway._async_clients)
+
+
+class EntitlementCacheTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('subscriber', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pay(self, status_type='success'):
+        PaymentTransaction.objects.create(user=self.user, transaction_id=f'txn_{status_type}', amount=100)
+        callback = {'success': 'success', 'failed': 'fail', 'cancelled': 'cancel'}[status_type]
+        self.client.get(f'/api/payment/{callback}/', {'mer_txnid': f'txn_{status_type}'})
+
+    def test_unpaid_users_are_not_cached(self):
+        self.assertFalse(has_successful_payment(self.user))
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_1', amount=100, status='success')
+        self.assertTrue(has_successful_payment(self.user))
+
+    def test_paid_answer_is_served_from_cache(self):
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_1', amount=100, status='success')
+        self.assertTrue(has_successful_payment(self.user))
+        with self.assertNumQueries(0):
+            self.assertTrue(has_successful_payment(self.user))
+
+    def test_success_callback_populates_cache(self):
+        self.pay('success')
+        with self.assertNumQueries(0):
+            self.assertTrue(has_successful_payment(self.user))
+
+    def test_failed_callback_clears_cache(self):
+        self.pay('success')
+        PaymentTransaction.objects.filter(transaction_id='txn_success').update(status='pending')
+        self.client.get('/api/payment/fail/', {'mer_txnid': 'txn_success'})
+        self.assertFalse(has_successful_payment(self.user))
+
+    def test_upload_path_skips_payment_table_when_cached(self):
+        self.pay('success')
+        with mock.patch('core.tasks.process_file_word_count_with_content.apply_async'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    '/api/files/', {'file': SimpleUploadedFile('a.txt', b'paid upload')}, format='multipart',
+                )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([q for q in queries if 'core_paymenttransaction' in q['sql']])
+
+
+class ExplainQueriesCommandTests(TestCase):
+    def test_listing_and_status_queries_use_composite_indexes(self):
+        User.objects.create_user('heavy', password='pass')
+        out = io.StringIO()
+        call_command('explain_queries', '--user', 'heavy', stdout=out)
+        plans = out.getvalue()
+        for index in (
+            'fileupload_user_time_idx', 'paymenttx_user_time_idx', 'activitylog_user_time_idx',
+            'fileupload_user_status_idx', 'paymenttx_user_status_idx', 'activitylog_user_action_idx',
+        ):
+            self.assertIn(index, plans)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('historian', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_walks_activity_history_in_order_without_gaps(self):
+        other = User.objects.create_user('someone-else', password='pass')
+        ActivityLog.objects.bulk_create(
+            [ActivityLog(user=self.user, action='file_uploaded', metadata={'n': i}) for i in range(125)]
+            + [ActivityLog(user=other, action='file_uploaded') for _ in range(5)]
+        )
+        # Force timestamp ties so the id tiebreak is exercised
+        ActivityLog.objects.filter(user=self.user, id__lte=60).update(timestamp=ActivityLog.objects.first().timestamp)
+
+        ids, pages = self.walk('/api/activity/?page_size=20')
+
+        expected = list(
+            ActivityLog.objects.filter(user=self.user).order_by('-timestamp', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 7)
+
+    def test_deep_pages_are_keyset_range_scans(self):
+        PaymentTransaction.objects.bulk_create(
+            [PaymentTransaction(user=self.user, transaction_id=f'txn_{i}', amount=100) for i in range(60)]
+        )
+        url = '/api/transactions/?page_size=10'
+        for _ in range(5):
+            url = self.client.get(url).data['next']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql'].upper()
+        self.assertIn('"TIMESTAMP" <', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_file_listing_is_paginated(self):
+        FileUpload.objects.bulk_create(
+            [FileUpload(user=self.user, file=f'uploads/{i}.txt', filename=f'{i}.txt') for i in range(3)]
+        )
+        response = self.client.get('/api/files/')
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertIsNone(response.data['next'])
+
+
+class ActivityLogBufferTests(SimpleTestCase):
+    def test_concurrent_producers_lose_no_events(self):
+        written = []
+        buffer = ActivityLogBuffer(written.extend, max_size=64, flush_interval=0)
+
+        def produce(worker):
+            for i in range(500):
+                buffer.add({'worker': worker, 'i': i})
+
+        threads = [threading.Thread(target=produce, args=(w,)) for w in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.flush()
+
+        self.assertEqual(len(written), 8 * 500)
+        self.assertEqual({(e['worker'], e['i']) for e in written}, {(w, i) for w in range(8) for i in range(500)})
+
+    def test_flushes_by_size(self):
+        batches = []
+        buffer = ActivityLogBuffer(batches.append, max_size=3, flush_interval=0)
+        for i in range(7):
+            buffer.add(i)
+        self.assertEqual(batches, [[0, 1, 2], [3, 4, 5]])
+        self.assertEqual(len(buffer), 1)
+
+    def test_flushes_by_age(self):
+        flushed = threading.Event()
+        batches = []
+        buffer = ActivityLogBuffer(lambda batch: (batches.append(batch), flushed.set()), max_size=100, flush_interval=0.05)
+        buffer.add('a')
+        buffer.add('b')
+        self.assertTrue(flushed.wait(2))
+        self.assertEqual(batches, [['a', 'b']])
+
+    def test_timer_thread_closes_its_connections(self):
+        closed = threading.Event()
+        buffer = ActivityLogBuffer(lambda batch: None, max_size=100, flush_interval=0.05)
+        with mock.patch('core.activity.connections') as timer_connections:
+            timer_connections.close_all.side_effect = closed.set
+            buffer.add('a')
+            self.assertTrue(closed.wait(2))
+
+    def test_failed_write_keeps_events(self):
+        calls = []
+
+        def flaky(batch):
+            calls.append(list(batch))
+            if len(calls) == 1:
+                raise RuntimeError('database unavailable')
+
+        buffer = ActivityLogBuffer(flaky, max_size=100, flush_interval=0)
+        buffer.add(1)
+        with self.assertLogs('core.activity', 'ERROR'):
+            self.assertEqual(buffer.flush(), 0)
+        buffer.add(2)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(calls[-1], [1, 2])
+
+
+@override_settings(ACTIVITY_LOG_BACKEND='buffered', ACTIVITY_LOG_BUFFER_SIZE=10, ACTIVITY_LOG_FLUSH_INTERVAL=0)
+class BufferedActivityLogTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('logger', password='pass')
+
+    def tearDown(self):
+        # Buffers capture settings when created; drop them between tests
+        flush_activity_logs()
+        activity._buffers.clear()
+
+    def test_events_are_written_in_bulk_with_event_time(self):
+        before = time.time()
+        with self.assertNumQueries(0):
+            for i in range(9):
+                log_activity(self.user, 'file_uploaded', {'n': i})
+        with self.assertNumQueries(1):
+            log_activity(self.user, 'file_uploaded', {'n': 9})
+        log_activity(self.user.id, 'file_uploaded', {'n': 10})
+
+        self.assertEqual(ActivityLog.objects.count(), 10)
+        self.assertEqual(flush_activity_logs(), 1)
+        self.assertEqual(ActivityLog.objects.count(), 11)
+        first = ActivityLog.objects.order_by('timestamp').first()
+        self.assertEqual(first.metadata, {'n': 0})
+        self.assertGreaterEqual(first.timestamp.timestamp(), before)
+
+    def test_payment_events_are_written_at_once(self):
+        with self.assertNumQueries(1):
+            log_activity(self.user, 'payment_success', {'transaction_id': 'txn_audit'})
+        self.assertTrue(ActivityLog.objects.filter(action='payment_success').exists())
+        self.assertEqual(flush_activity_logs(), 0)
+
+    def test_shutdown_flush_writes_everything(self):
+        for i in range(25):
+            log_activity(self.user, 'file_uploaded', {'n': i})
+        flush_activity_logs()
+        self.assertEqual(
+            sorted(ActivityLog.objects.values_list('metadata__n', flat=True)), list(range(25)),
+        )
+
+    @override_settings(ACTIVITY_LOG_BACKEND='celery')
+    def test_celery_backend_hands_batches_to_task(self):
+        with mock.patch.object(write_activity_logs, 'delay', side_effect=lambda events: write_activity_logs(events)) as delay:
+            for i in range(12):
+                log_activity(self.user, 'file_uploaded', {'n': i})
+            flush_activity_logs()
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [10, 2])
+        self.assertEqual(ActivityLog.objects.count(), 12)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    router = ReplicaRouter()
+
+    @override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'])
+    def test_reads_go_to_a_replica_only_inside_replica_reads(self):
+        self.assertIsNone(self.router.db_for_read(FileUpload))
+        with replica_reads():
+            self.assertIn(self.router.db_for_read(FileUpload), {'replica_1', 'replica_2'})
+            self.assertEqual(self.router.db_for_write(FileUpload), 'default')
+        self.assertIsNone(self.router.db_for_read(FileUpload))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_the_primary(self):
+        self.assertEqual(read_replica(), 'default')
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(FileUpload), 'default')
+
+
+class SQLiteReplicaRoutingTests(MediaRootMixin, TransactionTestCase):
+    """Primary and replica as two local SQLite files; rows saved to one only show where reads are routed"""
+
+    ALIAS = 'replica_1'
+    # Resolved at setUpClass, after the replica alias is added
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # The replica alias only exists for this class; it must be in place
+        # before the test case checks its databases
+        fd, cls.replica_path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        connections.settings[cls.ALIAS] = {**connections['default'].settings_dict, 'NAME': cls.replica_path}
+        call_command('migrate', database=cls.ALIAS, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.ALIAS].close()
+        del connections[cls.ALIAS]
+        del connections.settings[cls.ALIAS]
+        os.remove(cls.replica_path)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        override = override_settings(DATABASE_REPLICAS=[self.ALIAS])
+        override.enable()
+        self.addCleanup(override.disable)
+
+        # "Replicate" the account, so authentication works on either side
+        self.user = User.objects.create_user('replicated', password='pass')
+        self.token = Token.objects.create(user=self.user)
+        self.user.save(using=self.ALIAS)
+        self.token.save(using=self.ALIAS)
+
+    def save_on_replica(self, obj):
+        obj.save(using=self.ALIAS)
+        return obj
+
+    def test_read_only_viewsets_read_from_the_replica(self):
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_primary', amount=100, status='success')
+        self.save_on_replica(PaymentTransaction(user=self.user, transaction_id='txn_replica', amount=100))
+        self.save_on_replica(ActivityLog(user=self.user, action='replica_only'))
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+
+        transactions = self.client.get('/api/transactions/', **headers).json()['results']
+        self.assertEqual([row['transaction_id'] for row in transactions], ['txn_replica'])
+        activities = self.client.get('/api/activity/', **headers).json()['results']
+        self.assertEqual([row['action'] for row in activities], ['replica_only'])
+
+    def test_file_viewset_reads_the_primary(self):
+        # Uploads are listed right after they are written, so no replica lag is allowed
+        primary = FileUpload.objects.create(user=self.user, file='uploads/p.txt', filename='primary.txt')
+        self.save_on_replica(FileUpload(id=primary.id + 1, user=self.user, file='uploads/r.txt', filename='replica.txt'))
+        headers = {'HTTP_AUTHORIZATION': f'Token {self.token.key}'}
+
+        files = self.client.get('/api/files/', **headers).json()['results']
+        self.assertEqual([row['id'] for row in files], [primary.id])
+
+    def test_dashboard_listings_read_from_the_replica(self):
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_primary', amount=100, status='success')
+        self.save_on_replica(PaymentTransaction(user=self.user, transaction_id='txn_replica', amount=100, status='success'))
+        self.save_on_replica(FileUpload(user=self.user, file='uploads/r.txt', filename='replica.txt'))
+        self.client.force_login(self.user)
+
+        response = self.client.get('/dashboard/')
+        self.assertContains(response, 'replica.txt')
+        self.assertContains(response, 'txn_replica')
+        self.assertNotContains(response, 'txn_primary')
+
+    def test_instances_read_from_a_replica_are_saved_to_the_primary(self):
+        self.save_on_replica(PaymentTransaction.objects.create(user=self.user, transaction_id='txn_1', amount=100))
+
+        with replica_reads():
+            payment = PaymentTransaction.objects.get(transaction_id='txn_1')
+        payment.status = 'success'
+        payment.save()
+
+        self.assertEqual(PaymentTransaction.objects.get(transaction_id='txn_1').status, 'success')
+        self.assertEqual(PaymentTransaction.objects.using(self.ALIAS).get(transaction_id='txn_1').status, 'pending')
+
+
+class SQLiteTuningTests(SimpleTestCase):
+    ALIAS = 'sqlite_tuning_test'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'tuning.sqlite3')
+
+    def open_connection(self):
+        # A connection of its own, outside the test database
+        wrapper = SQLiteDatabaseWrapper(
+            {**connections['default'].settings_dict, 'NAME': self.path, 'OPTIONS': {}}, self.ALIAS
+        )
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        return wrapper.connection.execute(f'PRAGMA {name}').fetchone()[0]
+
+    @override_settings(SQLITE_TUNING=True, SQLITE_BUSY_TIMEOUT=1234, SQLITE_MMAP_SIZE=1 << 20)
+    def test_new_connections_are_tuned(self):
+        wrapper = self.open_connection()
+
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(wrapper, 'synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 1234)
+        self.assertEqual(self.pragma(wrapper, 'mmap_size'), 1 << 20)
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+
+    @override_settings(SQLITE_TUNING=False)
+    def test_tuning_can_be_turned_off(self):
+        wrapper = self.open_connection()
+
+        self.assertEqual(self.pragma(wrapper, 'journal_mode'), 'delete')
+        self.assertIsNone(wrapper.transaction_mode)
+
+    def run_writers(self, writers=4):
+        """Return the most threads seen inside serialized_writes() at once"""
+        inside = []
+        peak = []
+        barrier = threading.Barrier(writers)
+
+        def write():
+            connections[self.ALIAS] = SQLiteDatabaseWrapper(
+                {**connections['default'].settings_dict, 'NAME': self.path}, self.ALIAS
+            )
+            barrier.wait()
+            with serialized_writes(self.ALIAS):
+                inside.append(1)
+                peak.append(len(inside))
+                time.sleep(0.02)
+                inside.pop()
+
+        threads = [threading.Thread(target=write) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return max(peak)
+
+    @override_settings(SQLITE_SERIALIZE_WRITES=True)
+    def test_serialized_writes_admit_one_writer_at_a_time(self):
+        self.assertEqual(self.run_writers(), 1)
+
+    @override_settings(SQLITE_SERIALIZE_WRITES=False)
+    def test_serialized_writes_can_be_turned_off(self):
+        self.assertGreater(self.run_writers(), 1)
+
+
+class SQLiteWritersBenchmarkCommandTests(SimpleTestCase):
+    def test_compares_baseline_and_tuned_writers(self):
+        out = io.StringIO()
+        call_command('benchmark_sqlite_writers', json=True, writers=4, writes=10, readers=1, stdout=out)
+        reports = {report['mode']: report for report in json.loads(out.getvalue())}
+
+        self.assertEqual(reports['baseline']['journal_mode'], 'delete')
+        self.assertEqual(reports['tuned']['journal_mode'], 'wal')
+        for report in reports.values():
+            self.assertEqual(report['writes']['requests'], 40)
+            self.assertGreater(report['writes']['requests_per_second'], 0)
+        # Writers wait for the lock instead of failing with "database is locked"
+        self.assertEqual(reports['tuned']['writes']['errors'], 0)
+
+
+@override_settings(DASHBOARD_LIST_LIMIT=5)
+class DashboardTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('dash', password='pass')
+        Token.objects.create(user=self.user)
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_ok', amount=100, status='success')
+        FileUpload.objects.bulk_create(
+            [FileUpload(user=self.user, file=f'uploads/{i}.txt', filename=f'file_{i}.txt') for i in range(20)]
+        )
+        ActivityLog.objects.bulk_create([ActivityLog(user=self.user, action='file_uploaded') for _ in range(20)])
+        self.client.force_login(self.user)
+        # Fragments are only cached when workers share the cache
+        shared = mock.patch('core.views.cache_is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+
+    def test_cold_render_is_capped(self):
+        # session + user, token, payments (also answers "has paid"), files, activity
+        with self.assertNumQueries(6):
+            response = self.client.get('/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['has_successful_payment'])
+        self.assertEqual(response.content.decode().count('bi-file-earmark-text'), 5)
+
+    def test_warm_render_only_loads_the_session(self):
+        self.client.get('/dashboard/')
+        with self.assertNumQueries(2):
+            response = self.client.get('/dashboard/')
+        self.assertContains(response, 'file_19.txt')
+        self.assertContains(response, 'Payment Verified')
+
+    def test_unpaid_user_render_is_capped(self):
+        PaymentTransaction.objects.filter(user=self.user).update(status='failed')
+        with self.assertNumQueries(7):
+            response = self.client.get('/dashboard/')
+        self.assertFalse(response.context['has_successful_payment'])
+
+    def test_new_upload_invalidates_files_fragment(self):
+        self.client.get('/dashboard/')
+        api = APIClient()
+        api.force_authenticate(self.user)
+        with mock.patch('core.tasks.process_file_word_count_with_content.apply_async'):
+            api.post('/api/files/', {'file': SimpleUploadedFile('fresh.txt', b'new words')}, format='multipart')
+        self.assertContains(self.client.get('/dashboard/'), 'fresh.txt')
+
+    def test_task_completion_invalidates_files_fragment(self):
+        self.write_media_file('uploads/19.txt', 'one two three')
+        self.client.get('/dashboard/')
+        upload = FileUpload.objects.get(filename='file_19.txt')
+        process_file_word_count_with_content(upload.id)
+        self.assertContains(self.client.get('/dashboard/'), '<span class="badge bg-info">3</span>', html=True)
+
+    def test_worker_updates_show_without_a_shared_cache(self):
+        self.write_media_file('uploads/19.txt', 'one two three')
+        upload = FileUpload.objects.get(filename='file_19.txt')
+        with mock.patch('core.views.cache_is_shared', return_value=False):
+            self.client.get('/dashboard/')
+            # The worker invalidates in its own process-local cache
+            with mock.patch('core.dashboard_cache.cache', LocMemCache('worker', {})):
+                process_file_word_count_with_content(upload.id)
+            response = self.client.get('/dashboard/')
+        self.assertContains(response, '<span class="badge bg-info">3</span>', html=True)
+
+    def test_payment_callback_invalidates_payments_fragment(self):
+        self.client.get('/dashboard/')
+        PaymentTransaction.objects.create(user=self.user, transaction_id='txn_new', amount=100)
+        self.client.get('/api/payment/fail/', {'mer_txnid': 'txn_new'})
+        response = self.client.get('/dashboard/')
+        self.assertContains(response, 'txn_new')
+        self.assertContains(response, 'payment_failed')
+
+
+@override_settings(
+    FILE_STATUS_STREAM_POLL_INTERVAL=0.02,
+    FILE_STATUS_STREAM_TIMEOUT=0.3,
+    FILE_STATUS_STREAM_HEARTBEAT=0.1,
+)
+class FileStatusStreamTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user('watcher', password='pass')
+
+    def make_upload(self, **kwargs):
+        return FileUpload.objects.create(user=self.user, file='uploads/w.txt', filename='w.txt', **kwargs)
+
+    def test_task_publishes_one_event_per_state_change(self):
+        self.write_media_file('uploads/w.txt', 'four little words here')
+        upload = self.make_upload()
+        process_file_word_count_with_content(upload.id)
+
+        self.assertEqual(read_events(self.user.id, 0), [(1, {'id': upload.id, 'status': 'completed', 'word_count': 4})])
+        self.assertEqual(read_events(self.user.id, 1), [])
+
+    def test_batch_publishes_each_upload(self):
+        uploads = [self.make_upload(), self.make_upload()]
+        process_file_word_count_batch([upload.id for upload in uploads])
+        self.assertEqual(sorted(event['id'] for _, event in read_events(self.user.id, 0)), sorted(u.id for u in uploads))
+
+    def test_backlog_is_bounded(self):
+        upload = self.make_upload()
+        with self.settings(FILE_STATUS_EVENT_BACKLOG=3):
+            for _ in range(10):
+                publish_file_status(upload)
+            self.assertEqual([seq for seq, _ in read_events(self.user.id, 0)], [8, 9, 10])
+
+    async def read_stream(self, client, **headers):
+        response = await client.get('/api/file-events/', headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return ''.join([chunk.decode() async for chunk in response.streaming_content])
+
+    async def test_stream_resumes_from_last_event_id(self):
+        upload = await FileUpload.objects.acreate(user=self.user, file='uploads/w.txt', filename='w.txt')
+        for state in ('processing', 'completed'):
+            upload.status = state
+            publish_file_status(upload)
+
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        body = await self.read_stream(client, **{'Last-Event-ID': '1'})
+
+        self.assertNotIn('id: 1\n', body)
+        self.assertIn(f'id: 2\nevent: file_status\ndata: {{"id": {upload.id}, "status": "completed"', body)
+        self.assertIn(': keep-alive', body)
+
+    async def test_new_subscriber_gets_only_new_events(self):
+        upload = await FileUpload.objects.acreate(user=self.user, file='uploads/w.txt', filename='w.txt')
+        publish_file_status(upload)
+        token = await Token.objects.acreate(user=self.user)
+
+        body = await self.read_stream(AsyncClient(), Authorization=f'Token {token.key}')
+
+        self.assertNotIn('event: file_status', body)
+
+    async def test_requires_authentication(self):
+        response = await AsyncClient().get('/api/file-events/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_wsgi_stream_starts_without_waiting_for_the_timeout(self):
+        self.client.force_login(self.user)
+        with self.settings(FILE_STATUS_STREAM_TIMEOUT=30):
+            response = self.client.get('/api/file-events/')
+            self.assertFalse(response.is_async)
+            started = time.monotonic()
+            first = next(iter(response.streaming_content))
+            response.close()
+        self.assertTrue(first.startswith(b'retry: '))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_dashboard_subscribes_only_when_events_can_be_pushed(self):
+        self.make_upload()
+        self.client.force_login(self.user)
+        # WSGI, or a per-process cache the workers cannot publish to
+        self.assertNotContains(self.client.get('/dashboard/'), 'new EventSource')
+        with mock.patch('core.views.cache_is_shared', return_value=True):
+            self.assertNotContains(self.client.get('/dashboard/'), 'new EventSource')
+
+    async def test_asgi_dashboard_with_shared_cache_subscribes(self):
+        await FileUpload.objects.acreate(user=self.user, file='uploads/w.txt', filename='w.txt')
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        with mock.patch('core.views.cache_is_shared', return_value=True):
+            response = await client.get('/dashboard/')
+        self.assertContains(response, 'new EventSource')
+        self.assertNotContains(await client.get('/dashboard/'), 'new EventSource')
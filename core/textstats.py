@@ -0,0 +1,316 @@
+"""
+Single-pass text statistics.
+
+``TextStats`` is fed the same text chunks as the word counter and derives
+every metric from that one read: words, lines, characters, sentences,
+distinct words and the most frequent words. Memory stays bounded however
+large the vocabulary gets. Distinct words are counted exactly up to
+``TEXT_STATS_EXACT_DISTINCT_LIMIT`` and then by a HyperLogLog sketch
+(about 0.8% standard error). Frequent words are tracked by a Space-Saving
+summary of ``TEXT_STATS_SKETCH_SIZE`` counters, which is exact while the
+vocabulary fits and otherwise overestimates a count by at most the smallest
+tracked count.
+
+Both sketches merge, so whitespace-aligned byte ranges can be analyzed in a
+process pool and combined, like the parallel word count.
+
+Words are whitespace-separated tokens, exactly as ``str.split()`` finds
+them. For distinct and frequent words each token is lowercased and
+surrounding punctuation is stripped. A sentence ends at a token ending in
+``.``, ``!``, ``?`` or ``…`` (closing quotes and brackets aside), and
+trailing text without one counts as a last sentence.
+"""
+import codecs
+import hashlib
+import heapq
+import math
+import os
+import re
+import string
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .processing import CHUNK_SIZE, iter_docx_text, iter_text_chunks, split_byte_ranges
+
+_TERM_PUNCTUATION = string.punctuation + '“”‘’«»–—…¿¡'
+
+# A token ending a sentence: terminator, optional closers, then whitespace or the end
+_SENTENCE_END = re.compile(r'[.!?…]["\')\]}»”’]*(?!\S)')
+
+# A word longer than this is only remembered by its prefix while it spans
+# chunks, so a file without whitespace cannot grow the carried-over token
+_MAX_CARRY = 1024
+
+HLL_PRECISION = 14
+
+
+def _is_sentence_end(token):
+    return _SENTENCE_END.search(token) is not None
+
+
+def _hash64(term):
+    # Stable across processes, unlike hash(), so sketches from pool workers merge
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """Cardinality sketch with 2**precision one-byte registers"""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def update(self, terms):
+        registers = self.registers
+        shift = 64 - self.precision
+        mask = (1 << shift) - 1
+        for term in terms:
+            value = _hash64(term)
+            rank = shift - (value & mask).bit_length() + 1
+            if rank > registers[value >> shift]:
+                registers[value >> shift] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are empty
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class DistinctCounter:
+    """Exact set of terms that turns into a HyperLogLog past ``exact_limit`` terms"""
+
+    def __init__(self, exact_limit):
+        self.exact_limit = exact_limit
+        self.terms = set()
+        self.sketch = None
+
+    def update(self, terms):
+        if self.sketch is None:
+            self.terms.update(terms)
+            if len(self.terms) > self.exact_limit:
+                self._spill()
+        else:
+            self.sketch.update(terms)
+
+    def _spill(self):
+        self.sketch = HyperLogLog()
+        self.sketch.update(self.terms)
+        self.terms = set()
+
+    def merge(self, other):
+        if other.sketch is None:
+            self.update(other.terms)
+            return
+        if self.sketch is None:
+            self._spill()
+        self.sketch.merge(other.sketch)
+
+    def count(self):
+        return len(self.terms) if self.sketch is None else self.sketch.count()
+
+
+class SpaceSaving:
+    """Heavy-hitter summary keeping at most ``capacity`` term counters"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+
+    def floor(self):
+        # Upper bound on the count of any term not in the summary
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge_counts(self, counts, floor=0):
+        """Fold in another summary's counts (``floor`` is its own floor; 0 for exact counts)"""
+        own_floor = self.floor()
+        combined = {term: count + counts.get(term, floor) for term, count in self.counts.items()}
+        for term, count in counts.items():
+            if term not in combined:
+                combined[term] = count + own_floor
+        if len(combined) > self.capacity:
+            combined = dict(heapq.nlargest(self.capacity, combined.items(), key=lambda item: item[1]))
+        self.counts = combined
+
+    def merge(self, other):
+        self.merge_counts(other.counts, other.floor())
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+
+class TextStats:
+    """Accumulates every text statistic over a stream of text chunks"""
+
+    def __init__(self, sketch_size=1000, exact_distinct_limit=50000):
+        self.words = 0
+        self.characters = 0
+        self.newlines = 0
+        self.sentence_ends = 0
+        self.last_char = ''
+        self.last_token = ''
+        self.distinct = DistinctCounter(exact_distinct_limit)
+        self.frequent = SpaceSaving(sketch_size)
+        self._carry = ''
+
+    def feed(self, chunk):
+        if not chunk:
+            return
+        self.characters += len(chunk)
+        self.newlines += chunk.count('\n')
+        self.last_char = chunk[-1]
+
+        # Terms are case-folded, so lowercase the whole chunk at once
+        text = self._carry + chunk.lower()
+        if chunk[-1].isspace():
+            self._carry = ''
+        else:
+            # The last token may continue in the next chunk
+            tail = text.rsplit(None, 1)[-1]
+            text, self._carry = text[:-len(tail)], tail[:_MAX_CARRY]
+        self._add_text(text)
+
+    def flush(self):
+        """Count a token left over at the end of the stream"""
+        if self._carry:
+            self._add_text(self._carry)
+            self._carry = ''
+
+    def _add_text(self, text):
+        # ``text`` always ends at a token boundary
+        tokens = text.split()
+        if not tokens:
+            return
+        self.words += len(tokens)
+        self.last_token = tokens[-1]
+        self.sentence_ends += len(_SENTENCE_END.findall(text))
+
+        # Aggregate the chunk first so each distinct token is stripped and
+        # sketched once per chunk rather than once per occurrence
+        terms = Counter()
+        for token, count in Counter(tokens).items():
+            term = token.strip(_TERM_PUNCTUATION)
+            if term:
+                terms[term] += count
+        self.distinct.update(terms)
+        self.frequent.merge_counts(terms)
+
+    def merge(self, other):
+        """Append the statistics of the text that follows this one"""
+        self.words += other.words
+        self.characters += other.characters
+        self.newlines += other.newlines
+        self.sentence_ends += other.sentence_ends
+        if other.characters:
+            self.last_char = other.last_char
+        if other.words:
+            self.last_token = other.last_token
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+
+    @property
+    def lines(self):
+        # Like ``wc -l``, plus a final line that has no newline
+        return self.newlines + (1 if self.last_char and self.last_char != '\n' else 0)
+
+    @property
+    def sentences(self):
+        unterminated = self.words and not _is_sentence_end(self.last_token)
+        return self.sentence_ends + (1 if unterminated else 0)
+
+    def top_words(self, n):
+        return [[term, count] for term, count in self.frequent.top(n)]
+
+    def as_fields(self, top_n):
+        """Return the statistics keyed by ``FileUpload`` field name"""
+        return {
+            'word_count': self.words,
+            'text_stats': {
+                'lines': self.lines,
+                'characters': self.characters,
+                'sentences': self.sentences,
+                'unique_words': self.distinct.count(),
+                'top_words': self.top_words(top_n),
+            },
+        }
+
+
+def analyze_chunks(chunks, **options):
+    stats = TextStats(**options)
+    for chunk in chunks:
+        stats.feed(chunk)
+    stats.flush()
+    return stats
+
+
+def analyze_range(file_path, start, end, encoding='utf-8', chunk_size=CHUNK_SIZE, **options):
+    """Analyze bytes ``[start, end)`` of a file, decoding incrementally"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+
+    def chunks():
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield decoder.decode(data)
+        yield decoder.decode(b'', final=True)
+
+    return analyze_chunks(chunks(), **options)
+
+
+def _analyze_text_file(file_path, encoding='utf-8', **options):
+    with open(file_path, 'r', encoding=encoding) as f:
+        return analyze_chunks(iter_text_chunks(f), **options)
+
+
+def analyze_parallel(file_path, workers, encoding='utf-8', **options):
+    """
+    Analyze whitespace-aligned byte ranges in a process pool and merge them in order.
+
+    Falls back to a serial pass if a pool cannot be started in this process.
+    """
+    ranges = split_byte_ranges(file_path, workers)
+    if len(ranges) < 2:
+        return _analyze_text_file(file_path, encoding, **options)
+    try:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [
+                pool.submit(analyze_range, file_path, start, end, encoding, **options)
+                for start, end in ranges
+            ]
+            stats = futures[0].result()
+            for future in futures[1:]:
+                stats.merge(future.result())
+            return stats
+    except (OSError, AssertionError, BrokenProcessPool):
+        return _analyze_text_file(file_path, encoding, **options)
+
+
+def analyze_file(file_path, parallel_threshold=0, parallel_workers=1, **options):
+    """
+    Return the ``TextStats`` of an uploaded file, picking the reader by extension.
+
+    Mirrors ``count_file_words``: .docx bodies are parsed incrementally and
+    text files of at least ``parallel_threshold`` bytes (0 disables) are
+    split across ``parallel_workers`` processes.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.docx':
+        return analyze_chunks(iter_docx_text(file_path), **options)
+    if (parallel_threshold and parallel_workers > 1
+            and os.path.getsize(file_path) >= parallel_threshold):
+        return analyze_parallel(file_path, parallel_workers, **options)
+    return _analyze_text_file(file_path, **options)
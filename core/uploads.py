@@ -0,0 +1,187 @@
+"""
+Chunked, resumable uploads.
+
+A client opens a session with the file name and size, appends the bytes in
+chunks (each one streamed from the request to disk and then appended to a
+``.part`` file under ``MEDIA_ROOT``) and completes the session, which hashes
+the assembled file in fixed-size reads and moves it into ``uploads/``. The
+session row records how many bytes are safely on disk, so after a dropped
+connection the client asks for the offset and carries on from there.
+"""
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ChunkedUpload, FileUpload
+from .processing import CHUNK_SIZE, digest_chunks
+
+
+class ChunkOffsetMismatch(Exception):
+    """The chunk does not start where the session's received bytes end"""
+
+
+class ChunkTooLarge(Exception):
+    """The chunk would take the session past its declared size"""
+
+
+class SessionBusy(Exception):
+    """Another request is already completing the session"""
+
+
+def part_path(session):
+    return os.path.join(settings.MEDIA_ROOT, session.part_name)
+
+
+def start_session(session):
+    """Create the empty ``.part`` file for a new session"""
+    path = part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+
+def _write_at(path, spool, offset):
+    """Copy ``spool`` into the file at ``path`` from ``offset`` and cut off anything after it"""
+    spool.seek(0)
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        shutil.copyfileobj(spool, f, CHUNK_SIZE)
+        f.truncate()
+
+
+def append_chunk(session, offset, stream):
+    """
+    Stream one chunk from ``stream`` into the session's part file at ``offset``.
+
+    Only one ``CHUNK_SIZE`` read is held in memory at a time. The chunk is
+    first received into a spool file of its own. A conditional UPDATE then
+    claims the session for the copy into the part file, and a second one
+    moves the offset once the bytes are written; no transaction stays open
+    during the copy. Concurrent requests at the same offset therefore never
+    touch the part file together: the second finds the session claimed or
+    the offset moved and is refused. Bytes left past ``offset`` by an
+    earlier, interrupted chunk are overwritten. Returns the new offset.
+    """
+    if offset != session.received_bytes:
+        raise ChunkOffsetMismatch()
+
+    path = part_path(session)
+    remaining = session.total_size - offset
+    written = 0
+    with tempfile.TemporaryFile(dir=os.path.dirname(path)) as spool:
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            if not data:
+                break
+            written += len(data)
+            if written > remaining:
+                raise ChunkTooLarge()
+            spool.write(data)
+
+        # Another request may have appended at the same offset meanwhile
+        claimed = ChunkedUpload.objects.filter(
+            pk=session.pk, status='uploading', received_bytes=offset
+        ).update(status='receiving', updated_at=timezone.now())
+        if not claimed:
+            raise ChunkOffsetMismatch()
+        try:
+            _write_at(path, spool, offset)
+        except BaseException:
+            _release(session, 'receiving')
+            raise
+    # The new offset only counts bytes that are on disk
+    ChunkedUpload.objects.filter(pk=session.pk, status='receiving').update(
+        status='uploading', received_bytes=offset + written, updated_at=timezone.now()
+    )
+    session.received_bytes = offset + written
+    return session.received_bytes
+
+
+def complete_session(session):
+    """
+    Turn a fully received session into a ``FileUpload`` row.
+
+    The digest is computed over the part file in ``CHUNK_SIZE`` reads. With
+    ``FILE_UPLOAD_REUSE_DUPLICATES`` a file the same user already stored
+    under the same digest is reused and the part file is dropped; otherwise
+    the part file is renamed into ``uploads/`` without copying.
+
+    A conditional UPDATE claims the session first, so of two concurrent or
+    retried calls only one reads and moves the part file; the other gets
+    ``SessionBusy``.
+    """
+    claimed = ChunkedUpload.objects.filter(
+        pk=session.pk, status='uploading', received_bytes=F('total_size')
+    ).update(status='completing', updated_at=timezone.now())
+    if not claimed:
+        raise SessionBusy()
+
+    path = part_path(session)
+    try:
+        digest = digest_chunks(_read_file(path))
+
+        name = None
+        if settings.FILE_UPLOAD_REUSE_DUPLICATES:
+            existing_name = (
+                FileUpload.objects.filter(
+                    user_id=session.user_id,
+                    content_digest=digest,
+                    # Same extension, so the stored copy is parsed the same way
+                    file__iendswith=os.path.splitext(session.filename)[1],
+                )
+                .values_list('file', flat=True)
+                .first()
+            )
+            if existing_name and default_storage.exists(existing_name):
+                name = existing_name
+                os.remove(path)
+        if name is None:
+            field = FileUpload._meta.get_field('file')
+            name = default_storage.get_available_name(field.generate_filename(None, session.filename))
+            target = os.path.join(settings.MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(path, target)
+    except BaseException:
+        _release(session, 'completing')
+        raise
+
+    file_upload = FileUpload.objects.create(
+        user_id=session.user_id,
+        file=name,
+        filename=session.filename,
+        status='processing',
+        content_digest=digest,
+    )
+    session.status = 'complete'
+    session.file_upload = file_upload
+    session.save(update_fields=['status', 'file_upload', 'updated_at'])
+    return file_upload
+
+
+def _release(session, claimed_status):
+    """Hand a session claimed with ``claimed_status`` back after a failed write"""
+    ChunkedUpload.objects.filter(pk=session.pk, status=claimed_status).update(
+        status='uploading', updated_at=timezone.now()
+    )
+
+
+def discard_session(session):
+    """Delete a session and its part file"""
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
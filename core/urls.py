@@ -9,10 +9,14 @@ router = DefaultRouter()
 router.register(r'files', views.FileUploadViewSet, basename='fileupload')
 router.register(r'transactions', views.PaymentTransactionViewSet, basename='paymenttransaction')
 router.register(r'activity', views.ActivityLogViewSet, basename='activitylog')
+router.register(r'uploads', views.ChunkedUploadViewSet, basename='chunkedupload')
 
 urlpatterns = [
+    path('api/file-events/', views.file_status_stream, name='file_status_stream'),
+    path('api/metrics/', views.metrics_view, name='metrics'),
     path('api/', include(router.urls)),
     path('api/initiate-payment/', views.initiate_payment, name='initiate_payment'),
+    path('api/initiate-payment-async/', views.initiate_payment_async, name='initiate_payment_async'),
     path('api/payment/success/', views.payment_success, name='payment_success'),
     path('api/payment/fail/', views.payment_fail, name='payment_fail'),
     path('api/payment/cancel/', views.payment_cancel, name='payment_cancel'),
@@ -1,32 +1,44 @@
-import requests
+import asyncio
+import io
+import json
+import time
 import uuid
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.shortcuts import render, redirect
-from django.http import JsonResponse
-from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from .models import FileUpload, PaymentTransaction, ActivityLog
-from .serializers import FileUploadSerializer, PaymentTransactionSerializer, ActivityLogSerializer
-from .tasks import process_file_word_count_with_content
+from .models import FileUpload, PaymentTransaction, ActivityLog, ChunkedUpload
+from .serializers import FileUploadSerializer, BulkFileUploadSerializer, PaymentTransactionSerializer, ActivityLogSerializer, ChunkedUploadSerializer
+from .pagination import TimestampCursorPagination, UploadTimeCursorPagination
+from .tasks import queue_word_count, queue_word_count_batches
+from . import gateway
+from .activity import alog_activity, log_activity
+from .entitlements import grant_entitlement, has_successful_payment, is_entitlement_cached, revoke_entitlement
+from .dashboard_cache import get_auth_token_key, get_dashboard_versions, invalidate_dashboard
+from .events import cache_is_shared, latest_event_id, publish_file_status, read_events
+from .db_router import read_replica, replica_reads
+from . import metrics, uploads
 
 class FileUploadViewSet(viewsets.ModelViewSet):
     serializer_class = FileUploadSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = UploadTimeCursorPagination
     
     def get_queryset(self):
-        return FileUpload.objects.filter(user=self.request.user)
+        # The preview blob is only read by the preview action
+        return FileUpload.objects.filter(user=self.request.user).defer('preview')
     
     def create(self, request, *args, **kwargs):
-        # Check if user has made a successful payment
-        has_successful_payment = PaymentTransaction.objects.filter(
-            user=request.user, 
-            status='success'
-        ).exists()
-        
-        if not has_successful_payment:
+        # Check if user has made a successful payment (cached once paid)
+        if not has_successful_payment(request.user):
             return Response(
                 {"error": "Payment required before uploading files"}, 
                 status=status.HTTP_403_FORBIDDEN
@@ -57,28 +69,179 @@ class FileUploadViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         file_upload = serializer.save(user=self.request.user, status='processing')
+        _start_processing(self.request.user, file_upload, serializer.validated_data['file'].size)
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Upload many files (multipart field ``files``, repeated) in one request.
+
+        All files are validated before any is stored; the rows are inserted
+        with one ``bulk_create``, logged as one activity entry and queued as
+        word-count batches instead of one task per file.
+        """
+        if not has_successful_payment(request.user):
+            return Response(
+                {"error": "Payment required before uploading files"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        ActivityLog.objects.create(
-            user=self.request.user,
-            action='file_uploaded',
-            metadata={
-                'file_id': file_upload.id,
-                'filename': file_upload.filename
+        serializer = BulkFileUploadSerializer(
+            data={'files': request.FILES.getlist('files')},
+            context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            file_uploads = serializer.save()
+        file_ids = [file_upload.id for file_upload in file_uploads]
+        
+        invalidate_dashboard(request.user.pk, 'files')
+        publish_file_status(file_uploads)
+        log_activity(
+            request.user,
+            'files_uploaded',
+            {
+                'count': len(file_ids),
+                'file_ids': file_ids
             }
         )
         
-        process_file_word_count_with_content.delay(file_upload.id)
+        # With batching enabled the periodic dispatcher picks the uploads up
+        if not settings.WORD_COUNT_BATCHING:
+            queue_word_count_batches(file_ids)
+        
+        data = FileUploadSerializer(file_uploads, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['get'])
+    def preview(self, request, pk=None):
+        """The first FILE_PREVIEW_SIZE characters of the file's text, once processed"""
+        file_upload = get_object_or_404(
+            FileUpload.objects.filter(user=request.user).only('id', 'status', 'preview'),
+            pk=pk
+        )
+        return Response({
+            'id': file_upload.id,
+            'status': file_upload.status,
+            'preview': file_upload.preview_text,
+        })
 
-class PaymentTransactionViewSet(viewsets.ReadOnlyModelViewSet):
+def _start_processing(user, file_upload, size):
+    """Announce a newly stored upload and queue its word count on the lane for its size"""
+    invalidate_dashboard(user.pk, 'files')
+    publish_file_status(file_upload)
+    
+    log_activity(
+        user,
+        'file_uploaded',
+        {
+            'file_id': file_upload.id,
+            'filename': file_upload.filename
+        }
+    )
+    
+    # With batching enabled the periodic dispatcher picks the upload up
+    if not settings.WORD_COUNT_BATCHING:
+        queue_word_count(file_upload.id, size)
+
+class ChunkedUploadViewSet(mixins.CreateModelMixin,
+                           mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    Resumable uploads for files above the single-request size limit.
+
+    ``POST /api/uploads/`` with ``filename`` and ``size`` opens a session;
+    ``PUT /api/uploads/<id>/chunk/`` with an ``Upload-Offset`` header and
+    the raw bytes as body appends a chunk; ``POST /api/uploads/<id>/complete/``
+    finishes the upload and queues processing. ``GET /api/uploads/<id>/``
+    returns the offset to resume from after a failure.
+    """
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return ChunkedUpload.objects.filter(user=self.request.user)
+    
+    def create(self, request, *args, **kwargs):
+        if not has_successful_payment(request.user):
+            return Response(
+                {"error": "Payment required before uploading files"}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return super().create(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        session = serializer.save(user=self.request.user)
+        uploads.start_session(session)
+    
+    def perform_destroy(self, instance):
+        uploads.discard_session(instance)
+    
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        if session.status in ('completing', 'complete'):
+            return Response({'error': 'Upload already completed'}, status=status.HTTP_409_CONFLICT)
+        
+        offset = request.headers.get('Upload-Offset', '')
+        if not offset.isdigit():
+            return Response({'error': 'Upload-Offset header required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Read the raw body; request.data would parse it into memory
+        stream = request.stream or io.BytesIO()
+        try:
+            new_offset = uploads.append_chunk(session, int(offset), stream)
+        except uploads.ChunkOffsetMismatch:
+            session.refresh_from_db(fields=['received_bytes'])
+            return Response(
+                {'error': 'Chunk does not start at the current offset', 'offset': session.received_bytes},
+                status=status.HTTP_409_CONFLICT
+            )
+        except uploads.ChunkTooLarge:
+            return Response(
+                {'error': 'Chunk exceeds the declared file size', 'offset': session.received_bytes},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'offset': new_offset})
+    
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        session = self.get_object()
+        if session.status == 'complete':
+            return Response({'error': 'Upload already completed'}, status=status.HTTP_409_CONFLICT)
+        if session.received_bytes != session.total_size:
+            return Response(
+                {'error': 'Upload incomplete', 'offset': session.received_bytes},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        try:
+            file_upload = uploads.complete_session(session)
+        except uploads.SessionBusy:
+            return Response({'error': 'Upload already being completed'}, status=status.HTTP_409_CONFLICT)
+        _start_processing(request.user, file_upload, session.total_size)
+        return Response(FileUploadSerializer(file_upload).data, status=status.HTTP_201_CREATED)
+
+class ReplicaReadMixin:
+    """Serve every query of the viewset, authentication included, from a read replica"""
+    
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+class PaymentTransactionViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = PaymentTransactionSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = TimestampCursorPagination
     
     def get_queryset(self):
         return PaymentTransaction.objects.filter(user=self.request.user)
 
-class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
+class ActivityLogViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = ActivityLogSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = TimestampCursorPagination
     
     def get_queryset(self):
         return ActivityLog.objects.filter(user=self.request.user)
@@ -99,58 +262,177 @@ def initiate_payment(request):
         )
         
         # Log activity
-        ActivityLog.objects.create(
-            user=request.user,
-            action='payment_initiated',
-            metadata={'transaction_id': transaction_id, 'amount': 100}
-        )
-        
-        # Prepare payment data
-        payment_data = {
-            'store_id': settings.AAMARPAY_CONFIG['store_id'],
-            'signature_key': settings.AAMARPAY_CONFIG['signature_key'],
-            'tran_id': transaction_id,
-            'success_url': settings.AAMARPAY_CONFIG['success_url'],
-            'fail_url': settings.AAMARPAY_CONFIG['fail_url'],
-            'cancel_url': settings.AAMARPAY_CONFIG['cancel_url'],
-            'amount': settings.AAMARPAY_CONFIG['amount'],
-            'currency': settings.AAMARPAY_CONFIG['currency'],
-            'desc': 'Payment for file upload service',
-            'cus_name': request.user.get_full_name() or request.user.username,
-            'cus_email': request.user.email or 'test@example.com',
-            'cus_phone': '01800000000',
-            'type': 'json',
-            'cus_add1': 'Dhaka',
-            'cus_city': 'Dhaka',
-            'cus_country': 'Bangladesh',
-            'cus_postcode': '1000',
-        }
+        log_activity(request.user, 'payment_initiated', {'transaction_id': transaction_id, 'amount': 100})
+        invalidate_dashboard(request.user.pk, 'payments')
         
-        # Make request to aamarPay
-        response = requests.post(
-            settings.AAMARPAY_CONFIG['endpoint'],
-            json=payment_data,
-            headers={'Content-Type': 'application/json'}
-        )
+        # Make request to aamarPay over the shared keep-alive session
+        response = gateway.post_payment(gateway.build_payment_payload(request.user, transaction_id))
         
         # Parse response
         response_data = response.json()
         payment.gateway_response = response_data
-        payment.save()
-        
-        # Check result
-        if response_data.get('result') == 'true':
-            return Response({
-                'payment_url': response_data.get('payment_url'),
-                'transaction_id': transaction_id
-            })
-        else:
-            error_msg = response_data.get('error', response_data.get('message', 'Unknown error'))
-            return Response({'error': f'Payment gateway error: {error_msg}'}, status=status.HTTP_400_BAD_REQUEST)
+        # Only this column: the callback may already have settled the status
+        payment.save(update_fields=['gateway_response'])
+        
+        body, status_code = _payment_gateway_result(response_data, transaction_id)
+        return Response(body, status=status_code)
     
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _payment_gateway_result(response_data, transaction_id):
+    """Turn a gateway reply into the response body and status for the client"""
+    if response_data.get('result') == 'true':
+        return {
+            'payment_url': response_data.get('payment_url'),
+            'transaction_id': transaction_id
+        }, status.HTTP_200_OK
+    error_msg = response_data.get('error', response_data.get('message', 'Unknown error'))
+    return {'error': f'Payment gateway error: {error_msg}'}, status.HTTP_400_BAD_REQUEST
+
+async def _aget_token_user(request):
+    """Resolve the user from an ``Authorization: Token <key>`` header"""
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    try:
+        token = await Token.objects.select_related('user').aget(key=auth[1])
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+@csrf_exempt
+async def initiate_payment_async(request):
+    """
+    Async variant of ``initiate_payment`` for ASGI deployments.
+
+    The gateway call awaits on a pooled ``httpx.AsyncClient``, so a slow
+    gateway round-trip no longer holds a worker thread.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    
+    user = await _aget_token_user(request)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    try:
+        # Generate unique transaction ID
+        transaction_id = f"txn_{uuid.uuid4().hex[:8]}"
+        
+        payment = await PaymentTransaction.objects.acreate(
+            user=user,
+            transaction_id=transaction_id,
+            amount=100,
+            status='pending'
+        )
+        
+        await alog_activity(user, 'payment_initiated', {'transaction_id': transaction_id, 'amount': 100})
+        await sync_to_async(invalidate_dashboard)(user.pk, 'payments')
+        
+        response = await gateway.apost_payment(gateway.build_payment_payload(user, transaction_id))
+        
+        response_data = response.json()
+        payment.gateway_response = response_data
+        await payment.asave(update_fields=['gateway_response'])
+        
+        body, status_code = _payment_gateway_result(response_data, transaction_id)
+        return JsonResponse(body, status=status_code)
+    
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+def _can_push_file_events(request):
+    """Whether /api/file-events/ delivers live updates: an ASGI server and a cache the workers share"""
+    return isinstance(request, ASGIRequest) and cache_is_shared()
+
+def _file_event_frames(events):
+    for seq, event in events:
+        yield f"id: {seq}\nevent: file_status\ndata: {json.dumps(event)}\n\n"
+
+async def _file_event_stream(user_id, after):
+    """Yield server-sent events for a user's uploads until the stream times out"""
+    poll_interval = settings.FILE_STATUS_STREAM_POLL_INTERVAL
+    deadline = time.monotonic() + settings.FILE_STATUS_STREAM_TIMEOUT
+    last_sent = time.monotonic()
+    
+    # Tell the browser how long to wait before reconnecting
+    yield f"retry: {int(settings.FILE_STATUS_STREAM_RETRY * 1000)}\n\n"
+    
+    while time.monotonic() < deadline:
+        events = await sync_to_async(read_events)(user_id, after)
+        for frame in _file_event_frames(events):
+            yield frame
+        if events:
+            after = events[-1][0]
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= settings.FILE_STATUS_STREAM_HEARTBEAT:
+            # Comment line keeps proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        await asyncio.sleep(poll_interval)
+
+def _file_event_stream_sync(user_id, after):
+    """``_file_event_stream`` for WSGI, which would collect an async iterator whole before sending it"""
+    poll_interval = settings.FILE_STATUS_STREAM_POLL_INTERVAL
+    deadline = time.monotonic() + settings.FILE_STATUS_STREAM_TIMEOUT
+    last_sent = time.monotonic()
+    
+    yield f"retry: {int(settings.FILE_STATUS_STREAM_RETRY * 1000)}\n\n"
+    
+    while time.monotonic() < deadline:
+        events = read_events(user_id, after)
+        yield from _file_event_frames(events)
+        if events:
+            after = events[-1][0]
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= settings.FILE_STATUS_STREAM_HEARTBEAT:
+            yield ": keep-alive\n\n"
+            last_sent = time.monotonic()
+        time.sleep(poll_interval)
+
+async def file_status_stream(request):
+    """
+    Server-sent events stream of upload status changes for the current user.
+
+    Accepts the dashboard session or an ``Authorization: Token`` header. A
+    reconnecting client sends ``Last-Event-ID`` and receives what it missed.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        user = await _aget_token_user(request)
+    if user is None:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        after = int(last_event_id)
+    else:
+        # New subscribers only get changes from now on
+        after = await sync_to_async(latest_event_id)(user.pk)
+    
+    if isinstance(request, ASGIRequest):
+        stream = _file_event_stream(user.pk, after)
+    else:
+        # Each WSGI stream holds a worker thread until it times out
+        stream = _file_event_stream_sync(user.pk, after)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """Request and task histograms in Prometheus text format, for staff only"""
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def _handle_payment_callback(request, status_type):
     """Helper function to handle payment callbacks"""
     # Get transaction ID
@@ -161,17 +443,33 @@ def _handle_payment_callback(request, status_type):
     
     try:
         # Find payment transaction
-        payment = PaymentTransaction.objects.get(transaction_id=transaction_id)
-        payment.status = status_type
-        payment.save()
-        
-        # Log activity
-        ActivityLog.objects.create(
-            user=payment.user,
-            action=f'payment_{status_type}',
-            metadata={'transaction_id': transaction_id, 'amount': float(payment.amount)}
+        user_id, amount = PaymentTransaction.objects.values_list('user_id', 'amount').get(
+            transaction_id=transaction_id
         )
         
+        # Only a pending transaction moves, in one conditional UPDATE, so a
+        # retried or concurrent callback finds nothing to change and has no
+        # further effects
+        changed = PaymentTransaction.objects.filter(
+            transaction_id=transaction_id, status='pending'
+        ).update(status=status_type)
+        
+        if changed:
+            invalidate_dashboard(user_id, 'payments')
+            
+            # Keep the cached entitlement in step with the transaction
+            if status_type == 'success':
+                grant_entitlement(user_id)
+            else:
+                revoke_entitlement(user_id)
+            
+            # Log activity
+            log_activity(
+                user_id,
+                f'payment_{status_type}',
+                {'transaction_id': transaction_id, 'amount': float(amount)}
+            )
+        
         # Redirect to dashboard
         return redirect(f'/dashboard/?payment_status={status_type}&transaction_id={transaction_id}')
     
@@ -200,20 +498,38 @@ from django.contrib.auth.decorators import login_required
 @login_required
 def dashboard(request):
     user = request.user
-    has_successful_payment = PaymentTransaction.objects.filter(user=user, status='success').exists()
+    limit = settings.DASHBOARD_LIST_LIMIT
+    versions = get_dashboard_versions(user.pk)
+    
+    # The listings are read from a replica when one is configured.
+    # Querysets stay lazy: a cached fragment never evaluates its list
+    replica = read_replica()
+    payments = PaymentTransaction.objects.using(replica).filter(user=user).defer('gateway_response')[:limit]
     
-    # Get or create token for the user
-    token, created = Token.objects.get_or_create(user=user)
+    # A cached entitlement answers without a query; otherwise the payment
+    # window fetched for the table answers it, so both share one query
+    paid = is_entitlement_cached(user.pk)
+    if not paid:
+        payments = list(payments)
+        paid = has_successful_payment(user, recent_payments=payments)
     
     context = {
         'user': user,
-        'has_successful_payment': has_successful_payment,
-        'files': FileUpload.objects.filter(user=user).order_by('-upload_time'),
-        'activities': ActivityLog.objects.filter(user=user).order_by('-timestamp')[:10],
-        'payments': PaymentTransaction.objects.filter(user=user).order_by('-timestamp'),
-        'auth_token': token.key,
+        'has_successful_payment': paid,
+        'files': FileUpload.objects.using(replica).filter(user=user).only(
+            'id', 'filename', 'upload_time', 'status', 'word_count'
+        )[:limit],
+        'activities': ActivityLog.objects.using(replica).filter(user=user)[:limit],
+        'payments': payments,
+        'list_limit': limit,
+        # Workers invalidate fragments from their own processes; with a
+        # per-process cache that never reaches this one, so render uncached
+        'cache_timeout': settings.DASHBOARD_CACHE_TIMEOUT if cache_is_shared() else 0,
+        'versions': versions,
+        'auth_token': get_auth_token_key(user),
+        'live_file_status': _can_push_file_events(request),
         'payment_status': request.GET.get('payment_status'),
         'transaction_id': request.GET.get('transaction_id'),
     }
     
-    return render(request, 'core/dashboard.html', context)
\ No newline at end of file
+    return render(request, 'core/dashboard.html', context)
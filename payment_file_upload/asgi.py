@@ -13,4 +13,28 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'payment_file_upload.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from core import gateway  # noqa: E402  (needs the app registry set up above)
+
+
+async def lifespan(receive, send):
+    """Keep the gateway's async client for the server's loop and close it on shutdown"""
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            gateway.start_async_clients()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await gateway.aclose_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# Serve with an ASGI server (e.g. ``uvicorn payment_file_upload.asgi:application``)
+# so async views such as ``initiate_payment_async`` run on the event loop.
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    else:
+        await django_application(scope, receive, send)
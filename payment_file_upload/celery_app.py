@@ -1,6 +1,8 @@
 # celery.py
 import os
 from celery import Celery
+from celery.signals import celeryd_init
+from kombu import Queue
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'payment_file_upload.settings')
@@ -14,12 +16,51 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
 
-# Windows-specific configuration
+# Word-count lanes. Uploads a user is waiting on go to the small- or
+# large-file queue by size, so one big file never holds up the tiny ones
+# queued behind it; bulk uploads and backfill batches have a lane of their
+# own. Run a worker per lane (see WORD_COUNT_QUEUE_CONCURRENCY), or a single
+# worker without -Q to consume every queue.
+DEFAULT_QUEUE = 'celery'
+SMALL_FILES_QUEUE = 'word-count-small'
+LARGE_FILES_QUEUE = 'word-count-large'
+BULK_QUEUE = 'word-count-bulk'
+
+app.conf.update(
+    task_default_queue=DEFAULT_QUEUE,
+    task_queues=[Queue(name) for name in (DEFAULT_QUEUE, SMALL_FILES_QUEUE, LARGE_FILES_QUEUE, BULK_QUEUE)],
+    task_routes={
+        # Interactive uploads pick the lane by size when they are enqueued
+        'core.tasks.process_file_word_count_with_content': {'queue': SMALL_FILES_QUEUE},
+        'core.tasks.process_file_word_count_batch': {'queue': BULK_QUEUE},
+    },
+)
+
+# The worker pool and its sizing come from the CELERY_WORKER_* settings
 app.conf.update(
     task_serializer='json',
     accept_content=['json'],
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
-    worker_pool='solo'  # Use solo pool for Windows
-)
\ No newline at end of file
+)
+
+
+@celeryd_init.connect
+def size_worker_for_queues(conf=None, options=None, **kwargs):
+    """Default a worker's concurrency to the sum configured for the lanes it consumes
+
+    -c and CELERY_WORKER_CONCURRENCY still win. The config is namespaced, so
+    the value has to go under its CELERY_ key for the worker to see it.
+    """
+    from django.conf import settings
+
+    queues = options.get('queues') or []
+    if isinstance(queues, str):
+        queues = queues.split(',')
+    concurrency = settings.WORD_COUNT_QUEUE_CONCURRENCY
+    if options.get('concurrency') or conf.get('CELERY_WORKER_CONCURRENCY'):
+        return
+    if not queues or not all(queue in concurrency for queue in queues):
+        return
+    conf['CELERY_WORKER_CONCURRENCY'] = sum(concurrency[queue] for queue in queues)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import sys
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -47,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timing covers every other middleware
+    'core.metrics.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,13 +85,105 @@ WSGI_APPLICATION = 'payment_file_upload.wsgi.application'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
 # Database
+# SQLite by default. It holds one write lock for the whole file, so upload
+# inserts, task saves and activity logs queue behind each other under load;
+# set DB_ENGINE (e.g. django.db.backends.postgresql) and DB_NAME, DB_USER,
+# DB_PASSWORD, DB_HOST, DB_PORT for a server database in production.
+DB_ENGINE = os.getenv('DB_ENGINE', 'django.db.backends.sqlite3')
+DB_IS_SQLITE = DB_ENGINE == 'django.db.backends.sqlite3'
+
+if DB_IS_SQLITE:
+    PRIMARY_DATABASE = {
+        'ENGINE': DB_ENGINE,
+        'NAME': os.getenv('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        # Test against a file, not the shared in-memory database, so that
+        # concurrent connections wait on locks the way they do in production
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+        'OPTIONS': {},
+    }
+else:
+    PRIMARY_DATABASE = {
+        'ENGINE': DB_ENGINE,
+        'NAME': os.getenv('DB_NAME', 'payment_file_upload'),
+        'USER': os.getenv('DB_USER', ''),
+        'PASSWORD': os.getenv('DB_PASSWORD', ''),
+        'HOST': os.getenv('DB_HOST', 'localhost'),
+        'PORT': os.getenv('DB_PORT', ''),
+        'OPTIONS': {},
+    }
+
+# Seconds a connection is kept open and reused across requests (0 closes it
+# after each request); dead connections are detected before reuse
+PRIMARY_DATABASE['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', '0' if DB_IS_SQLITE else '60'))
+PRIMARY_DATABASE['CONN_HEALTH_CHECKS'] = True
+
+# PostgreSQL only: share a psycopg connection pool (pip install "psycopg[pool]")
+# between the threads of a process instead of one connection per thread
+if not DB_IS_SQLITE and os.getenv('DB_POOL', 'False').lower() == 'true':
+    PRIMARY_DATABASE['CONN_MAX_AGE'] = 0  # Django requires this with a pool
+    PRIMARY_DATABASE['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    }
+
 DATABASES = {
+    'default': PRIMARY_DATABASE,
+}
+
+# Read replicas: a comma-separated list of hosts for a server database, or of
+# file paths for SQLite (primary and replica as two local files, to check the
+# routing offline). Each becomes a replica_<n> alias. core.db_router sends
+# reads to them only where a view opts in; tests read them from the primary.
+DATABASE_REPLICAS = []
+for _index, _location in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1):
+    _alias = f'replica_{_index}'
+    DATABASES[_alias] = {
+        **PRIMARY_DATABASE,
+        'NAME' if DB_IS_SQLITE else 'HOST': _location.strip(),
+        'OPTIONS': dict(PRIMARY_DATABASE['OPTIONS']),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(_alias)
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+# SQLite concurrency (see core.sqlite_tuning): WAL so reads do not block the
+# writer, transactions that take the write lock up front, and a busy timeout
+# (ms) for writers waiting on it. synchronous=NORMAL is durable in WAL except
+# for the last commits before a power loss. The memory map (bytes) serves
+# reads from the page cache. Off by default: WAL is a persistent property of
+# the database file, and the checked-in db.sqlite3 should stay as it is.
+SQLITE_TUNING = os.getenv('SQLITE_TUNING', 'False').lower() == 'true'
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT = int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+# Word-count task saves queue on a lock shared by worker threads and processes
+# (a <db>-writelock file); on with the tuning unless set
+SQLITE_SERIALIZE_WRITES = os.getenv('SQLITE_SERIALIZE_WRITES', str(SQLITE_TUNING)).lower() == 'true'
+
+
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# cache (e.g. django.core.cache.backends.redis.RedisCache) in production
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'payment-file-upload'),
     }
 }
 
+# How long a "user has paid" answer stays cached (core/entitlements.py)
+ENTITLEMENT_CACHE_TIMEOUT = int(os.getenv('ENTITLEMENT_CACHE_TIMEOUT', str(24 * 60 * 60)))
+
+# Dashboard: rows shown per list, and lifetime of cached per-user fragments
+# (fragments are also invalidated whenever their data changes)
+DASHBOARD_LIST_LIMIT = int(os.getenv('DASHBOARD_LIST_LIMIT', '10'))
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', '300'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -157,15 +252,105 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
-# Windows-specific configuration
-CELERY_WORKER_POOL = 'solo'
+# Worker pool: prefork (a process per slot), threads or solo (one task at a
+# time). Prefork is the default, solo on Windows where prefork is unsupported.
+# The word-count task reads the file and then tokenises it in Python holding
+# the GIL, so only processes scale it across cores. Threads suit I/O-bound
+# lanes and save memory. Concurrency defaults to one slot per CPU.
+CELERY_WORKER_POOL = os.getenv('CELERY_WORKER_POOL', 'solo' if sys.platform == 'win32' else 'prefork')
+CELERY_WORKER_CONCURRENCY = int(os.getenv('CELERY_WORKER_CONCURRENCY', '0')) or None
+# Messages each slot reserves ahead. Task times range from milliseconds to
+# seconds, so 1 keeps short tasks from waiting behind a long one while another
+# slot is idle.
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', '1'))
+# Prefork only: replace a child after this many tasks, or after a task leaves
+# it above this resident size (KB). Parsing a large .docx can grow a child's
+# heap, and the memory is only released when the child is replaced.
+# 0 disables either limit.
+CELERY_WORKER_MAX_TASKS_PER_CHILD = int(os.getenv('CELERY_WORKER_MAX_TASKS_PER_CHILD', '500')) or None
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = int(os.getenv('CELERY_WORKER_MAX_MEMORY_PER_CHILD', str(256 * 1024))) or None
+
+# Word count processing
+# When batching is on, uploads are not enqueued one by one; the beat task
+# below coalesces pending uploads into messages of WORD_COUNT_BATCH_SIZE ids.
+WORD_COUNT_BATCHING = os.getenv('WORD_COUNT_BATCHING', 'False').lower() == 'true'
+WORD_COUNT_BATCH_SIZE = int(os.getenv('WORD_COUNT_BATCH_SIZE', '50'))
+WORD_COUNT_BATCH_WORKERS = int(os.getenv('WORD_COUNT_BATCH_WORKERS', '4'))
+
+# Interactive uploads of at least WORD_COUNT_LARGE_FILE_SIZE bytes are counted
+# on the large-file queue, smaller ones on the small-file queue (queues are
+# declared in celery_app.py). A worker started with -Q on these queues gets
+# the summed concurrency below unless -c is given.
+WORD_COUNT_LARGE_FILE_SIZE = int(os.getenv('WORD_COUNT_LARGE_FILE_SIZE', str(1024 * 1024)))
+WORD_COUNT_QUEUE_CONCURRENCY = {
+    'word-count-small': int(os.getenv('WORD_COUNT_SMALL_CONCURRENCY', '4')),
+    'word-count-large': int(os.getenv('WORD_COUNT_LARGE_CONCURRENCY', '1')),
+    'word-count-bulk': int(os.getenv('WORD_COUNT_BULK_CONCURRENCY', '2')),
+}
+
+# Text files of at least this many bytes are split into whitespace-aligned
+# byte ranges and counted in a process pool (0 disables). Prefork children
+# are daemonic and cannot start that pool, so it is off by default there.
+WORD_COUNT_PARALLEL_THRESHOLD = int(os.getenv(
+    'WORD_COUNT_PARALLEL_THRESHOLD',
+    '0' if CELERY_WORKER_POOL == 'prefork' else str(16 * 1024 * 1024),
+))
+WORD_COUNT_PARALLEL_WORKERS = int(os.getenv('WORD_COUNT_PARALLEL_WORKERS', str(os.cpu_count() or 1)))
+
+# Text statistics (lines, sentences, distinct and frequent words), gathered
+# in the same pass as the word count. That pass costs tens of times a plain
+# word count; set TEXT_STATS_ENABLED=False to only count words.
+# Distinct words are counted exactly up to the limit, then estimated;
+# frequent words are tracked in a summary of TEXT_STATS_SKETCH_SIZE counters.
+TEXT_STATS_ENABLED = os.getenv('TEXT_STATS_ENABLED', 'True').lower() == 'true'
+TEXT_STATS_TOP_WORDS = int(os.getenv('TEXT_STATS_TOP_WORDS', '10'))
+TEXT_STATS_SKETCH_SIZE = int(os.getenv('TEXT_STATS_SKETCH_SIZE', '1000'))
+TEXT_STATS_EXACT_DISTINCT_LIMIT = int(os.getenv('TEXT_STATS_EXACT_DISTINCT_LIMIT', '50000'))
+
+# Characters of each file's text kept (compressed) for GET /api/files/<id>/preview/
+# (0 disables). The file itself is only ever read from storage.
+FILE_PREVIEW_SIZE = int(os.getenv('FILE_PREVIEW_SIZE', '4096'))
+
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-pending-word-counts': {
+        'task': 'core.tasks.dispatch_pending_word_counts',
+        'schedule': float(os.getenv('WORD_COUNT_DISPATCH_INTERVAL', '2')),
+    },
+    'purge-stale-chunked-uploads': {
+        'task': 'core.tasks.purge_stale_chunked_uploads',
+        'schedule': 3600.0,
+    },
+}
+
+
+# Upload status event stream (core/events.py, /api/file-events/)
+FILE_STATUS_EVENT_TTL = int(os.getenv('FILE_STATUS_EVENT_TTL', '3600'))
+FILE_STATUS_EVENT_BACKLOG = int(os.getenv('FILE_STATUS_EVENT_BACKLOG', '100'))
+FILE_STATUS_STREAM_POLL_INTERVAL = float(os.getenv('FILE_STATUS_STREAM_POLL_INTERVAL', '0.5'))
+FILE_STATUS_STREAM_HEARTBEAT = float(os.getenv('FILE_STATUS_STREAM_HEARTBEAT', '15'))
+FILE_STATUS_STREAM_TIMEOUT = float(os.getenv('FILE_STATUS_STREAM_TIMEOUT', '300'))
+FILE_STATUS_STREAM_RETRY = float(os.getenv('FILE_STATUS_STREAM_RETRY', '3'))
+
+# Performance histograms (core/metrics.py, /api/metrics/ for staff users).
+# Each process pushes a snapshot to the cache at most every push interval.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_PUSH_INTERVAL = float(os.getenv('METRICS_PUSH_INTERVAL', '15'))
+METRICS_SNAPSHOT_TTL = int(os.getenv('METRICS_SNAPSHOT_TTL', '300'))
+
+# Activity logging (core/activity.py): 'sync', 'buffered' or 'celery'.
+# Buffered events are lost if the process is killed; payment events are
+# always written synchronously.
+ACTIVITY_LOG_BACKEND = os.getenv('ACTIVITY_LOG_BACKEND', 'sync')
+ACTIVITY_LOG_BUFFER_SIZE = int(os.getenv('ACTIVITY_LOG_BUFFER_SIZE', '100'))
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_LOG_FLUSH_INTERVAL', '1'))
 
 
 # aamarPay Configuration
 AAMARPAY_CONFIG = {
     'store_id': 'aamarpaytest',
     'signature_key': 'dbb74894e82415a2f7ff0ec3a97e4183',
-    'endpoint': 'https://sandbox.aamarpay.com/jsonpost.php',
+    # Point at `manage.py run_gateway_simulator` to test without the sandbox
+    'endpoint': os.getenv('AAMARPAY_ENDPOINT', 'https://sandbox.aamarpay.com/jsonpost.php'),
     'amount': 100,  # ৳100
     'currency': 'BDT',
     'success_url': 'http://localhost:8000/api/payment/success/',
@@ -173,6 +358,16 @@ AAMARPAY_CONFIG = {
     'cancel_url': 'http://localhost:8000/api/payment/cancel/',
 }
 
+# Shared keep-alive HTTP clients used to call the gateway (core/gateway.py)
+AAMARPAY_HTTP = {
+    'connect_timeout': float(os.getenv('AAMARPAY_CONNECT_TIMEOUT', '5')),
+    'read_timeout': float(os.getenv('AAMARPAY_READ_TIMEOUT', '30')),
+    'pool_timeout': float(os.getenv('AAMARPAY_POOL_TIMEOUT', '10')),
+    'max_connections': int(os.getenv('AAMARPAY_MAX_CONNECTIONS', '100')),
+    'max_keepalive_connections': int(os.getenv('AAMARPAY_MAX_KEEPALIVE_CONNECTIONS', '20')),
+    'keepalive_expiry': float(os.getenv('AAMARPAY_KEEPALIVE_EXPIRY', '30')),
+}
+
 # CORS settings
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
@@ -185,9 +380,20 @@ CSRF_COOKIE_SAMESITE = 'Lax'
 # File upload settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# Upper bound on files per request, i.e. per /api/files/bulk/ call
+DATA_UPLOAD_MAX_NUMBER_FILES = int(os.getenv('DATA_UPLOAD_MAX_NUMBER_FILES', '500'))
 FILE_UPLOAD_PERMISSIONS = 0o644
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o755
 
+# Uploads whose content digest matches an earlier upload by the same user
+# share its stored file
+FILE_UPLOAD_REUSE_DUPLICATES = os.getenv('FILE_UPLOAD_REUSE_DUPLICATES', 'True').lower() == 'true'
+
+# Chunked uploads (/api/uploads/) stream to disk, so their cap is independent
+# of the in-memory limits above; abandoned sessions are purged after the expiry
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', str(1024 * 1024 * 1024)))  # 1GB
+CHUNKED_UPLOAD_EXPIRY_HOURS = int(os.getenv('CHUNKED_UPLOAD_EXPIRY_HOURS', '24'))
+
 # Media settings
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file